@@ -0,0 +1,154 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+from functools import wraps
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+
+except ImportError:
+    fcntl = None
+
+from sushy_tools import error
+
+
+class StripedLock(object):
+    """Per-identity locks spread over a fixed number of stripes
+
+    Identities are hashed into `stripes` reentrant locks, so operations on
+    one identity are serialized while operations on most other identities
+    proceed in parallel. With a `path`, each stripe is additionally locked
+    with an `fcntl` byte range lock on that file, which serializes the
+    operations across processes too.
+
+    The time spent waiting for the locks is recorded in `stats`.
+    """
+
+    def __init__(self, stripes=64, path=None):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+        self._local = threading.local()
+        self._fd = None
+        if path:
+            if fcntl is None:
+                raise error.FishyError(
+                    'Inter-process locks are not supported on this platform')
+
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        self._stats_lock = threading.Lock()
+        self.stats = {'acquired': 0, 'contended': 0, 'wait_time': 0.0,
+                      'max_wait_time': 0.0}
+
+    def _stripe(self, identity):
+        # NOTE: hash() is randomized per process, which is no good for
+        # inter-process locks
+        return zlib.crc32(str(identity).encode()) % len(self._locks)
+
+    def _record(self, contended, wait_time):
+        with self._stats_lock:
+            self.stats['acquired'] += 1
+            self.stats['contended'] += contended
+            self.stats['wait_time'] += wait_time
+            self.stats['max_wait_time'] = max(
+                self.stats['max_wait_time'], wait_time)
+
+    @contextlib.contextmanager
+    def lock(self, identity):
+        """Lock an identity
+
+        :param identity: identity to lock, usually a system UUID
+        """
+        stripe = self._stripe(identity)
+        lock = self._locks[stripe]
+
+        start = time.monotonic()
+        contended = not lock.acquire(blocking=False)
+        if contended:
+            lock.acquire()
+
+        try:
+            depths = self._local.__dict__.setdefault('depths', {})
+            depth = depths.get(stripe, 0)
+            if self._fd is not None and not depth:
+                contended |= self._lock_file(stripe)
+
+            depths[stripe] = depth + 1
+            self._record(contended, time.monotonic() - start)
+
+            try:
+                yield
+
+            finally:
+                depths[stripe] = depth
+                if self._fd is not None and not depth:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+
+        finally:
+            lock.release()
+
+    def _lock_file(self, stripe):
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, stripe)
+            return False
+
+        except OSError:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            return True
+
+
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+
+
+def get(config):
+    """Get the locks shared by all drivers
+
+    :param config: emulator configuration
+    :returns: `StripedLock` object
+    """
+    path = None
+    if config.get('SUSHY_EMULATOR_INTERPROCESS_LOCKS'):
+        dbpath = (config.get('SUSHY_EMULATOR_STATE_DIR')
+                  or os.path.join(tempfile.gettempdir(), 'sushy-emulator'))
+        os.makedirs(dbpath, exist_ok=True)
+        path = os.path.join(dbpath, 'locks')
+
+    key = config.get('SUSHY_EMULATOR_LOCK_STRIPES', 64), path
+
+    with _LOCKS_LOCK:
+        try:
+            return _LOCKS[key]
+
+        except KeyError:
+            locks = _LOCKS[key] = StripedLock(*key)
+            return locks
+
+
+def locked(method):
+    """Serialize the decorated method per resource identity
+
+    The object of the method is expected to have the `_config` attribute,
+    and the method to take the resource identity as its first argument.
+    """
+
+    @wraps(method)
+    def wrapped(self, identity, *args, **kwargs):
+        with get(self._config).lock(identity):
+            return method(self, identity, *args, **kwargs)
+
+    return wrapped
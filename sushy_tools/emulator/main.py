@@ -313,7 +313,55 @@ def thermal_resource(identity):
     return app.render_template(
         'thermal.json',
         chassis=identity,
-        systems=systems
+        systems=systems,
+        metrics=_get_systems_metrics(systems)
+    )
+
+
+def _get_systems_metrics(systems):
+    metrics = {}
+
+    for system in systems:
+        try:
+            metrics[system] = app.systems.get_metrics(system)
+
+        except error.NotSupportedError:
+            metrics[system] = {}
+
+        except error.FishyError as e:
+            # NOTE: readings of one system must not fail the others
+            app.logger.warning(
+                'Failed getting metrics of system %s: %s', system, e)
+            metrics[system] = {}
+
+    return metrics
+
+
+@app.route('/redfish/v1/Chassis/<identity>/Power', methods=['GET'])
+@api_utils.returns_json
+def power_resource(identity):
+    if app.feature_set != "full":
+        raise error.FeatureNotAvailable("Chassis")
+
+    chassis = app.chassis
+
+    uuid = chassis.uuid(identity)
+
+    app.logger.debug(
+        'Serving power resources for chassis "%s"', identity)
+
+    # the first chassis gets all resources
+    if uuid == chassis.chassis[0]:
+        systems = app.systems.systems
+
+    else:
+        systems = []
+
+    return app.render_template(
+        'power.json',
+        chassis=identity,
+        systems=systems,
+        metrics=_get_systems_metrics(systems)
     )
 
 
@@ -490,7 +538,8 @@ def system_resource(identity):
             chassis=app.chassis.chassis[:1],
             indicator_led=app.indicators.get_indicator_state(
                 app.systems.uuid(identity)),
-            http_boot_uri=try_get(app.systems.get_http_boot_uri)
+            http_boot_uri=try_get(app.systems.get_http_boot_uri),
+            metrics_supported=try_get(app.systems.get_metrics) is not None
         )
 
     elif flask.request.method == 'PATCH':
@@ -678,14 +727,61 @@ def processor(identity, processor_id):
 
     processors = app.systems.get_processors(identity)
 
+    try:
+        metrics = app.systems.get_metrics(identity)
+    except error.NotSupportedError:
+        metrics = None
+
     for proc in processors:
         if proc['id'] == processor_id:
             return app.render_template(
-                'processor.json', identity=identity, processor=proc)
+                'processor.json', identity=identity, processor=proc,
+                metrics_supported=metrics is not None)
+
+    raise error.NotFound()
+
+
+@app.route('/redfish/v1/Systems/<identity>/Processors/<processor_id>'
+           '/ProcessorMetrics', methods=['GET'])
+@api_utils.ensure_instance_access
+@api_utils.returns_json
+def processor_metrics(identity, processor_id):
+    if app.feature_set != "full":
+        raise error.FeatureNotAvailable("Processors")
+
+    metrics = app.systems.get_metrics(identity)
+    processors = app.systems.get_processors(identity)
+
+    for index, proc in enumerate(processors):
+        if proc['id'] == processor_id:
+            vcpu_utilization = metrics.get('vcpu_utilization', [])
+            if index < len(vcpu_utilization):
+                utilization = vcpu_utilization[index]
+            else:
+                utilization = metrics.get('cpu_utilization')
+
+            return app.render_template(
+                'processor_metrics.json', identity=identity,
+                processor=proc, metrics=metrics,
+                utilization=utilization)
 
     raise error.NotFound()
 
 
+@app.route('/redfish/v1/Systems/<identity>/MemorySummary/MemoryMetrics',
+           methods=['GET'])
+@api_utils.ensure_instance_access
+@api_utils.returns_json
+def memory_metrics(identity):
+    if app.feature_set != "full":
+        raise error.FeatureNotAvailable("MemoryMetrics")
+
+    metrics = app.systems.get_metrics(identity)
+
+    return app.render_template(
+        'memory_metrics.json', identity=identity, metrics=metrics)
+
+
 @app.route('/redfish/v1/Systems/<identity>/Actions/ComputerSystem.Reset',
            methods=['POST'])
 @api_utils.ensure_instance_access
@@ -19,12 +19,18 @@ try:
 except ImportError:
     import collections
 
+import atexit
+import base64
+from collections import OrderedDict
 import contextlib
 from functools import wraps
+import json
 import os
 import pickle
 import sqlite3
 import tempfile
+import threading
+import time
 
 import tenacity
 
@@ -32,47 +38,226 @@ import tenacity
 MutableMapping = getattr(collections, 'abc', collections).MutableMapping
 
 
-def memoize(permanent_cache=None):
+_ALL = object()
+
+
+class LRUCache(object):
+    """Cache of the return values of a memoized method
+
+    Entries are evicted in the least recently used order once there are
+    more than `max_size` of them, and are expired `ttl` seconds after
+    being stored.
+
+    :param max_size: maximum number of entries, unbounded if not given
+    :param ttl: time to live of the entries in seconds, forever if not
+        given
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        # generation of the shared values the entries are consistent with
+        self.generation = None
+
+    def get(self, key):
+        """Get a cached value
+
+        :param key: entry key
+        :returns: the cached value
+        :raises: `KeyError` if there is no valid entry for the key
+        """
+        with self._lock:
+            try:
+                value, expires = self._entries[key]
+
+            except KeyError:
+                self.stats['misses'] += 1
+                raise
+
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                self.stats['evictions'] += 1
+                self.stats['misses'] += 1
+                raise KeyError(key)
+
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def put(self, key, value):
+        """Cache a value
+
+        :param key: entry key
+        :param value: value to cache
+        """
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+
+        with self._lock:
+            self._entries[key] = value, expires
+            self._entries.move_to_end(key)
+
+            while (self.max_size is not None
+                   and len(self._entries) > self.max_size):
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, key=_ALL):
+        """Drop a cached value
+
+        :param key: entry key, all entries are dropped if not given
+        """
+        with self._lock:
+            if key is _ALL:
+                self._entries.clear()
+
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _make_key(args, kwargs):
+    # NOTE: keyword arguments are sorted as they may come in any order,
+    # positional arguments are not
+    return args, tuple(sorted(kwargs.items()))
+
+
+def memoize(permanent_cache=None, max_size=None, ttl=None, shared=None):
     """Cache the return value of the decorated method.
 
     :param permanent_cache: a `dict` like object to use as a cache.
         If not given, the `._cache` attribute would be added to
         the object of the decorated method pointing to a newly
         created `dict`.
+    :param max_size: maximum number of cached values of the decorated
+        method, the least recently used ones are evicted first. The
+        shared values are bounded to the most recently shared ones.
+        Unbounded if not given.
+    :param ttl: time in seconds to cache the values for, forever if
+        not given.
+    :param shared: whether to share the cached values with the other
+        emulator processes when the `SUSHY_EMULATOR_SHARED_CACHE` option
+        is set in the `._config` attribute of the object. Either `True`
+        for picklable values, or a pair of functions to convert the values
+        to and from picklable data, called with the object and the value.
     :return: decorated function
     """
+    dump = load = None
+    if shared and shared is not True:
+        dump, load = shared
 
     def decorator(method):
 
-        @wraps(method)
-        def wrapped(self, *args, **kwargs):
+        scope = '%s.%s' % (method.__module__, method.__qualname__)
+
+        def method_cache(obj):
             if permanent_cache is None:
                 try:
-                    cache = self._cache
+                    cache = obj._cache
 
                 except AttributeError:
-                    cache = self._cache = {}
+                    cache = obj._cache = {}
 
             else:
                 cache = permanent_cache
 
-            method_cache = cache.setdefault(method, {})
+            try:
+                return cache[method]
+
+            except KeyError:
+                return cache.setdefault(method, LRUCache(max_size, ttl))
+
+        def get_shared_cache(obj):
+            if shared:
+                return get_shared(getattr(obj, '_config', {}))
+
+        @wraps(method)
+        def wrapped(self, *args, **kwargs):
+            cache = method_cache(self)
+            key = _make_key(args, kwargs)
 
-            key = frozenset(args), frozenset(kwargs)
+            shared_cache = get_shared_cache(self)
+            if shared_cache is not None:
+                # NOTE: drop the values invalidated by any process
+                generation = shared_cache.generation(scope)
+                if cache.generation != generation:
+                    cache.invalidate()
+                    cache.generation = generation
 
             try:
-                return method_cache[key]
+                return cache.get(key)
 
             except KeyError:
-                rv = method(self, *args, **kwargs)
-                method_cache[key] = rv
-                return rv
+                pass
+
+            if shared_cache is not None:
+                try:
+                    rv = shared_cache.get(scope, key)
+
+                except KeyError:
+                    pass
+
+                else:
+                    rv = rv if load is None else load(self, rv)
+                    cache.put(key, rv)
+                    return rv
+
+            rv = method(self, *args, **kwargs)
+            cache.put(key, rv)
+
+            if shared_cache is not None:
+                shared_cache.put(scope, key,
+                                 rv if dump is None else dump(self, rv),
+                                 generation, ttl, max_size)
+
+            return rv
+
+        wrapped.method_cache = method_cache
+        wrapped.get_shared_cache = get_shared_cache
+        wrapped.scope = scope
 
         return wrapped
 
     return decorator
 
 
+def invalidate(method, *args, **kwargs):
+    """Drop the cached return value of a memoized method
+
+    Drivers are expected to call this when they change the resource
+    a memoized value describes. Shared values are dropped in all the
+    emulator processes.
+
+    :param method: bound memoized method
+    :param args: positional arguments of the call to drop, all cached
+        values of the method are dropped if no arguments are given
+    :param kwargs: keyword arguments of the call to drop
+    """
+    cache = method.__func__.method_cache(method.__self__)
+    shared_cache = method.__func__.get_shared_cache(method.__self__)
+    key = _make_key(args, kwargs) if args or kwargs else _ALL
+
+    cache.invalidate(key)
+
+    if shared_cache is not None:
+        shared_cache.invalidate(method.__func__.scope, key)
+
+
+def cache_info(method):
+    """Get the statistics of a memoized method cache
+
+    :param method: bound memoized method
+    :returns: a `dict` with the `hits`, `misses`, `evictions` counters
+        and the current `size` of the cache
+    """
+    cache = method.__func__.method_cache(method.__self__)
+    return dict(cache.stats, size=len(cache))
+
+
 _retry = tenacity.retry(
     retry=tenacity.retry_if_exception_type(sqlite3.OperationalError),
     wait=tenacity.wait_exponential(min=0.1, max=2, multiplier=1),
@@ -80,11 +265,140 @@ _retry = tenacity.retry(
     reraise=True)
 
 
+class PickleCodec(object):
+    """Pickle encoding, used by the state databases of older releases"""
+
+    name = 'pickle'
+
+    @staticmethod
+    def encode(obj):
+        return pickle.dumps(obj)
+
+    @staticmethod
+    def decode(blob):
+        return pickle.loads(blob)
+
+
+class JSONCodec(object):
+    """Canonical, compact JSON encoding
+
+    Equal objects are always encoded the same way, so encoded keys can be
+    compared as is, and the databases can be inspected with the usual
+    sqlite tools. Types JSON lacks are encoded as single key objects with
+    the key telling the type:
+
+    * `!t` - tuple, as a list of the items
+    * `!s` - set, as a list of the items in the order of their encoding
+    * `!f` - frozenset, likewise
+    * `!b` - bytes, as a base64 string
+    * `!d` - dict with non-string keys or keys starting with `!`, as a list
+      of key and value pairs in the order of the key encoding
+    * `!p` - anything else, as a base64 string of the pickled object
+    """
+
+    name = 'json'
+
+    def _sorted(self, items):
+        return sorted(items, key=self.encode)
+
+    _SCALARS = frozenset([str, int, float, bool, type(None)])
+
+    def _tag(self, obj):
+        # NOTE: subclasses, e.g. named tuples, are pickled to keep their type
+        kind = type(obj)
+        if kind in self._SCALARS:
+            return obj
+
+        if kind is list:
+            return [self._tag(item) for item in obj]
+
+        if kind is dict:
+            for key in obj:
+                if type(key) is not str or key.startswith('!'):
+                    return {'!d': [[self._tag(key), self._tag(obj[key])]
+                                   for key in self._sorted(obj)]}
+
+            return {key: self._tag(value) for key, value in obj.items()}
+
+        if kind is tuple:
+            return {'!t': [self._tag(item) for item in obj]}
+
+        if kind in (set, frozenset):
+            tag = '!f' if kind is frozenset else '!s'
+            return {tag: [self._tag(item) for item in self._sorted(obj)]}
+
+        if kind is bytes:
+            return {'!b': base64.b64encode(obj).decode('ascii')}
+
+        return {'!p': base64.b64encode(pickle.dumps(obj)).decode('ascii')}
+
+    @staticmethod
+    def _untag(obj):
+        if len(obj) != 1:
+            return obj
+
+        (tag, value), = obj.items()
+        if tag == '!t':
+            return tuple(value)
+
+        if tag == '!s':
+            return set(value)
+
+        if tag == '!f':
+            return frozenset(value)
+
+        if tag == '!b':
+            return base64.b64decode(value)
+
+        if tag == '!d':
+            return {key: item for key, item in value}
+
+        if tag == '!p':
+            return pickle.loads(base64.b64decode(value))
+
+        return obj
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(
+            sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        self._decoder = json.JSONDecoder(object_hook=self._untag)
+
+    def encode(self, obj):
+        return self._encoder.encode(self._tag(obj))
+
+    def decode(self, blob):
+        return self._decoder.decode(blob)
+
+
+CODECS = {codec.name: codec for codec in (PickleCodec(), JSONCodec())}
+
+
 class PersistentDict(MutableMapping):
+    """Dict-like object stored in an sqlite database
+
+    Values read from the database are kept pickled in memory, and served
+    from there until the database changes, be it by this or any other
+    process.
+
+    :param codec: name of the codec to encode the keys and values with,
+        see `CODECS`. Databases encoded with another codec, or created
+        before the codec was recorded in them, are converted on
+        `make_permanent`.
+    """
+
     DBPATH = os.path.join(tempfile.gettempdir(), 'sushy-emulator')
 
     _dbpath = None
 
+    def __init__(self, codec='json'):
+        self._codec = CODECS[codec]
+        self._read_lock = threading.Lock()
+        self._read_cache = {}
+        self._read_version = None
+        self._check_connection = None
+        self._check_pid = None
+
+    @_retry
     def make_permanent(self, dbpath, dbfile):
         dbpath = dbpath or self.DBPATH
         os.makedirs(dbpath, exist_ok=True)
@@ -96,14 +410,58 @@ class PersistentDict(MutableMapping):
                 'create table if not exists cache '
                 '(key blob primary key not null, value blob not null)'
             )
+            cursor.execute(
+                'create table if not exists meta '
+                '(key text primary key not null, value text not null)'
+            )
+            self._migrate(cursor)
 
-    @staticmethod
-    def encode(obj):
-        return pickle.dumps(obj)
+    def _stored_codec(self, cursor):
+        cursor.execute("select value from meta where key='codec'")
+        row = cursor.fetchone()
 
-    @staticmethod
-    def decode(blob):
-        return pickle.loads(blob)
+        if row is None:
+            # NOTE: databases of the older releases are pickled
+            return CODECS[PickleCodec.name]
+
+        elif row[0] in CODECS:
+            return CODECS[row[0]]
+
+        else:
+            raise TypeError('Unknown codec %s of %s' % (row[0], self._dbpath))
+
+    def _migrate(self, cursor):
+        # NOTE: only take the write lock when there is something to convert
+        if self._stored_codec(cursor) is self._codec:
+            return
+
+        # NOTE: lock the database so that only one process converts it
+        cursor.execute('begin immediate')
+        codec = self._stored_codec(cursor)
+        if codec is self._codec:
+            return
+
+        cursor.execute('select key, value from cache')
+        records = [(self.encode(codec.decode(k)),
+                    self.encode(codec.decode(v)))
+                   for k, v in cursor.fetchall()]
+
+        cursor.execute('delete from cache')
+        cursor.executemany(
+            'insert into cache values (?, ?)',
+            records
+        )
+
+        cursor.execute(
+            "insert or replace into meta values ('codec', ?)",
+            (self._codec.name,)
+        )
+
+    def encode(self, obj):
+        return self._codec.encode(obj)
+
+    def decode(self, blob):
+        return self._codec.decode(blob)
 
     @contextlib.contextmanager
     def connection(self):
@@ -114,10 +472,33 @@ class PersistentDict(MutableMapping):
             connection.execute("pragma journal_mode=wal")
             yield connection.cursor()
 
+    def _version(self):
+        # NOTE: data_version of a connection changes whenever any other
+        # connection, in this process or not, commits to the database
+        if self._check_pid != os.getpid():
+            self._check_connection = sqlite3.connect(
+                self._dbpath, check_same_thread=False)
+            self._check_pid = os.getpid()
+
+        return self._check_connection.execute(
+            'pragma data_version').fetchone()[0]
+
     @_retry
     def __getitem__(self, key):
         key = self.encode(key)
 
+        with self._read_lock:
+            version = self._version()
+            if version != self._read_version:
+                self._read_cache = {}
+                self._read_version = version
+
+            try:
+                return pickle.loads(self._read_cache[key])
+
+            except KeyError:
+                pass
+
         with self.connection() as cursor:
             cursor.execute(
                 'select value from cache where key=?',
@@ -128,7 +509,15 @@ class PersistentDict(MutableMapping):
         if value is None:
             raise KeyError(key)
 
-        return self.decode(value[0])
+        # NOTE: unpickling is faster than decoding most codecs
+        value = self.decode(value[0])
+        blob = pickle.dumps(value)
+
+        with self._read_lock:
+            if version == self._read_version:
+                self._read_cache[key] = blob
+
+        return value
 
     @_retry
     def __setitem__(self, key, value):
@@ -172,3 +561,353 @@ class PersistentDict(MutableMapping):
             )
             count = cursor.fetchone()[0]
             return count
+
+    @_retry
+    def items(self):
+        with self.connection() as cursor:
+            cursor.execute(
+                'select key, value from cache'
+            )
+            records = cursor.fetchall()
+
+        return [(self.decode(k), self.decode(v)) for k, v in records]
+
+    @_retry
+    def update(self, other=(), /, **kwargs):
+        records = [(self.encode(k), self.encode(v))
+                   for k, v in dict(other, **kwargs).items()]
+
+        with self.connection() as cursor:
+            cursor.executemany(
+                'insert or replace into cache values (?, ?)',
+                records
+            )
+
+    @_retry
+    def write(self, changed, deleted=()):
+        """Store and delete records in a single transaction
+
+        :param changed: `dict` of the records to store
+        :param deleted: keys of the records to delete, keys not in the
+            dict are ignored
+        """
+        records = [(self.encode(k), self.encode(v))
+                   for k, v in changed.items()]
+        keys = [(self.encode(k),) for k in deleted]
+
+        with self.connection() as cursor:
+            cursor.executemany(
+                'insert or replace into cache values (?, ?)',
+                records
+            )
+            cursor.executemany(
+                'delete from cache where key=?',
+                keys
+            )
+
+
+class WriteBackDict(MutableMapping):
+    """In-memory dict writing changes back to another dict-like store
+
+    Values are kept pickled, so callers always get a private copy to work
+    on and the in-memory copy stays compact. Changed and deleted keys are
+    written to the store in one batch every `interval` seconds and when
+    the dict is closed, which happens at the latest on interpreter exit.
+
+    :param store: dict-like object to write the changes to
+    :param interval: seconds between writes to the store
+    :param data: initial contents of the store if already known, to save
+        reading them from the store
+    :param logger: logger object to report failed writes to
+    """
+
+    def __init__(self, store, interval, data=None, logger=None):
+        self._store = store
+        self._interval = interval
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._data = {
+            key: pickle.dumps(value)
+            for key, value in (store.items() if data is None
+                               else data.items())
+        }
+        self._dirty = set()
+        self._deleted = set()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __getitem__(self, key):
+        return pickle.loads(self._data[key])
+
+    def __setitem__(self, key, value):
+        blob = pickle.dumps(value)
+
+        with self._lock:
+            self._data[key] = blob
+            self._dirty.add(key)
+            self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+            self._dirty.discard(key)
+            self._deleted.add(key)
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def flush(self):
+        """Write pending changes to the store"""
+        with self._lock:
+            changed = {key: self._data[key] for key in self._dirty}
+            deleted = self._deleted
+            self._dirty = set()
+            self._deleted = set()
+
+        try:
+            values = {key: pickle.loads(blob) for key, blob in changed.items()}
+            # NOTE: stores like PersistentDict write everything at once
+            write = getattr(self._store, 'write', None)
+            if write is not None:
+                if values or deleted:
+                    write(values, deleted)
+
+            else:
+                if values:
+                    self._store.update(values)
+
+                for key in deleted:
+                    self._store.pop(key, None)
+
+        except Exception:
+            # NOTE: keep the changes pending unless they got superseded
+            with self._lock:
+                self._dirty.update(key for key in changed
+                                   if key in self._data)
+                self._deleted.update(key for key in deleted
+                                     if key not in self._data)
+            raise
+
+    def _flush_loop(self):
+        while not self._closed.wait(self._interval):
+            try:
+                self.flush()
+
+            except Exception as exc:
+                if self._logger:
+                    self._logger.error(
+                        'Failed to write back %d changes: %s',
+                        len(self._dirty) + len(self._deleted), exc)
+
+    def close(self):
+        """Stop writing back periodically and write pending changes"""
+        if not self._closed.is_set():
+            self._closed.set()
+            self._thread.join()
+            atexit.unregister(self.close)
+
+        self.flush()
+
+
+class SharedCache(object):
+    """Memoized values shared by the emulator processes
+
+    Values are kept pickled in an sqlite database, tagged with the
+    generation of their scope (the memoized method) at the time the value
+    was looked up. Invalidating a value bumps the generation of its scope,
+    which makes the values looked up before invalidation unusable and tells
+    the other processes to drop their own copies of the scope values.
+
+    :param path: path to the sqlite database
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._generations = {}
+        self._version = None
+        self._check_connection = None
+        self._check_pid = None
+
+        with self.connection() as cursor:
+            cursor.execute(
+                'create table if not exists generations '
+                '(scope text primary key not null, '
+                'generation integer not null)'
+            )
+            cursor.execute(
+                'create table if not exists entries '
+                '(scope text not null, key text not null, '
+                'value blob not null, generation integer not null, '
+                'expires real, primary key (scope, key))'
+            )
+
+    @contextlib.contextmanager
+    def connection(self):
+        with sqlite3.connect(self._path) as connection:
+            connection.execute("pragma journal_mode=wal")
+            yield connection.cursor()
+
+    def _data_version(self):
+        # NOTE: data_version of a connection changes whenever any other
+        # connection, in this process or not, commits to the database
+        if self._check_pid != os.getpid():
+            self._check_connection = sqlite3.connect(
+                self._path, check_same_thread=False)
+            self._check_pid = os.getpid()
+
+        return self._check_connection.execute(
+            'pragma data_version').fetchone()[0]
+
+    @_retry
+    def generation(self, scope):
+        """Get the current generation of a scope
+
+        Generations are only looked up again once the database changes.
+
+        :param scope: scope of the values, usually a memoized method name
+        :returns: generation number
+        """
+        with self._lock:
+            version = self._data_version()
+            if version != self._version:
+                self._generations = {}
+                self._version = version
+
+            try:
+                return self._generations[scope]
+
+            except KeyError:
+                pass
+
+            with self.connection() as cursor:
+                cursor.execute(
+                    'select generation from generations where scope=?',
+                    (scope,)
+                )
+                row = cursor.fetchone()
+
+            generation = self._generations[scope] = row[0] if row else 0
+            return generation
+
+    @_retry
+    def get(self, scope, key):
+        """Get a shared value
+
+        :param scope: scope of the value
+        :param key: key of the value within the scope
+        :returns: the shared value
+        :raises: `KeyError` if there is no valid value for the key
+        """
+        with self.connection() as cursor:
+            cursor.execute(
+                'select value from entries left join generations '
+                'using (scope) where scope=? and key=? and '
+                'entries.generation=coalesce(generations.generation, 0) '
+                'and (expires is null or expires>?)',
+                (scope, repr(key), time.time())
+            )
+            row = cursor.fetchone()
+
+        if row is None:
+            raise KeyError(key)
+
+        return pickle.loads(row[0])
+
+    @_retry
+    def put(self, scope, key, value, generation, ttl=None, max_size=None):
+        """Share a value
+
+        Expired and invalidated values of the scope are purged, as well as
+        the oldest values beyond `max_size`.
+
+        :param scope: scope of the value
+        :param key: key of the value within the scope
+        :param value: value to share
+        :param generation: generation of the scope at the time the value
+            was looked up, values looked up before an invalidation are
+            never returned
+        :param ttl: time in seconds to share the value for, forever if
+            not given
+        :param max_size: maximum number of values of the scope, unbounded
+            if not given
+        """
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+
+        with self.connection() as cursor:
+            cursor.execute(
+                'insert or replace into entries values (?, ?, ?, ?, ?)',
+                (scope, repr(key), pickle.dumps(value), generation, expires)
+            )
+            cursor.execute(
+                'delete from entries where scope=? and (expires<=? or '
+                'generation<(select coalesce(max(generation), 0) '
+                'from generations where scope=?))',
+                (scope, now, scope)
+            )
+
+            if max_size is not None:
+                # NOTE: replaced rows get a new rowid, so rowid order is
+                # the order the values were shared in
+                cursor.execute(
+                    'delete from entries where scope=? and rowid not in '
+                    '(select rowid from entries where scope=? '
+                    'order by rowid desc limit ?)',
+                    (scope, scope, max_size)
+                )
+
+    @_retry
+    def invalidate(self, scope, key=_ALL):
+        """Drop a shared value in all processes
+
+        :param scope: scope of the value
+        :param key: key of the value within the scope, all values of the
+            scope are dropped if not given
+        """
+        with self.connection() as cursor:
+            if key is _ALL:
+                cursor.execute(
+                    'delete from entries where scope=?', (scope,))
+
+            else:
+                cursor.execute(
+                    'delete from entries where scope=? and key=?',
+                    (scope, repr(key)))
+
+            cursor.execute(
+                'insert into generations values (?, 1) on conflict (scope) '
+                'do update set generation=generation+1',
+                (scope,)
+            )
+
+
+_SHARED = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def get_shared(config):
+    """Get the cache shared by the emulator processes
+
+    :param config: emulator configuration
+    :returns: `SharedCache` object or `None` if sharing is not enabled
+    """
+    if not config.get('SUSHY_EMULATOR_SHARED_CACHE'):
+        return
+
+    dbpath = config.get('SUSHY_EMULATOR_STATE_DIR') or PersistentDict.DBPATH
+    path = os.path.join(dbpath, 'memoize.sqlite')
+
+    with _SHARED_LOCK:
+        try:
+            return _SHARED[path]
+
+        except KeyError:
+            os.makedirs(dbpath, exist_ok=True)
+            shared_cache = _SHARED[path] = SharedCache(path)
+            return shared_cache
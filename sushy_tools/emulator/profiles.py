@@ -0,0 +1,202 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import fnmatch
+from functools import wraps
+import math
+import random
+import time
+
+from sushy_tools import error
+
+
+class Latency(object):
+    """Random latency following a distribution
+
+    :param spec: latency specification, a `dict` with the `distribution`
+        key and the parameters of the distribution:
+
+        * `fixed` - `value`
+        * `uniform` - `min` and `max`
+        * `lognormal` - `median` and `sigma`
+        * `histogram` - `buckets`, a list of `[upper_bound, count]` pairs
+          sorted by the upper bound, e.g. as recorded from a real BMC;
+          latencies are spread evenly within a bucket
+
+        All latencies are in seconds.
+    """
+
+    def __init__(self, spec, rng=random):
+        self._rng = rng
+        distribution = spec.get('distribution', 'fixed')
+
+        init = getattr(self, '_init_%s' % distribution, None)
+        if init is None:
+            raise error.FishyError(
+                'Unknown latency distribution %s' % distribution)
+
+        try:
+            self._sample = init(spec)
+
+        except (KeyError, TypeError, ValueError) as exc:
+            raise error.FishyError(
+                'Invalid %s latency distribution %s: %s'
+                % (distribution, spec, exc))
+
+    def _init_fixed(self, spec):
+        value = float(spec['value'])
+        return lambda: value
+
+    def _init_uniform(self, spec):
+        low, high = float(spec['min']), float(spec['max'])
+        return lambda: self._rng.uniform(low, high)
+
+    def _init_lognormal(self, spec):
+        mu, sigma = math.log(spec['median']), float(spec['sigma'])
+        return lambda: self._rng.lognormvariate(mu, sigma)
+
+    def _init_histogram(self, spec):
+        bounds = [0.0]
+        totals = []
+        total = 0
+        for upper_bound, count in spec['buckets']:
+            total += count
+            bounds.append(float(upper_bound))
+            totals.append(total)
+
+        if not total:
+            raise ValueError('no samples')
+
+        def sample():
+            bucket = bisect.bisect_right(totals, self._rng.random() * total)
+            return self._rng.uniform(bounds[bucket], bounds[bucket + 1])
+
+        return sample
+
+    def sample(self):
+        """Draw a latency in seconds"""
+        return max(0.0, self._sample())
+
+
+class Profile(object):
+    """Latency and failure rate of a driver method
+
+    :param spec: profile specification, a `dict` with the optional keys
+        `latency` (see `Latency`), `error_rate` (a probability between 0
+        and 1) and `error_code` (HTTP status code of the errors, 500 by
+        default)
+    """
+
+    def __init__(self, spec, rng=random):
+        self._rng = rng
+        self._latency = (Latency(spec['latency'], rng)
+                         if spec.get('latency') else None)
+        self._error_rate = spec.get('error_rate', 0)
+        self._error_code = spec.get('error_code', 500)
+
+    def apply(self, method, identity):
+        """Delay and possibly fail a driver method call
+
+        Delaying sleeps the calling thread, which only yields to other
+        requests under a threaded or green-threaded server.
+
+        :param method: driver method name
+        :param identity: resource identity the method is called for
+        :raises: `FishyError` when the call is chosen to fail
+        """
+        if self._latency is not None:
+            time.sleep(self._latency.sample())
+
+        if self._error_rate and self._rng.random() < self._error_rate:
+            raise error.FishyError(
+                'Injected failure of %s for %s' % (method, identity),
+                code=self._error_code)
+
+
+class Profiles(object):
+    """Latency and failure profiles of driver methods by resource
+
+    :param groups: list of profile groups, each a `dict` with the keys:
+
+        * `systems` - list of `fnmatch` patterns of the resource identities
+          the group applies to, all resources if not given
+        * `methods` - `dict` of driver method names (or `*` for any
+          method) and their profiles (see `Profile`)
+
+        The first group matching the identity and having a profile for the
+        method (or a `*` one) applies.
+    """
+
+    def __init__(self, groups, rng=random):
+        self._groups = [
+            (group.get('systems') or ['*'],
+             {method: Profile(spec, rng)
+              for method, spec in group.get('methods', {}).items()})
+            for group in groups
+        ]
+
+    def get(self, method, identity):
+        """Find the profile of a driver method call
+
+        :param method: driver method name
+        :param identity: resource identity the method is called for
+        :returns: `Profile` object or `None`
+        """
+        for patterns, methods in self._groups:
+            if not any(fnmatch.fnmatchcase(identity, pattern)
+                       for pattern in patterns):
+                continue
+
+            profile = methods.get(method) or methods.get('*')
+            if profile is not None:
+                return profile
+
+    def apply(self, method, identity):
+        """Delay and possibly fail a driver method call
+
+        :param method: driver method name
+        :param identity: resource identity the method is called for
+        :raises: `FishyError` when the call is chosen to fail
+        """
+        profile = self.get(method, identity)
+        if profile is not None:
+            profile.apply(method, identity)
+
+
+def load(config):
+    """Load profiles from the emulator configuration
+
+    :param config: emulator configuration
+    :returns: `Profiles` object or `None` if no profiles are configured
+    """
+    groups = config.get('SUSHY_EMULATOR_FAKE_PROFILES')
+    if groups:
+        return Profiles(groups)
+
+
+def profiled(method):
+    """Apply the latency and failure profile to the decorated method
+
+    The object of the method is expected to have the `_profiles`
+    attribute, and the method to take the resource identity as its
+    first argument.
+    """
+
+    @wraps(method)
+    def wrapped(self, identity, *args, **kwargs):
+        if self._profiles is not None:
+            self._profiles.apply(method.__name__, identity)
+
+        return method(self, identity, *args, **kwargs)
+
+    return wrapped
@@ -255,6 +255,14 @@ class AbstractSystemsDriver(metaclass=abc.ABCMeta):
         """
         raise error.NotSupportedError('Not implemented')
 
+    def get_metrics(self, identity):
+        """Get live utilization readings of the system
+
+        :returns: dict of readings such as CPU and memory utilization,
+            power consumption and CPU temperature
+        """
+        raise error.NotSupportedError('Not implemented')
+
     def find_or_create_storage_volume(self, data):
         """Find/create volume based on existence in the virtualization backend
 
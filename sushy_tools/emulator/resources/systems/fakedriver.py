@@ -10,24 +10,401 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import atexit
 import copy
+import heapq
+import queue
 import random
+import re
+import string
+import threading
 import time
+import uuid
 
 import requests
+import tenacity
 
+from sushy_tools.emulator import locks
 from sushy_tools.emulator import memoize
+from sushy_tools.emulator import profiles
 from sushy_tools.emulator.resources.systems.base import AbstractSystemsDriver
 from sushy_tools import error
 
 DEFAULT_UUID = '27946b59-9e44-4fa7-8e91-f3527a1ef094'
 
+# Namespace of the UUIDs of generated systems
+GENERATOR_NAMESPACE = uuid.UUID('5a4d2b9e-6c3f-4f0e-9d1a-8b7c6e5f4a3b')
+
+# Bits of the generated system UUIDs holding the system index
+GENERATOR_INDEX_MASK = (1 << 32) - 1
+
+
+class SystemGenerator(object):
+    """Deterministic generator of fake systems
+
+    Systems are numbered from 0 to `count - 1`. Everything about a system
+    is derived from its index and the generator seed, so that any system
+    can be generated, and its UUID or name resolved back to its index,
+    without generating the others.
+
+    :param spec: generator specification, a `dict` with the keys:
+
+        * `count` - number of systems
+        * `name_pattern` - `str.format` pattern of system names with an
+          `index` field, `fake-{index}` by default
+        * `seed` - seed of the UUIDs, MAC addresses and random choices
+        * `nics` - number of NICs of each system, 1 by default
+        * `power_states` - `dict` of power states and their weights,
+          `Off` by default
+        * `boot_modes` - `dict` of boot modes and their weights, `UEFI`
+          by default
+        * `external_notifier` - whether to send external notifications
+          about the systems
+    """
+
+    def __init__(self, spec):
+        self._count = spec['count']
+        self._name_pattern = spec.get('name_pattern', 'fake-{index}')
+        self._seed = str(spec.get('seed', ''))
+        self._nics = spec.get('nics', 1)
+        self._power_states = spec.get('power_states', {'Off': 1})
+        self._boot_modes = spec.get('boot_modes', {'UEFI': 1})
+        self._external_notifier = spec.get('external_notifier', False)
+
+        # NOTE: MAC addresses leave 32 bits to number the NICs with
+        if self._count * max(self._nics, 1) > 1 << 32:
+            raise error.FishyError(
+                'Cannot generate more than %d fake system NICs' % (1 << 32))
+
+        self._uuid_base = (uuid.uuid5(GENERATOR_NAMESPACE, self._seed).int
+                           & ~GENERATOR_INDEX_MASK)
+        self._uuid_prefix = str(uuid.UUID(int=self._uuid_base))[:-8]
+        self._mac_prefix = self._uuid_base >> 120
+
+        regex = ''
+        fields = 0
+        for literal, field, _spec, _conv in string.Formatter().parse(
+                self._name_pattern):
+            regex += re.escape(literal)
+            if field is not None:
+                if field != 'index':
+                    raise error.FishyError(
+                        'Unknown field %s in fake system name pattern %s'
+                        % (field, self._name_pattern))
+                regex += r'(\d+)'
+                fields += 1
+
+        if fields != 1:
+            raise error.FishyError(
+                'Fake system name pattern %s must contain a single {index} '
+                'field' % self._name_pattern)
+
+        self._name_regex = re.compile(regex)
+
+    def __len__(self):
+        return self._count
+
+    def uuid(self, index):
+        """Get system UUID by index"""
+        return '%s%08x' % (self._uuid_prefix, index)
+
+    def uuids(self):
+        """Iterate over system UUIDs"""
+        for index in range(self._count):
+            yield self.uuid(index)
+
+    def name(self, index):
+        """Get system name by index"""
+        return self._name_pattern.format(index=index)
+
+    def index(self, identity):
+        """Get system index by UUID
+
+        :param identity: system UUID
+        :returns: system index or `None` if the UUID is not of a generated
+            system
+        """
+        try:
+            value = uuid.UUID(identity).int
+
+        except ValueError:
+            return
+
+        index = value & GENERATOR_INDEX_MASK
+        if (value & ~GENERATOR_INDEX_MASK == self._uuid_base
+                and index < self._count and self.uuid(index) == identity):
+            return index
+
+    def index_by_name(self, name):
+        """Get system index by name
+
+        :param name: system name
+        :returns: system index or `None` if the name is not of a generated
+            system
+        """
+        match = self._name_regex.fullmatch(name)
+        if match is None:
+            return
+
+        index = int(match.group(1))
+        if index < self._count and self.name(index) == name:
+            return index
+
+    def generate(self, index):
+        """Generate system by index
+
+        :param index: system index
+        :returns: system `dict` as in `SUSHY_EMULATOR_FAKE_SYSTEMS`
+        """
+        rng = random.Random('%s-%d' % (self._seed, index))
+
+        nics = []
+        for nic in range(self._nics):
+            mac = (self._mac_prefix << 32) | (index * self._nics + nic)
+            nics.append({
+                'mac': ':'.join(['02'] + ['%02x' % octet for octet in
+                                          mac.to_bytes(5, 'big')])
+            })
+
+        return {
+            'uuid': self.uuid(index),
+            'name': self.name(index),
+            'power_state': rng.choices(
+                list(self._power_states),
+                weights=list(self._power_states.values()))[0],
+            'boot_mode': rng.choices(
+                list(self._boot_modes),
+                weights=list(self._boot_modes.values()))[0],
+            'external_notifier': self._external_notifier,
+            'nics': nics,
+        }
+
+
+class PowerScheduler(object):
+    """Calls back when pending power state changes are due
+
+    A single thread, started on the first scheduled change, sleeps until
+    the earliest change is due and then calls `callback` with the system
+    UUID and the generation the change was scheduled at.
+    """
+
+    def __init__(self, callback, logger):
+        self._callback = callback
+        self._logger = logger
+        self._heap = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def schedule(self, apply_time, identity, generation):
+        """Schedule a pending power state change
+
+        :param apply_time: UNIX time the change is due at
+        :param identity: system UUID
+        :param generation: system generation the change was scheduled at
+        """
+        with self._condition:
+            heapq.heappush(self._heap, (apply_time, identity, generation))
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+            self._condition.notify()
+
+    def _next(self):
+        with self._condition:
+            while not self._stopped:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                delay = self._heap[0][0] - time.time()
+                if delay <= 0:
+                    return heapq.heappop(self._heap)
+
+                self._condition.wait(delay)
+
+    def _run(self):
+        while True:
+            change = self._next()
+            if change is None:
+                return
+
+            apply_time, identity, generation = change
+            try:
+                self._callback(identity, generation)
+
+            except Exception as exc:
+                self._logger.error(
+                    'Failed to apply pending power state of system %s: %s',
+                    identity, exc)
+
+    def stop(self):
+        """Stop the scheduler thread, dropping changes not yet due"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join()
+
+
+class _ServerError(Exception):
+    """Notification endpoint failed in a way worth retrying"""
+
+
+class ExternalNotifier(object):
+    """Sends system change notifications from a background thread
+
+    Notifications wait in a queue of up to `queue_size` entries, the
+    oldest ones being dropped when it overflows. Up to `batch_size` queued
+    notifications are sent in one request, as a JSON list of systems when
+    there is more than one. All requests share one HTTP session, and are
+    retried with exponential backoff on connection and server errors.
+    """
+
+    def __init__(self, url, logger, verify=False, cert=None, queue_size=1000,
+                 batch_size=1, retries=3):
+        self._url = url
+        self._logger = logger
+        self._batch_size = batch_size
+        self._retrying = tenacity.Retrying(
+            retry=tenacity.retry_if_exception_type(
+                (requests.ConnectionError, requests.Timeout, _ServerError)),
+            wait=tenacity.wait_exponential(min=0.5, max=10, multiplier=1),
+            stop=tenacity.stop_after_attempt(retries + 1),
+            reraise=True)
+        self._session = requests.Session()
+        self._session.verify = verify
+        self._session.cert = cert
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {'queued': 0, 'sent': 0, 'failed': 0, 'dropped': 0}
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def notify(self, system):
+        """Queue a notification about system changes
+
+        :param system: system dictionary to send
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+        system = copy.deepcopy(system)
+
+        while True:
+            try:
+                self._queue.put_nowait(system)
+                break
+
+            except queue.Full:
+                try:
+                    dropped = self._queue.get_nowait()
+
+                except queue.Empty:
+                    continue
+
+                self._queue.task_done()
+                if dropped is None:
+                    # NOTE: closing, put the stop marker back
+                    self._queue.put_nowait(dropped)
+                    return
+
+                self._count('dropped')
+                if self.stats['dropped'] % 1000 == 1:
+                    self._logger.warning(
+                        'External notification queue is full, %d '
+                        'notifications dropped so far',
+                        self.stats['dropped'])
+
+        self._count('queued')
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while batch[-1] is not None and len(batch) < self._batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _send(self, payload):
+        resp = self._session.put(
+            self._url, json=payload,
+            headers={'Content-type': 'application/json'})
+
+        if resp.status_code >= 500:
+            raise _ServerError('error %d: %s' % (resp.status_code, resp.text))
+
+        if resp.status_code >= 400:
+            raise requests.HTTPError(
+                'error %d: %s' % (resp.status_code, resp.text))
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            systems = [system for system in batch if system is not None]
+            names = ', '.join(str(system.get('name')) for system in systems)
+
+            if systems:
+                self._logger.info(
+                    'External notification to (%s): node %s power state '
+                    'changes', self._url, names)
+
+                try:
+                    self._retrying(self._send,
+                                   systems if len(systems) > 1 else systems[0])
+
+                except Exception as exc:
+                    self._count('failed', len(systems))
+                    self._logger.error(
+                        'External notification to (%s) about system %s '
+                        'request %s', self._url, names, exc)
+
+                else:
+                    self._count('sent', len(systems))
+                    self._logger.info(
+                        'External notification to (%s) sent about %s',
+                        self._url, names)
+
+            for _ in batch:
+                self._queue.task_done()
+
+            if len(systems) < len(batch):
+                return
+
+    def close(self):
+        """Send the queued notifications and stop the thread"""
+        with self._lock:
+            thread = self._thread
+
+        if thread is None or not thread.is_alive():
+            return
+
+        self._queue.put(None)
+        thread.join()
+        atexit.unregister(self.close)
+
 
 class FakeDriver(AbstractSystemsDriver):
     """Fake driver"""
 
     @classmethod
     def initialize(cls, config, logger):
+        generator = config.get('SUSHY_EMULATOR_FAKE_SYSTEMS_GENERATOR')
+        if generator:
+            config.setdefault('SUSHY_EMULATOR_FAKE_SYSTEMS', [])
+
         config.setdefault('SUSHY_EMULATOR_FAKE_SYSTEMS', [
             {
                 'uuid': DEFAULT_UUID,
@@ -46,6 +423,10 @@ class FakeDriver(AbstractSystemsDriver):
         cls._config = config
         cls._logger = logger
         cls._no_memoize = config.get('SUSHY_EMULATOR_NO_MEMOIZE')
+        cls._write_back_interval = config.get(
+            'SUSHY_EMULATOR_FAKE_WRITE_BACK_INTERVAL')
+        cls._generator = SystemGenerator(generator) if generator else None
+        cls._profiles = profiles.load(config)
         return cls
 
     def __init__(self):
@@ -58,31 +439,89 @@ class FakeDriver(AbstractSystemsDriver):
                 self._systems.make_permanent(
                     self._config.get('SUSHY_EMULATOR_STATE_DIR'), 'fakedriver')
 
-        for system in self._config['SUSHY_EMULATOR_FAKE_SYSTEMS']:
-            # Be careful to reduce racing with other processes
-            if system['uuid'] not in self._systems:
-                self._systems[system['uuid']] = copy.deepcopy(system)
+        systems = dict(self._systems.items())
+
+        # Be careful to reduce racing with other processes
+        missing = {
+            system['uuid']: copy.deepcopy(system)
+            for system in self._config['SUSHY_EMULATOR_FAKE_SYSTEMS']
+            if system['uuid'] not in systems
+        }
+        if missing:
+            self._systems.update(missing)
+            systems.update(missing)
+
+        if self._write_back_interval and not self._no_memoize:
+            self._systems = memoize.WriteBackDict(
+                self._systems, self._write_back_interval, data=systems,
+                logger=self._logger)
 
         self._by_name = {
             system['name']: uuid
-            for uuid, system in self._systems.items()
+            for uuid, system in systems.items()
         }
 
-    def _update_if_needed(self, system):
+        self._notifier = self._get_notifier()
+        self._scheduler = PowerScheduler(
+            self._apply_pending_power, self._logger)
+
+        for uuid, system in systems.items():
+            pending_power = system.get('pending_power')
+            if pending_power:
+                self._scheduler.schedule(
+                    pending_power['apply_time'], uuid,
+                    pending_power.get('generation'))
+
+    def _get_notifier(self):
+        cert = None
+        verify = False
+        if self._config.get("EXTERNAL_NOTIFICATION_CAFILE"):
+            verify = self._config.get("EXTERNAL_NOTIFICATION_CAFILE")
+        elif self._config.get("EXTERNAL_NOTIFICATION_CERTFILE") and \
+            self._config.get("EXTERNAL_NOTIFICATION_KEYFILE"):
+            cert = (self._config.get("EXTERNAL_NOTIFICATION_CERTFILE"),
+                    self._config.get("EXTERNAL_NOTIFICATION_KEYFILE"))
+            verify = True
+
+        return ExternalNotifier(
+            self._config.get('EXTERNAL_NOTIFICATION_URL'), self._logger,
+            verify=verify, cert=cert,
+            queue_size=self._config.get(
+                'EXTERNAL_NOTIFICATION_QUEUE_SIZE', 1000),
+            batch_size=self._config.get(
+                'EXTERNAL_NOTIFICATION_BATCH_SIZE', 1),
+            retries=self._config.get('EXTERNAL_NOTIFICATION_RETRIES', 3))
+
+    @staticmethod
+    def _pending_power_state(pending_power):
+        if 'Restart' in pending_power['power_state']:
+            return 'On'
+
+        return pending_power['power_state']
+
+    @locks.locked
+    def _apply_pending_power(self, identity, generation):
+        try:
+            system = self._systems[identity]
+        except KeyError:
+            return
+
+        # NOTE: the change got superseded or already applied
         pending_power = system.get('pending_power')
-        if pending_power and time.time() >= pending_power['apply_time']:
-            if 'Restart' in pending_power['power_state']:
-                pending_power['power_state'] = 'On'
-            self._update(system,
-                         power_state=pending_power['power_state'],
-                         pending_power=None)
+        if not pending_power or pending_power.get('generation') != generation:
+            return
 
-        return system
+        self._update(system,
+                     power_state=self._pending_power_state(pending_power),
+                     pending_power=None)
 
     def _get(self, identity):
         try:
             result = self._systems[identity]
         except KeyError:
+            if self._generator is not None:
+                return self._get_generated(identity)
+
             try:
                 uuid = self._by_name[identity]
             except KeyError:
@@ -90,14 +529,32 @@ class FakeDriver(AbstractSystemsDriver):
             else:
                 raise error.AliasAccessError(uuid)
 
-        # NOTE(dtantsur): since the state change can only be observed after
-        # a _get() call, we can cheat a bit and update it on reading.
-        return self._update_if_needed(result)
+        return result
+
+    def _get_generated(self, identity):
+        index = self._generator.index(identity)
+        if index is not None:
+            # NOTE: generated systems only get stored once accessed
+            system = self._generator.generate(index)
+            self._systems[system['uuid']] = system
+            return system
+
+        try:
+            uuid = self._by_name[identity]
+        except KeyError:
+            index = self._generator.index_by_name(identity)
+            if index is None:
+                raise error.NotFound(f'Fake system {identity} was not found')
+
+            uuid = self._generator.uuid(index)
+
+        raise error.AliasAccessError(uuid)
 
     def _update(self, system, **changes):
         if isinstance(system, str):
             system = self._get(system)
         system.update(changes)
+        system['generation'] = system.get('generation', 0) + 1
         self._systems[system['uuid']] = system
         if system.get('external_notifier'):
             self._send_external_notification(system)
@@ -108,7 +565,13 @@ class FakeDriver(AbstractSystemsDriver):
 
     @property
     def systems(self):
-        return list(self._systems)
+        if self._generator is None:
+            return list(self._systems)
+
+        return [
+            uuid for uuid in self._systems
+            if self._generator.index(uuid) is None
+        ] + list(self._generator.uuids())
 
     def uuid(self, identity):
         try:
@@ -122,54 +585,89 @@ class FakeDriver(AbstractSystemsDriver):
         except error.AliasAccessError:
             return identity
 
+    @profiles.profiled
     def get_power_state(self, identity):
-        return self._get(identity)['power_state']
+        system = self._get(identity)
+
+        # NOTE: the scheduler may not have caught up with a due change yet
+        pending_power = system.get('pending_power')
+        if pending_power and time.time() >= pending_power['apply_time']:
+            return self._pending_power_state(pending_power)
 
+        return system['power_state']
+
+    @profiles.profiled
+    @locks.locked
     def set_power_state(self, identity, state):
         # hardware actions are not immediate
         apply_time = int(time.time()) + random.randint(1, 11)
 
-        system = self._get(identity)
-
         if 'On' in state:
             pending_state = 'On'
         elif state in ('ForceOff', 'GracefulShutdown'):
             pending_state = 'Off'
         elif 'Restart' in state:
-            system['power_state'] = 'Off'
             pending_state = state
         else:
             raise error.NotSupportedError(
                 f'Power state {state} is not supported')
 
-        if system['power_state'] != pending_state:
+        system = self._get(identity)
+
+        # NOTE: compare with the state the system is going to end up in
+        pending_power = system.get('pending_power')
+        if pending_power:
+            power_state = self._pending_power_state(pending_power)
+        else:
+            power_state = system['power_state']
+
+        if 'Restart' in state:
+            system['power_state'] = 'Off'
+
+        if power_state != pending_state:
+            # NOTE: _update() bumps the generation to this value
+            generation = system.get('generation', 0) + 1
             self._update(system, pending_power={
                 'power_state': pending_state,
                 'apply_time': apply_time,
+                'generation': generation,
             })
+            self._scheduler.schedule(apply_time, system['uuid'], generation)
 
+    @profiles.profiled
     def get_boot_device(self, identity):
         return self._get(identity).get('boot_device', 'Hdd')
 
+    @profiles.profiled
+    @locks.locked
     def set_boot_device(self, identity, boot_source):
         self._update(identity, boot_device=boot_source)
 
+    @profiles.profiled
     def get_boot_mode(self, identity):
         return self._get(identity).get('boot_mode', 'UEFI')
 
+    @profiles.profiled
+    @locks.locked
     def set_boot_mode(self, identity, boot_mode):
         self._update(identity, boot_mode=boot_mode)
 
+    @profiles.profiled
     def get_secure_boot(self, identity):
         return self._get(identity).get('secure_boot', False)
 
+    @profiles.profiled
+    @locks.locked
     def set_secure_boot(self, identity, secure):
         self._update(identity, secure_boot=secure)
 
+    @profiles.profiled
     def get_boot_image(self, identity, device):
         devinfo = self._get(identity).get('boot_image') or {}
         return devinfo.get(device) or (None, False, False)
 
+    @profiles.profiled
+    @locks.locked
     def set_boot_image(self, identity, device, boot_image=None,
                        write_protected=True):
         system = self._get(identity)
@@ -177,6 +675,7 @@ class FakeDriver(AbstractSystemsDriver):
         devinfo[device] = (boot_image, write_protected, bool(boot_image))
         self._update(system, boot_image=devinfo)
 
+    @profiles.profiled
     def get_nics(self, identity):
         nics = self._get(identity)['nics']
         return [{'id': nic.get('mac'), 'mac': nic.get('mac')}
@@ -185,42 +684,9 @@ class FakeDriver(AbstractSystemsDriver):
     def _send_external_notification(self, system):
         """Notify external API about a given system changes.
 
+        The notification is sent from a background thread.
+
         Args:
             system (dict): The system dictionary containing system details.
-
-        Logs:
-            Info: Logs the start of the fake IPA boot process.
-            Error: Logs any errors encountered during the request.
         """
-        external_notification_url = self._config.get(
-            'EXTERNAL_NOTIFICATION_URL'
-            )
-        cert = None
-        verify = False
-        if self._config.get("EXTERNAL_NOTIFICATION_CAFILE"):
-            verify = self._config.get("EXTERNAL_NOTIFICATION_CAFILE")
-        elif self._config.get("EXTERNAL_NOTIFICATION_CERTFILE") and \
-            self._config.get("EXTERNAL_NOTIFICATION_KEYFILE"):
-            cert = (self._config.get("EXTERNAL_NOTIFICATION_CERTFILE"),
-                    self._config.get("EXTERNAL_NOTIFICATION_KEYFILE"))
-            verify = True
-
-        self._logger.info(
-            'External notification to (%s): node %s power state changes',
-            external_notification_url, system.get('name'))
-        resp = requests.put(
-            external_notification_url, verify=verify, cert=cert, json=system,
-            headers={'Content-type': 'application/json'})
-
-        # Check if the request was unsuccessful
-        if resp.status_code >= 400:
-            self._logger.error(
-                'External notification to (%s) about system %s request'
-                'error %d: %s',
-                external_notification_url, system.get('name'),
-                resp.status_code, resp.text)
-            return
-
-        # Log successful notification
-        self._logger.info("External notification to (%s) sent about %s",
-                          external_notification_url, system.get('name'))
+        self._notifier.notify(system)
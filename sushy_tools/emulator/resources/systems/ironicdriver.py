@@ -14,9 +14,11 @@
 #    under the License.
 
 import math
+import threading
+import time
 
-from sushy_tools.emulator import memoize
 from sushy_tools.emulator.resources.systems.base import AbstractSystemsDriver
+from sushy_tools.emulator.resources.systems import osconnection
 from sushy_tools import error
 
 try:
@@ -29,6 +31,179 @@ except ImportError:
 is_loaded = bool(openstack)
 
 
+class PortIndex(object):
+    """Index of Ironic port MAC addresses by node UUID
+
+    All ports of the deployment are fetched with a single (paged) listing,
+    which is repeated once the index gets older than `ttl` seconds. Nodes
+    not in the index (e.g. ones enrolled after the last listing) have their
+    ports looked up on their own.
+    """
+
+    def __init__(self, connection, logger, ttl=60):
+        self._cc = connection
+        self._logger = logger
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._macs = {}
+        self._expires = None
+
+    def _load(self):
+        macs = {}
+        count = 0
+        for port in self._cc.baremetal.ports(
+                fields=["address", "node_uuid"]):
+            macs.setdefault(port["node_uuid"], set()).add(port["address"])
+            count += 1
+
+        self._logger.debug('Indexed %d Ironic ports of %d nodes',
+                           count, len(macs))
+
+        self._macs = macs
+        self._expires = time.monotonic() + self._ttl
+
+    def get(self, node_id):
+        """Get MAC addresses of node's ports
+
+        :param node_id: Ironic node UUID
+        :returns: set of MAC addresses
+        """
+        with self._lock:
+            if self._expires is None or time.monotonic() >= self._expires:
+                self._load()
+
+            try:
+                return set(self._macs[node_id])
+
+            except KeyError:
+                ports = self._cc.baremetal.ports(
+                    node_id=node_id, fields=["address"])
+                macs = set(port["address"] for port in ports)
+                self._macs[node_id] = macs
+
+                return set(macs)
+
+
+class NodeCache(object):
+    """Cache of Ironic node snapshots by node UUID and name
+
+    Only the node fields the Redfish views need are fetched. Snapshots are
+    refetched once they get older than `ttl` seconds, and all of them are
+    refreshed at once by listing the nodes. Power state and boot device
+    changes made through the driver are applied to the cached snapshots.
+    """
+
+    FIELDS = ['uuid', 'name', 'power_state', 'boot_mode', 'secure_boot',
+              'properties']
+
+    def __init__(self, connection, logger, ttl=5):
+        self._cc = connection
+        self._logger = logger
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._nodes = {}
+        self._names = {}
+        self._boot_devices = {}
+
+    def _store(self, node, expires):
+        self._nodes[node.id] = node, expires
+        if node.name:
+            self._names[node.name] = node.id
+
+    def _fresh(self, cache, key):
+        try:
+            value, expires = cache[key]
+
+        except KeyError:
+            return
+
+        if time.monotonic() < expires:
+            return value
+
+    def refresh(self):
+        """Refresh snapshots of all nodes
+
+        :returns: list of node snapshots
+        """
+        nodes = list(self._cc.baremetal.nodes(
+            fields=self.FIELDS, details=False))
+
+        with self._lock:
+            self._nodes.clear()
+            self._names.clear()
+            expires = time.monotonic() + self._ttl
+            for node in nodes:
+                self._store(node, expires)
+
+        self._logger.debug('Cached %d Ironic nodes', len(nodes))
+
+        return nodes
+
+    def get(self, identity):
+        """Get node snapshot by node UUID or name
+
+        :param identity: Ironic node UUID or name
+        :returns: node snapshot
+        :raises: `openstack.exceptions.ResourceNotFound` if the node
+            does not exist
+        """
+        with self._lock:
+            node = self._fresh(
+                self._nodes, self._names.get(identity, identity))
+            if node is not None:
+                return node
+
+        node = self._cc.baremetal.get_node(identity, fields=self.FIELDS)
+
+        with self._lock:
+            self._store(node, time.monotonic() + self._ttl)
+
+        return node
+
+    def set_power_state(self, node_id, power_state):
+        """Apply a power state change to the cached snapshot
+
+        :param node_id: Ironic node UUID
+        :param power_state: Ironic power state the node is moving to
+        """
+        with self._lock:
+            try:
+                node = self._nodes[node_id][0]
+
+            except KeyError:
+                return
+
+            node.power_state = power_state
+
+    def get_boot_device(self, node):
+        """Get node boot device
+
+        :param node: node snapshot
+        :returns: Ironic boot device name or `None`
+        """
+        with self._lock:
+            boot_device = self._fresh(self._boot_devices, node.id)
+            if boot_device is not None:
+                return boot_device
+
+        boot_device = node.get_boot_device(
+            self._cc.baremetal).get("boot_device")
+
+        self.set_boot_device(node.id, boot_device)
+
+        return boot_device
+
+    def set_boot_device(self, node_id, boot_device):
+        """Cache node boot device
+
+        :param node_id: Ironic node UUID
+        :param boot_device: Ironic boot device name
+        """
+        with self._lock:
+            self._boot_devices[node_id] = (
+                boot_device, time.monotonic() + self._ttl)
+
+
 class IronicDriver(AbstractSystemsDriver):
     """Ironic driver"""
 
@@ -38,6 +213,15 @@ class IronicDriver(AbstractSystemsDriver):
     IRONIC_POWER_REBOOT = "rebooting"
     IRONIC_POWER_REBOOT_SOFT = "soft rebooting"
 
+    # Power state a node ends up in after a power state change
+    IRONIC_POWER_STATE_AFTER = {
+        IRONIC_POWER_ON: IRONIC_POWER_ON,
+        IRONIC_POWER_OFF: IRONIC_POWER_OFF,
+        IRONIC_POWER_OFF_SOFT: IRONIC_POWER_OFF,
+        IRONIC_POWER_REBOOT: IRONIC_POWER_ON,
+        IRONIC_POWER_REBOOT_SOFT: IRONIC_POWER_ON,
+    }
+
     BOOT_DEVICE_MAP = {
         'Pxe': 'pxe',
         'Hdd': 'disk',
@@ -53,8 +237,6 @@ class IronicDriver(AbstractSystemsDriver):
 
     BOOT_MODE_MAP_REV = {v: k for k, v in BOOT_MODE_MAP.items()}
 
-    PERMANENT_CACHE = {}
-
     @classmethod
     def initialize(cls, config, logger, os_cloud, *args, **kwargs):
         cls._config = config
@@ -62,15 +244,20 @@ class IronicDriver(AbstractSystemsDriver):
         cls._os_cloud = os_cloud
 
         if not hasattr(cls, "_cc"):
-            cls._cc = openstack.connect(cloud=cls._os_cloud)
+            cls._cc = osconnection.connect(cls._os_cloud, config, logger)
+
+        ttl = config.get('SUSHY_EMULATOR_IRONIC_PORT_INDEX_TTL', 60)
+        cls._port_index = PortIndex(cls._cc, logger, ttl) if ttl else None
+
+        cls._node_cache = NodeCache(
+            cls._cc, logger,
+            config.get('SUSHY_EMULATOR_IRONIC_NODE_CACHE_TTL', 5))
 
         return cls
 
-    @memoize.memoize()
     def _get_node(self, identity):
         try:
-            node = self._cc.baremetal.get_node(identity)
-            return node
+            return self._node_cache.get(identity)
         except openstack.exceptions.ResourceNotFound:
             pass
 
@@ -82,15 +269,10 @@ class IronicDriver(AbstractSystemsDriver):
 
         raise error.NotFound(msg)
 
-    @memoize.memoize(permanent_cache=PERMANENT_CACHE)
     def _get_properties(self, identity):
         node = self._get_node(identity)
         return node.properties
 
-    @memoize.memoize(permanent_cache=PERMANENT_CACHE)
-    def _get_driver_internal_info(self, identity):
-        return self._get_node(identity).driver_internal_info
-
     @property
     def driver(self):
         """Return human-friendly driver description
@@ -105,7 +287,7 @@ class IronicDriver(AbstractSystemsDriver):
 
         :returns: list of UUIDs representing the systems
         """
-        return [node.id for node in self._cc.baremetal.nodes(fields=["uuid"])]
+        return [node.id for node in self._node_cache.refresh()]
 
     def uuid(self, identity):
         """Get computer system UUID by name
@@ -160,26 +342,22 @@ class IronicDriver(AbstractSystemsDriver):
         node = self._get_node(identity)
 
         if state in ('On', 'ForceOn'):
-            self._cc.baremetal.set_node_power_state(
-                node.id, self.IRONIC_POWER_ON)
+            self._set_node_power_state(node, self.IRONIC_POWER_ON)
 
         elif state == 'ForceOff':
-            self._cc.baremetal.set_node_power_state(
-                node.id, self.IRONIC_POWER_OFF)
+            self._set_node_power_state(node, self.IRONIC_POWER_OFF)
 
         elif state == 'GracefulShutdown':
-            self._cc.baremetal.set_node_power_state(
-                node.id, self.IRONIC_POWER_OFF_SOFT)
+            self._set_node_power_state(node, self.IRONIC_POWER_OFF_SOFT)
 
         elif state == 'GracefulRestart':
             if node.power_state == self.IRONIC_POWER_ON:
-                self._cc.baremetal.set_node_power_state(
-                    node.id, self.IRONIC_POWER_REBOOT_SOFT)
+                self._set_node_power_state(
+                    node, self.IRONIC_POWER_REBOOT_SOFT)
 
         elif state == 'ForceRestart':
             if node.power_state == self.IRONIC_POWER_ON:
-                self._cc.baremetal.set_node_power_state(
-                    node.id, self.IRONIC_POWER_REBOOT)
+                self._set_node_power_state(node, self.IRONIC_POWER_REBOOT)
 
         # NOTE(etingof) can't support `state == "Nmi"` as
         # openstacksdk does not seem to support that
@@ -187,6 +365,11 @@ class IronicDriver(AbstractSystemsDriver):
             raise error.BadRequest(
                 'Unknown ResetType "%(state)s"' % {'state': state})
 
+    def _set_node_power_state(self, node, target):
+        self._cc.baremetal.set_node_power_state(node.id, target)
+        self._node_cache.set_power_state(
+            node.id, self.IRONIC_POWER_STATE_AFTER[target])
+
     def get_boot_device(self, identity):
         """Get computer system boot device name
 
@@ -201,7 +384,7 @@ class IronicDriver(AbstractSystemsDriver):
         except error.FishyError:
             return
 
-        bdevice = node.get_boot_device(self._cc.baremetal).get("boot_device")
+        bdevice = self._node_cache.get_boot_device(node)
         return self.BOOT_DEVICE_MAP_REV.get(bdevice)
 
     def set_boot_device(self, identity, boot_source):
@@ -223,7 +406,9 @@ class IronicDriver(AbstractSystemsDriver):
 
             raise error.BadRequest(msg)
 
-        self._cc.baremetal.set_node_boot_device(identity, target)
+        node = self._get_node(identity)
+        self._cc.baremetal.set_node_boot_device(node.id, target)
+        self._node_cache.set_boot_device(node.id, target)
 
     def get_boot_mode(self, identity):
         """Get computer system boot mode.
@@ -316,12 +501,14 @@ class IronicDriver(AbstractSystemsDriver):
         :returns: list of dictionaries with NIC attributes (id and mac)
         """
 
-        self._get_node(identity)
+        node = self._get_node(identity)
+
+        if self._port_index is not None:
+            macs = self._port_index.get(node.id)
 
-        macs = set()
-        for port in self._cc.baremetal.ports(fields=["address", "node_uuid"]):
-            if port["node_uuid"] == identity:
-                macs.add(port["address"])
+        else:
+            macs = set(port["address"] for port in self._cc.baremetal.ports(
+                node_id=node.id, fields=["address"]))
 
         return [{'id': mac, 'mac': mac}
                 for mac in macs]
@@ -14,12 +14,18 @@
 #    under the License.
 
 from collections import defaultdict
+from collections import deque
 from collections import namedtuple
+from concurrent import futures
 import os
+import threading
+import time
+from urllib import parse as urlparse
 import uuid
 import xml.etree.ElementTree as ET
 
 from sushy_tools.emulator import constants
+from sushy_tools.emulator import locks
 from sushy_tools.emulator import memoize
 from sushy_tools.emulator.resources.systems.base import AbstractSystemsDriver
 from sushy_tools import error
@@ -67,6 +73,199 @@ class libvirt_open(object):
         self._conn.close()
 
 
+DomainStatsSample = namedtuple('DomainStatsSample',
+                               ['timestamp',
+                                'active',
+                                'vcpus',
+                                'cpu_time',
+                                'vcpu_times',
+                                'memory_used',
+                                'memory_total',
+                                'block_bytes',
+                                'net_bytes'])
+
+
+class DomainStatsCollector(object):
+    """Collect guest statistics of all libvirt domains in bulk
+
+    Calls `getAllDomainStats` once per interval and keeps a short time
+    series of compact samples per domain, from which live utilization,
+    power and thermal readings are derived.
+    """
+
+    # Power model: idle draw of a powered on system plus per-vCPU draw
+    # at full utilization
+    IDLE_WATTS = 60
+    VCPU_WATTS = 15
+
+    # Thermal model: CPU temperature at idle and at full utilization
+    CPU_IDLE_CELSIUS = 35
+    CPU_BUSY_CELSIUS = 41
+
+    def __init__(self, uri, logger, interval=10, history=60):
+        self._uri = uri
+        self._logger = logger
+        self._interval = interval
+        self._history = history
+        self._series = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start collecting statistics in a background thread"""
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(
+            target=self._run, name='libvirt-stats', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background collection"""
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.collect()
+
+            except Exception as e:
+                self._logger.warning(
+                    'Failed collecting domain statistics at libvirt URI '
+                    '"%s": %s', self._uri, e)
+
+            if self._stop.wait(self._interval):
+                return
+
+    def collect(self):
+        """Fetch statistics of all domains with a single libvirt call"""
+        stats = (libvirt.VIR_DOMAIN_STATS_STATE
+                 | libvirt.VIR_DOMAIN_STATS_CPU_TOTAL
+                 | libvirt.VIR_DOMAIN_STATS_BALLOON
+                 | libvirt.VIR_DOMAIN_STATS_VCPU
+                 | libvirt.VIR_DOMAIN_STATS_INTERFACE
+                 | libvirt.VIR_DOMAIN_STATS_BLOCK)
+
+        with libvirt_open(self._uri, readonly=True) as conn:
+            records = conn.getAllDomainStats(stats)
+
+        timestamp = time.monotonic()
+        series = {}
+
+        for domain, record in records:
+            uuid = domain.UUIDString()
+            samples = self._series.get(uuid)
+            if samples is None:
+                samples = deque(maxlen=self._history)
+            samples.append(self._make_sample(timestamp, record))
+            series[uuid] = samples
+
+        # NOTE: domains that are gone are dropped with their history
+        self._series = series
+
+    @staticmethod
+    def _make_sample(timestamp, record):
+        vcpus = record.get('vcpu.current', 0)
+        vcpu_times = tuple(record.get('vcpu.%d.time' % i, 0)
+                           for i in range(vcpus))
+
+        memory_total = record.get('balloon.maximum', 0)
+        if 'balloon.available' in record and 'balloon.unused' in record:
+            memory_used = (record['balloon.available']
+                           - record['balloon.unused'])
+        else:
+            memory_used = record.get('balloon.rss',
+                                     record.get('balloon.current', 0))
+
+        block_bytes = sum(
+            record.get('block.%d.rd.bytes' % i, 0)
+            + record.get('block.%d.wr.bytes' % i, 0)
+            for i in range(record.get('block.count', 0)))
+
+        net_bytes = sum(
+            record.get('net.%d.rx.bytes' % i, 0)
+            + record.get('net.%d.tx.bytes' % i, 0)
+            for i in range(record.get('net.count', 0)))
+
+        # VIR_DOMAIN_RUNNING
+        active = record.get('state.state') == 1
+
+        return DomainStatsSample(timestamp, active, vcpus,
+                                 record.get('cpu.time', 0), vcpu_times,
+                                 memory_used, memory_total,
+                                 block_bytes, net_bytes)
+
+    def _power_watts(self, sample, cpu_utilization):
+        if not sample.active:
+            return 0
+        return round(self.IDLE_WATTS
+                     + self.VCPU_WATTS * sample.vcpus * cpu_utilization / 100)
+
+    def get_metrics(self, uuid):
+        """Get readings derived from the time series of a domain
+
+        :param uuid: libvirt domain UUID
+        :returns: dict of readings, empty if there is not enough
+            statistics collected for the domain yet
+        """
+        samples = list(self._series.get(uuid, ()))
+        if len(samples) < 2:
+            return {}
+
+        watts = []
+        for prev, cur in zip(samples, samples[1:]):
+            elapsed = (cur.timestamp - prev.timestamp) * 1e9
+            if not elapsed or not cur.vcpus:
+                utilization = 0
+            else:
+                utilization = min(100, max(
+                    0, (cur.cpu_time - prev.cpu_time)
+                    * 100 / elapsed / cur.vcpus))
+            watts.append(self._power_watts(cur, utilization))
+
+        prev, cur = samples[-2], samples[-1]
+        elapsed = cur.timestamp - prev.timestamp
+
+        def rate(prev_value, cur_value):
+            if not elapsed:
+                return 0
+            return max(0, cur_value - prev_value) / elapsed
+
+        vcpu_utilization = [
+            round(min(100, rate(prev_time, cur_time) * 100 / 1e9), 1)
+            for prev_time, cur_time in zip(prev.vcpu_times, cur.vcpu_times)]
+
+        memory_utilization = 0
+        if cur.memory_total:
+            memory_utilization = round(
+                cur.memory_used * 100 / cur.memory_total, 1)
+
+        cpu_temperature = round(
+            self.CPU_IDLE_CELSIUS
+            + (self.CPU_BUSY_CELSIUS - self.CPU_IDLE_CELSIUS)
+            * utilization / 100, 1)
+
+        return {
+            'active': cur.active,
+            'cpu_utilization': round(utilization, 1),
+            'vcpu_utilization': vcpu_utilization,
+            'cpu_temperature_celsius': cpu_temperature,
+            'memory_used_mib': cur.memory_used // 1024,
+            'memory_total_mib': cur.memory_total // 1024,
+            'memory_utilization': memory_utilization,
+            'block_bytes_per_second': round(
+                rate(prev.block_bytes, cur.block_bytes)),
+            'network_bytes_per_second': round(
+                rate(prev.net_bytes, cur.net_bytes)),
+            'power_watts': watts[-1],
+            'power_watts_min': min(watts),
+            'power_watts_max': max(watts),
+            'power_watts_average': round(sum(watts) / len(watts)),
+            'interval_minutes': max(
+                1, round((cur.timestamp - samples[0].timestamp) / 60)),
+        }
+
+
 class LibvirtDriver(AbstractSystemsDriver):
     """Libvirt driver"""
 
@@ -155,6 +354,12 @@ class LibvirtDriver(AbstractSystemsDriver):
 
     STORAGE_POOL = 'default'
 
+    # Seconds to reuse the index of libvirt storage volumes
+    VOLUME_INDEX_TTL = 60
+
+    # how long to wait (seconds) for each hypervisor to list its domains
+    HOST_TIMEOUT = 10
+
     STORAGE_VOLUME_XML = """
 <volume type='file'>
   <name>%(name)s</name>
@@ -173,7 +378,22 @@ class LibvirtDriver(AbstractSystemsDriver):
         cls._config = config
         cls._logger = logger
 
-        cls._uri = uri or cls.LIBVIRT_URI
+        if not uri or isinstance(uri, str):
+            cls._uris = [uri or cls.LIBVIRT_URI]
+        else:
+            cls._uris = list(uri)
+
+        # NOTE: the first hypervisor is used where no domain is involved
+        cls._uri = cls._uris[0]
+        cls._routes = {}
+        cls.HOST_TIMEOUT = cls._config.get(
+            'SUSHY_EMULATOR_LIBVIRT_HOST_TIMEOUT', cls.HOST_TIMEOUT)
+        cls._executor = None
+        cls._listings = {}
+        cls._listings_lock = threading.Lock()
+        if len(cls._uris) > 1:
+            cls._executor = futures.ThreadPoolExecutor(
+                max_workers=len(cls._uris))
 
         cls.BOOT_LOADER_MAP = cls._config.get(
             'SUSHY_EMULATOR_BOOT_LOADER_MAP', cls.BOOT_LOADER_MAP)
@@ -189,12 +409,114 @@ class LibvirtDriver(AbstractSystemsDriver):
             cls._config.get('SUSHY_EMULATOR_IGNORE_BOOT_DEVICE', False)
         cls.STORAGE_POOL = cls._config.get(
             'SUSHY_EMULATOR_STORAGE_POOL', cls.STORAGE_POOL)
+        cls.VOLUME_INDEX_TTL = cls._config.get(
+            'SUSHY_EMULATOR_LIBVIRT_VOLUME_INDEX_TTL', cls.VOLUME_INDEX_TTL)
+        cls._volume_index = {}
+        cls.STATS_INTERVAL = cls._config.get(
+            'SUSHY_EMULATOR_LIBVIRT_STATS_INTERVAL')
+        cls.STATS_HISTORY = cls._config.get(
+            'SUSHY_EMULATOR_LIBVIRT_STATS_HISTORY', 60)
+        cls._stats_collectors = {}
+        cls._stats_collectors_lock = threading.Lock()
+        cls.LIVE_MEDIA_CHANGE = cls._config.get(
+            'SUSHY_EMULATOR_LIBVIRT_LIVE_MEDIA_CHANGE', False)
         cls._http_boot_uri = None
         return cls
 
-    @memoize.memoize()
+    def _list_host_domains(self, uri):
+        with libvirt_open(uri, readonly=True) as conn:
+            return [(domain.UUIDString(), domain.name())
+                    for domain in conn.listAllDomains()]
+
+    def _route_domains(self):
+        """List domains of all hypervisors and index their locations
+
+        All hypervisors are queried in parallel. Hypervisors that fail or
+        do not respond within `HOST_TIMEOUT` seconds are skipped, and the
+        routes of their domains learned before are kept.
+
+        A hypervisor is not queried again while its previous listing is
+        still running, but that listing is waited for instead. So a hung
+        hypervisor occupies at most one worker and never delays the
+        listings of the others.
+
+        :returns: list of UUIDs of the domains found
+        """
+        pending = {}
+        with self._listings_lock:
+            for uri in self._uris:
+                future = self._listings.get(uri)
+                if future is None or future.done():
+                    future = self._listings[uri] = self._executor.submit(
+                        self._list_host_domains, uri)
+
+                pending[future] = uri
+
+        done, _ = futures.wait(pending, timeout=self.HOST_TIMEOUT)
+
+        routes = {}
+        systems = []
+
+        for future, uri in pending.items():
+            if future not in done:
+                self._logger.warning(
+                    'Timed out listing domains at libvirt URI "%s"', uri)
+                continue
+
+            try:
+                domains = future.result()
+
+            except (error.FishyError, libvirt.libvirtError) as e:
+                self._logger.warning(
+                    'Failed listing domains at libvirt URI "%s": %s', uri, e)
+                continue
+
+            for domain_uuid, domain_name in domains:
+                systems.append(domain_uuid)
+                routes.setdefault(domain_uuid, uri)
+                routes.setdefault(domain_name, uri)
+
+        self._routes.update(routes)
+
+        return systems
+
+    def _uri_for(self, identity):
+        """Get the URI of the hypervisor running a domain
+
+        :param identity: libvirt domain name or UUID
+        :raises: `error.NotFound` if no hypervisor knows the domain
+        :returns: libvirt URI
+        """
+        if len(self._uris) == 1:
+            return self._uri
+
+        try:
+            key = str(uuid.UUID(identity))
+
+        except ValueError:
+            key = identity
+
+        if key not in self._routes:
+            self._route_domains()
+
+        try:
+            return self._routes[key]
+
+        except KeyError:
+            msg = ('Error finding domain by name/UUID "%(identity)s" at '
+                   'any of the libvirt URIs %(uris)s' %
+                   {'identity': identity, 'uris': ', '.join(self._uris)})
+
+            self._logger.debug(msg)
+
+            raise error.NotFound(msg)
+
+    # NOTE: cached domains hold their libvirt connection open
+    @memoize.memoize(max_size=1024, ttl=60)
     def _get_domain(self, identity, readonly=False):
-        with libvirt_open(self._uri, readonly=readonly) as conn:
+        uri = self._uri_for(identity)
+
+        with libvirt_open(uri, readonly=readonly) as conn:
             try:
                 uu_identity = uuid.UUID(identity)
 
@@ -208,7 +530,7 @@ class LibvirtDriver(AbstractSystemsDriver):
                     msg = ('Error finding domain by name/UUID "%(identity)s" '
                            'at libvirt URI %(uri)s": %(err)s' %
                            {'identity': identity,
-                            'uri': self._uri, 'err': ex})
+                            'uri': uri, 'err': ex})
 
                     self._logger.debug(msg)
 
@@ -244,6 +566,9 @@ class LibvirtDriver(AbstractSystemsDriver):
 
         :returns: list of UUIDs representing the systems
         """
+        if len(self._uris) > 1:
+            return self._route_domains()
+
         with libvirt_open(self._uri, readonly=True) as conn:
             return [domain.UUIDString() for domain in conn.listAllDomains()]
 
@@ -316,7 +641,8 @@ class LibvirtDriver(AbstractSystemsDriver):
 
         except libvirt.libvirtError as e:
             msg = ('Error changing power state at libvirt URI "%(uri)s": '
-                   '%(error)s' % {'uri': self._uri, 'error': e})
+                   '%(error)s' % {'uri': self._uri_for(identity),
+                                  'error': e})
 
             raise error.FishyError(msg)
 
@@ -402,15 +728,17 @@ class LibvirtDriver(AbstractSystemsDriver):
 
         return boot_source_target
 
-    def _defineDomain(self, tree):
+    def _defineDomain(self, identity, tree):
+        uri = self._uri_for(identity)
         try:
-            with libvirt_open(self._uri) as conn:
+            with libvirt_open(uri) as conn:
                 conn.defineXML(ET.tostring(tree).decode('utf-8'))
         except libvirt.libvirtError as e:
             msg = ('Error changing boot device at libvirt URI "%(uri)s": '
-                   '%(error)s' % {'uri': self._uri, 'error': e})
+                   '%(error)s' % {'uri': uri, 'error': e})
             raise error.FishyError(msg)
 
+    @locks.locked
     def set_boot_device(self, identity, boot_source):
         """Get/Set computer system boot device name
 
@@ -442,7 +770,7 @@ class LibvirtDriver(AbstractSystemsDriver):
                 self._logger.warning('Ignoring setting of boot device')
                 boot_element = ET.SubElement(os_element, 'boot')
                 boot_element.set('dev', 'fd')
-                self._defineDomain(tree)
+                self._defineDomain(identity, tree)
                 return
 
         target = self.DISK_DEVICE_MAP.get(boot_source)
@@ -519,7 +847,7 @@ class LibvirtDriver(AbstractSystemsDriver):
             boot_element = ET.SubElement(target_device_element, 'boot')
             boot_element.set('order', str(order + 1))
 
-        self._defineDomain(tree)
+        self._defineDomain(identity, tree)
 
     def _is_firmware_autoselection(self, tree):
         """Get libvirt firmware autoselection mode
@@ -562,6 +890,7 @@ class LibvirtDriver(AbstractSystemsDriver):
 
             return boot_mode
 
+    @locks.locked
     def set_boot_mode(self, identity, boot_mode):
         """Set computer system boot mode.
 
@@ -580,14 +909,16 @@ class LibvirtDriver(AbstractSystemsDriver):
         tree = ET.fromstring(self.get_xml_desc(domain))
         self._build_os_element(identity, tree, boot_mode)
 
-        with libvirt_open(self._uri) as conn:
+        uri = self._uri_for(identity)
+
+        with libvirt_open(uri) as conn:
 
             try:
                 conn.defineXML(ET.tostring(tree).decode('utf-8'))
 
             except libvirt.libvirtError as e:
                 msg = ('Error changing boot mode at libvirt URI '
-                       '"%(uri)s": %(error)s' % {'uri': self._uri,
+                       '"%(uri)s": %(error)s' % {'uri': uri,
                                                  'error': e})
 
                 raise error.FishyError(msg)
@@ -789,6 +1120,7 @@ class LibvirtDriver(AbstractSystemsDriver):
         nvram_template = nvram[0].get('template')
         return nvram_template == self.SECURE_BOOT_ENABLED_NVRAM
 
+    @locks.locked
     def set_secure_boot(self, identity, secure):
         """Set computer system secure boot state for UEFI boot mode.
 
@@ -806,14 +1138,16 @@ class LibvirtDriver(AbstractSystemsDriver):
         tree = ET.fromstring(domain.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE))
         self._build_os_element(identity, tree, 'UEFI', secure)
 
-        with libvirt_open(self._uri) as conn:
+        uri = self._uri_for(identity)
+
+        with libvirt_open(uri) as conn:
 
             try:
                 conn.defineXML(ET.tostring(tree).decode('utf-8'))
 
             except libvirt.libvirtError as e:
                 msg = ('Error changing secure boot at libvirt URI '
-                       '"%(uri)s": %(error)s' % {'uri': self._uri,
+                       '"%(uri)s": %(error)s' % {'uri': uri,
                                                  'error': e})
 
                 raise error.FishyError(msg)
@@ -1005,6 +1339,7 @@ class LibvirtDriver(AbstractSystemsDriver):
         return FirmwareProcessResult(tree, attributes_written,
                                      firmware_versions)
 
+    @locks.locked
     def _process_bios(self, identity,
                       bios_attributes=DEFAULT_BIOS_ATTRIBUTES,
                       update_existing_attributes=False):
@@ -1032,18 +1367,21 @@ class LibvirtDriver(AbstractSystemsDriver):
 
         if result.attributes_written:
 
+            uri = self._uri_for(identity)
+
             try:
-                with libvirt_open(self._uri) as conn:
+                with libvirt_open(uri) as conn:
                     conn.defineXML(ET.tostring(result.tree).decode('utf-8'))
 
             except libvirt.libvirtError as e:
                 msg = ('Error updating BIOS attributes'
                        ' at libvirt URI "%(uri)s": '
-                       '%(error)s' % {'uri': self._uri, 'error': e})
+                       '%(error)s' % {'uri': uri, 'error': e})
                 raise error.FishyError(msg)
 
         return result.bios_attributes
 
+    @locks.locked
     def _process_versions(self, identity,
                           firmware_versions=DEFAULT_FIRMWARE_VERSIONS,
                           update_existing_attributes=False):
@@ -1071,14 +1409,16 @@ class LibvirtDriver(AbstractSystemsDriver):
 
         if result.attributes_written:
 
+            uri = self._uri_for(identity)
+
             try:
-                with libvirt_open(self._uri) as conn:
+                with libvirt_open(uri) as conn:
                     conn.defineXML(ET.tostring(result.tree).decode('utf-8'))
 
             except libvirt.libvirtError as e:
                 msg = ('Error updating firmware versions'
                        ' at libvirt URI "%(uri)s": '
-                       '%(error)s' % {'uri': self._uri, 'error': e})
+                       '%(error)s' % {'uri': uri, 'error': e})
                 raise error.FishyError(msg)
         return result.firmware_versions
 
@@ -1217,6 +1557,41 @@ class LibvirtDriver(AbstractSystemsDriver):
 
         return processors
 
+    def _get_stats_collector(self, uri):
+        with self._stats_collectors_lock:
+            collector = self._stats_collectors.get(uri)
+            if collector is None:
+                collector = DomainStatsCollector(
+                    uri, self._logger, interval=self.STATS_INTERVAL,
+                    history=self.STATS_HISTORY)
+                self._stats_collectors[uri] = collector
+                collector.start()
+
+        return collector
+
+    def get_metrics(self, identity):
+        """Get live utilization readings of the system
+
+        The readings are derived from domain statistics collected in bulk
+        every `SUSHY_EMULATOR_LIBVIRT_STATS_INTERVAL` seconds.
+
+        :param identity: libvirt domain name or ID
+        :returns: dict of readings, empty until enough statistics
+            are collected
+        :raises: `error.NotSupportedError` if statistics collection is
+            not enabled
+        """
+        if not self.STATS_INTERVAL:
+            raise error.NotSupportedError(
+                'Statistics collection is not enabled')
+
+        domain = self._get_domain(identity, readonly=True)
+
+        collector = self._get_stats_collector(
+            self._uri_for(domain.UUIDString()))
+
+        return collector.get_metrics(domain.UUIDString())
+
     def get_boot_image(self, identity, device):
         """Get backend VM boot image info
 
@@ -1246,7 +1621,7 @@ class LibvirtDriver(AbstractSystemsDriver):
             if source_element is None:
                 continue
 
-            boot_image = source_element.attrib.get('file')
+            boot_image = self._get_boot_image_source(source_element)
             if boot_image is None:
                 continue
 
@@ -1293,6 +1668,8 @@ class LibvirtDriver(AbstractSystemsDriver):
 
         # Create new volume
 
+        self._invalidate_volume_index()
+
         volume = pool.createXML(
             self.STORAGE_VOLUME_XML % {
                 'name': image_name, 'path': image_path,
@@ -1312,6 +1689,64 @@ class LibvirtDriver(AbstractSystemsDriver):
 
         return image_path
 
+    @staticmethod
+    def _is_network_image(boot_image):
+        return urlparse.urlparse(boot_image).scheme in ('http', 'https')
+
+    def _set_boot_image_source(self, disk_element, image_path):
+        """Point a disk element to a local image file or an image URL
+
+        HTTP(S) URLs are attached as network disks, so that QEMU reads
+        only the blocks the guest accesses instead of the whole image
+        being fetched and uploaded to the storage pool.
+        """
+        source_element = ET.SubElement(disk_element, 'source')
+
+        if not self._is_network_image(image_path):
+            disk_element.set('type', 'file')
+            source_element.set('file', image_path)
+            return
+
+        url = urlparse.urlparse(image_path)
+
+        disk_element.set('type', 'network')
+        source_element.set('protocol', url.scheme)
+        source_element.set(
+            'name', url.path + ('?' + url.query if url.query else ''))
+
+        host_element = ET.SubElement(source_element, 'host')
+        host_element.set('name', url.hostname)
+        host_element.set(
+            'port', str(url.port or (443 if url.scheme == 'https' else 80)))
+
+        if url.scheme == 'https':
+            verify = self._config.get('SUSHY_EMULATOR_VMEDIA_VERIFY_SSL',
+                                      False)
+            ssl_element = ET.SubElement(source_element, 'ssl')
+            ssl_element.set('verify', 'yes' if verify else 'no')
+
+    @staticmethod
+    def _get_boot_image_source(source_element):
+        boot_image = source_element.attrib.get('file')
+        if boot_image is not None:
+            return boot_image
+
+        protocol = source_element.attrib.get('protocol')
+        host_element = source_element.find('host')
+        if protocol not in ('http', 'https') or host_element is None:
+            return None
+
+        netloc = host_element.attrib.get('name', '')
+        if ':' in netloc:
+            netloc = '[%s]' % netloc
+
+        port = host_element.attrib.get('port')
+        if port and port != ('443' if protocol == 'https' else '80'):
+            netloc = '%s:%s' % (netloc, port)
+
+        return '%s://%s%s' % (protocol, netloc,
+                              source_element.attrib.get('name', ''))
+
     def _default_controller(self, domain_tree):
         os_element = domain_tree.find('os')
         if os_element is not None:
@@ -1327,7 +1762,7 @@ class LibvirtDriver(AbstractSystemsDriver):
         return 'ide'
 
     def _add_boot_image(self, domain, domain_tree, device,
-                        boot_image, write_protected):
+                        boot_image, write_protected, image_path=None):
 
         identity = domain.UUIDString()
 
@@ -1339,9 +1774,12 @@ class LibvirtDriver(AbstractSystemsDriver):
 
         controller_type = self._default_controller(domain_tree)
 
-        with libvirt_open(self._uri) as conn:
+        with libvirt_open(self._uri_for(identity)) as conn:
 
-            image_path = self._upload_image(domain, conn, boot_image)
+            if image_path is None and self._is_network_image(boot_image):
+                image_path = boot_image
+            elif image_path is None:
+                image_path = self._upload_image(domain, conn, boot_image)
 
             try:
                 lv_device = self.BOOT_DEVICE_MAP[device]
@@ -1420,8 +1858,7 @@ class LibvirtDriver(AbstractSystemsDriver):
             driver_element.set('name', 'qemu')
             driver_element.set('type', 'raw')
 
-            source_element = ET.SubElement(disk_element, 'source')
-            source_element.set('file', image_path)
+            self._set_boot_image_source(disk_element, image_path)
 
             if write_protected:
                 ET.SubElement(disk_element, 'readonly')
@@ -1451,6 +1888,100 @@ class LibvirtDriver(AbstractSystemsDriver):
             if dev_type == lv_device:
                 device_element.remove(disk_element)
 
+    def _redefine_boot_image(self, domain, device, boot_image,
+                             write_protected, image_path=None):
+        domain_tree = ET.fromstring(self.get_xml_desc(domain))
+
+        self._remove_boot_images(domain, domain_tree, device)
+
+        if boot_image:
+            self._add_boot_image(domain, domain_tree, device,
+                                 boot_image, write_protected, image_path)
+
+        uri = self._uri_for(domain.UUIDString())
+
+        with libvirt_open(uri) as conn:
+            xml = ET.tostring(domain_tree)
+
+            try:
+                conn.defineXML(xml.decode('utf-8'))
+
+            except Exception as e:
+                self._logger.error('Rejected libvirt domain XML is %s', xml)
+
+                msg = ('Error changing boot image at libvirt URI "%(uri)s": '
+                       '%(error)s' % {'uri': uri, 'error': e})
+
+                raise error.FishyError(msg)
+
+    def _change_boot_image_live(self, domain, device, boot_image,
+                                write_protected):
+        """Swap the media of a removable disk of a running domain
+
+        Updates the source of the existing CD-ROM or floppy disk in both
+        the live and the persistent domain configuration, so that no
+        power cycle is needed for the guest to see the new media.
+
+        :returns: a tuple of `True` if the media has been changed, `False`
+            if the domain needs to be redefined instead, and the path or
+            URL of the image if it has already been uploaded
+        """
+        lv_device = self.DEVICE_TYPE_MAP.get(device)
+        if lv_device is None or not domain.isActive():
+            return False, None
+
+        domain_tree = ET.fromstring(self.get_xml_desc(domain))
+
+        for disk_element in domain_tree.findall('devices/disk'):
+            if disk_element.attrib.get('device') == lv_device:
+                break
+
+        else:
+            self._logger.debug(
+                'No %(device)s device to change media live in the libvirt '
+                'domain "%(identity)s"',
+                {'device': lv_device, 'identity': domain.UUIDString()})
+            return False, None
+
+        for source_element in disk_element.findall('source'):
+            disk_element.remove(source_element)
+
+        image_path = None
+        if boot_image:
+            if self._is_network_image(boot_image):
+                image_path = boot_image
+            else:
+                with libvirt_open(
+                        self._uri_for(domain.UUIDString())) as conn:
+                    image_path = self._upload_image(domain, conn, boot_image)
+
+            self._set_boot_image_source(disk_element, image_path)
+
+            readonly_element = disk_element.find('readonly')
+            if write_protected and readonly_element is None:
+                ET.SubElement(disk_element, 'readonly')
+            elif not write_protected and readonly_element is not None:
+                disk_element.remove(readonly_element)
+
+        xml = ET.tostring(disk_element).decode('utf-8')
+
+        try:
+            domain.updateDeviceFlags(
+                xml, libvirt.VIR_DOMAIN_AFFECT_LIVE
+                | libvirt.VIR_DOMAIN_AFFECT_CONFIG)
+
+        except libvirt.libvirtError as e:
+            self._logger.warning(
+                'Failed to change %(device)s media live in the libvirt '
+                'domain "%(identity)s", redefining the domain instead: '
+                '%(error)s', {'device': lv_device,
+                              'identity': domain.UUIDString(), 'error': e})
+            # NOTE: pass the uploaded image on to the redefinition
+            return False, image_path
+
+        return True, image_path
+
+    @locks.locked
     def set_boot_image(self, identity, device, boot_image=None,
                        write_protected=True):
         """Set backend VM boot image
@@ -1462,36 +1993,28 @@ class LibvirtDriver(AbstractSystemsDriver):
             configured image entirely
         :param write_protected: expose media as read-only or writable
 
+        With `SUSHY_EMULATOR_LIBVIRT_LIVE_MEDIA_CHANGE` enabled, the media
+        of a running domain is swapped in place rather than on the next
+        power cycle.
+
         :raises: `error.FishyError` if boot device can't be set
         """
         domain = self._get_domain(identity)
 
-        domain_tree = ET.fromstring(self.get_xml_desc(domain))
+        boot_device = None
 
-        self._remove_boot_images(domain, domain_tree, device)
+        changed, image_path = False, None
+        if self.LIVE_MEDIA_CHANGE:
+            changed, image_path = self._change_boot_image_live(
+                domain, device, boot_image, write_protected)
 
-        boot_device = None
+        if not changed:
+            self._redefine_boot_image(domain, device, boot_image,
+                                      write_protected, image_path)
 
         if boot_image:
-            self._add_boot_image(domain, domain_tree, device,
-                                 boot_image, write_protected)
-
             boot_device = self.get_boot_device(identity)
 
-        with libvirt_open(self._uri) as conn:
-            xml = ET.tostring(domain_tree)
-
-            try:
-                conn.defineXML(xml.decode('utf-8'))
-
-            except Exception as e:
-                self._logger.error('Rejected libvirt domain XML is %s', xml)
-
-                msg = ('Error changing boot image at libvirt URI "%(uri)s": '
-                       '%(error)s' % {'uri': self._uri, 'error': e})
-
-                raise error.FishyError(msg)
-
         if device == boot_device:
             self.set_boot_device(identity, boot_device)
         elif boot_image is None:
@@ -1501,20 +2024,22 @@ class LibvirtDriver(AbstractSystemsDriver):
                 self._logger.warning(
                     'Failed to restore boot order to HDD after eject: %s', ex)
 
-    def _find_device_by_path(self, vol_path):
+    def _find_device_by_path(self, vol_path, uri=None):
         """Get device attributes using path
 
         :param vol_path: path for the libvirt volume
+        :param uri: libvirt URI of the hypervisor holding the volume
         :returns: a dict (or None) of the corresponding device attributes
         """
-        with libvirt_open(self._uri, readonly=True) as conn:
+        uri = uri or self._uri
+        with libvirt_open(uri, readonly=True) as conn:
             try:
                 vol = conn.storageVolLookupByPath(vol_path)
             except libvirt.libvirtError as e:
                 msg = ('Could not find storage volume by path '
                        '"%(path)s" at libvirt URI "%(uri)s": '
                        '%(err)s' %
-                       {'path': vol_path, 'uri': self._uri,
+                       {'path': vol_path, 'uri': uri,
                         'err': e})
                 self._logger.debug(msg)
                 return
@@ -1524,20 +2049,22 @@ class LibvirtDriver(AbstractSystemsDriver):
             }
             return disk_device
 
-    def _find_device_from_pool(self, pool_name, vol_name):
+    def _find_device_from_pool(self, pool_name, vol_name, uri=None):
         """Get device attributes from pool
 
         :param pool_name: libvirt pool name
         :param vol_name: libvirt volume name
+        :param uri: libvirt URI of the hypervisor holding the pool
         :returns: a dict (or None) of the corresponding device attributes
         """
-        with libvirt_open(self._uri, readonly=True) as conn:
+        uri = uri or self._uri
+        with libvirt_open(uri, readonly=True) as conn:
             try:
                 pool = conn.storagePoolLookupByName(pool_name)
             except libvirt.libvirtError as e:
                 msg = ('Error finding Storage Pool by name "%(name)s" at'
                        'libvirt URI "%(uri)s": %(err)s' %
-                       {'name': pool_name, 'uri': self._uri, 'err': e})
+                       {'name': pool_name, 'uri': uri, 'err': e})
                 self._logger.debug(msg)
                 return
 
@@ -1548,7 +2075,7 @@ class LibvirtDriver(AbstractSystemsDriver):
                        'in Pool '"%(pName)s"' at libvirt URI "%(uri)s"'
                        ': %(err)s' %
                        {'name': vol_name, 'pName': pool_name,
-                        'uri': self._uri, 'err': e})
+                        'uri': uri, 'err': e})
                 self._logger.debug(msg)
                 return
             disk_device = {
@@ -1557,6 +2084,73 @@ class LibvirtDriver(AbstractSystemsDriver):
             }
             return disk_device
 
+    def _get_volume_index(self, conn, uri=None):
+        """Get an index of all libvirt storage volumes
+
+        The index is built by listing the volumes of every storage pool
+        once and is reused until it is older than `VOLUME_INDEX_TTL`
+        seconds or gets invalidated by a storage change made by the driver.
+
+        :param conn: libvirt connection to build the index with
+        :param uri: libvirt URI of the connection, one index is kept
+            per hypervisor
+        :returns: a tuple of two dicts mapping volume path and
+            (pool name, volume name) to the corresponding device attributes
+        """
+        uri = uri or self._uri
+        index = self._volume_index.get(uri)
+        if index is not None and time.monotonic() < index[0]:
+            return index[1], index[2]
+
+        by_path = {}
+        by_pool = {}
+
+        try:
+            pools = conn.listAllStoragePools()
+        except libvirt.libvirtError as e:
+            msg = ('Error listing Storage Pools at libvirt URI "%(uri)s": '
+                   '%(err)s' % {'uri': uri, 'err': e})
+            self._logger.debug(msg)
+            return by_path, by_pool
+
+        for pool in pools:
+            try:
+                pool_name = pool.name()
+                volumes = pool.listAllVolumes()
+            except libvirt.libvirtError as e:
+                # NOTE: inactive pools can't list their volumes
+                self._logger.debug('Error listing Storage Volumes at '
+                                   'libvirt URI "%s": %s', uri, e)
+                continue
+
+            for vol in volumes:
+                try:
+                    disk_device = {
+                        'Name': vol.name(),
+                        'CapacityBytes': vol.info()[1]
+                    }
+                    vol_path = vol.path()
+                except libvirt.libvirtError as e:
+                    self._logger.debug('Error reading Storage Volume in '
+                                       'Pool "%s": %s', pool_name, e)
+                    continue
+
+                by_path[vol_path] = disk_device
+                by_pool[(pool_name, disk_device['Name'])] = disk_device
+
+        self._volume_index[uri] = (
+            time.monotonic() + self.VOLUME_INDEX_TTL, by_path, by_pool)
+
+        return by_path, by_pool
+
+    def _invalidate_volume_index(self):
+        """Drop the index of libvirt storage volumes
+
+        Called whenever the driver changes the storage pools so that the
+        next lookup sees the change.
+        """
+        self._volume_index.clear()
+
     def get_simple_storage_collection(self, identity):
         """Get a dict of simple storage controllers and their devices
 
@@ -1571,6 +2165,11 @@ class LibvirtDriver(AbstractSystemsDriver):
         tree = ET.fromstring(domain.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE))
         simple_storage = defaultdict(lambda: defaultdict(DeviceList=list()))
 
+        uri = self._uri_for(domain.UUIDString())
+
+        with libvirt_open(uri, readonly=True) as conn:
+            by_path, by_pool = self._get_volume_index(conn, uri)
+
         for disk_element in tree.findall(".//disk/target[@bus]/.."):
             source_element = disk_element.find('source')
             if source_element is not None:
@@ -1582,16 +2181,26 @@ class LibvirtDriver(AbstractSystemsDriver):
                         vol_path = source_element.attrib['file']
                     else:
                         vol_path = source_element.attrib['dev']
-                    disk_device = self._find_device_by_path(vol_path)
+                    # NOTE: volumes missing from the index are looked up
+                    # individually and the result (even a miss) is kept
+                    # in the index until it expires
+                    if vol_path not in by_path:
+                        by_path[vol_path] = self._find_device_by_path(
+                            vol_path, uri)
+                    disk_device = by_path[vol_path]
                 elif disk_type == 'volume':
                     pool_name = source_element.attrib['pool']
                     vol_name = source_element.attrib['volume']
-                    disk_device = self._find_device_from_pool(pool_name,
-                                                              vol_name)
+                    if (pool_name, vol_name) not in by_pool:
+                        by_pool[(pool_name, vol_name)] = (
+                            self._find_device_from_pool(
+                                pool_name, vol_name, uri))
+                    disk_device = by_pool[(pool_name, vol_name)]
                 if disk_device is not None:
                     simple_storage[ctl_type]['Id'] = ctl_type
                     simple_storage[ctl_type]['Name'] = ctl_type
-                    simple_storage[ctl_type]['DeviceList'].append(disk_device)
+                    simple_storage[ctl_type]['DeviceList'].append(
+                        dict(disk_device))
         return simple_storage
 
     def find_or_create_storage_volume(self, data):
@@ -1639,6 +2248,8 @@ class LibvirtDriver(AbstractSystemsDriver):
                     pool_path_element.text, data['libvirtVolName'])
 
                 # Create a new volume
+                self._invalidate_volume_index()
+
                 vol = pool.createXML(
                     self.STORAGE_VOLUME_XML % {
                         'name': data['libvirtVolName'], 'path': vol_path,
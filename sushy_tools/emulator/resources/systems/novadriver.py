@@ -15,14 +15,21 @@
 
 import base64
 from concurrent import futures
+import datetime
+import json
 import math
 import os
 import sqlite3
+import threading
 import time
 from urllib import parse as urlparse
 
+import requests
+
+from sushy_tools.emulator import locks
 from sushy_tools.emulator import memoize
 from sushy_tools.emulator.resources.systems.base import AbstractSystemsDriver
+from sushy_tools.emulator.resources.systems import osconnection
 from sushy_tools import error
 
 try:
@@ -35,6 +42,467 @@ except ImportError:
 is_loaded = bool(openstack)
 
 FUTURES = {}
+# Operations waiting for the one in progress on the same server
+PENDING = {}
+PENDING_LOCK = threading.Lock()
+
+
+def _dump_resource(driver, resource):
+    if resource is not None:
+        return type(resource), resource.to_dict(computed=False)
+
+
+def _load_resource(driver, data):
+    if data is not None:
+        resource_type, attrs = data
+        return resource_type.existing(**attrs)
+
+
+# OpenStack resources do not pickle, their attributes are shared instead
+SHARED_RESOURCE = _dump_resource, _load_resource
+
+
+class _PendingWait(object):
+
+    def __init__(self, kind, resource, ready, key, stable_for, interval,
+                 max_interval, now, timeout):
+        self.kind = kind
+        self.resource = resource
+        self.ready = ready
+        self.key = key
+        self.stable_for = stable_for
+        self.initial_interval = interval
+        self.interval = interval
+        self.max_interval = max_interval
+        self.next_check = now
+        self.deadline = None if timeout is None else now + timeout
+        self.stable_since = None
+        self.stable_state = None
+        self.future = futures.Future()
+
+
+class StatusWaiter(object):
+    """Wait for OpenStack servers and images to reach a desired state
+
+    Rather than every caller sleep-polling its own resource, pending waits
+    are registered here and checked together: one of the waiting callers
+    polls on behalf of all of them, refreshing all due servers (or images)
+    with a single listing per tick and backing off exponentially between
+    the checks of each wait. Server listings only cover the servers changed
+    since the waited ones were last seen.
+    """
+
+    def __init__(self, connection, logger, interval=1, max_interval=5):
+        self._cc = connection
+        self._logger = logger
+        self._interval = interval
+        self._max_interval = max_interval
+        self._cond = threading.Condition()
+        self._waits = []
+        self._polling = False
+        # NOTE: time advanced by the polling caller's sleeps, which keeps
+        # waits independent of how long the API calls take
+        self._clock = 0
+
+    def wait_for_server(self, server, ready, timeout=None, interval=None,
+                        stable_for=0, key=None):
+        """Wait for a server to reach a state
+
+        :param server: server object to wait for
+        :param ready: callable telling if a server is in the desired state
+        :param timeout: how long to wait in seconds or `None` to wait
+            for as long as it takes
+        :param interval: initial interval between the checks in seconds
+        :param stable_for: for how long in seconds the server has to stay
+            in the desired state
+        :param key: callable returning the part of the server state which
+            must not change while waiting for stability
+        :returns: a tuple of (is_ready, server) with the last seen server
+            object, `is_ready` is `False` if the wait timed out
+        """
+        return self._wait('server', server, ready, timeout, interval,
+                          stable_for, key)
+
+    def wait_for_image(self, image, ready, timeout=None, interval=None):
+        """Wait for an image to reach a state
+
+        :param image: image object to wait for
+        :param ready: callable telling if an image is in the desired state
+        :param timeout: how long to wait in seconds or `None` to wait
+            for as long as it takes
+        :param interval: initial interval between the checks in seconds
+        :returns: a tuple of (is_ready, image) with the last seen image
+            object, `is_ready` is `False` if the wait timed out
+        """
+        return self._wait('image', image, ready, timeout, interval, 0, None)
+
+    def _wait(self, kind, resource, ready, timeout, interval, stable_for,
+              key):
+        with self._cond:
+            pending = _PendingWait(
+                kind, resource, ready, key, stable_for,
+                interval or self._interval,
+                max(self._max_interval, interval or 0), self._clock, timeout)
+
+            self._waits.append(pending)
+
+            while not pending.future.done():
+                if not self._polling:
+                    self._polling = True
+                    break
+
+                self._cond.wait(self._max_interval)
+
+            else:
+                return pending.future.result()
+
+        try:
+            self._poll(pending)
+
+        finally:
+            with self._cond:
+                self._polling = False
+                self._cond.notify_all()
+
+        return pending.future.result()
+
+    def _poll(self, pending):
+        while True:
+            with self._cond:
+                due = [wait for wait in self._waits
+                       if wait.next_check <= self._clock]
+
+            self._check(due)
+
+            with self._cond:
+                self._waits = [wait for wait in self._waits
+                               if not wait.future.done()]
+                self._cond.notify_all()
+
+                if pending.future.done():
+                    return
+
+                delay = max(0, min(wait.next_check for wait in self._waits)
+                            - self._clock)
+
+            time.sleep(delay)
+
+            with self._cond:
+                self._clock += delay
+
+    def _fetch_servers(self, servers):
+        if len(servers) == 1:
+            servers[0].fetch(self._cc.compute)
+            return {servers[0].id: servers[0]}
+
+        ids = {server.id for server in servers}
+        updated_at = [getattr(server, 'updated_at', None)
+                      for server in servers]
+        if not all(isinstance(value, str) for value in updated_at):
+            return {server.id: server
+                    for server in self._cc.compute.servers(details=True)
+                    if server.id in ids}
+
+        # NOTE: only list the servers changed since the least recently
+        # updated one was seen, the others are unchanged. Deleted servers
+        # are listed too when filtering by change time.
+        fetched = {server.id: server for server in servers}
+        fetched.update(
+            (server.id, server)
+            for server in self._cc.compute.servers(
+                details=True, changes_since=min(updated_at))
+            if server.id in ids)
+        return {server_id: server for server_id, server in fetched.items()
+                if server.status != 'DELETED'}
+
+    def _fetch_images(self, images):
+        if len(images) == 1:
+            image = self._cc.image.get_image(images[0])
+            return {images[0].id: image}
+
+        ids = {image.id for image in images}
+        return {image.id: image
+                for image in self._cc.image.images(
+                    id='in:%s' % ','.join(sorted(ids)))}
+
+    def _check(self, due):
+        for kind, fetch in (('server', self._fetch_servers),
+                            ('image', self._fetch_images)):
+            waits = [wait for wait in due if wait.kind == kind]
+            if not waits:
+                continue
+
+            try:
+                resources = fetch([wait.resource for wait in waits])
+
+            except Exception as ex:
+                for wait in waits:
+                    wait.future.set_exception(ex)
+                continue
+
+            for wait in waits:
+                resource = resources.get(wait.resource.id)
+                if resource is None:
+                    wait.future.set_exception(error.NotFound(
+                        'The %s %s is gone' % (kind, wait.resource.id)))
+                    continue
+
+                wait.resource = resource
+                self._update(wait)
+
+    def _update(self, wait):
+        resource = wait.resource
+        expired = wait.deadline is not None and self._clock >= wait.deadline
+
+        if wait.ready(resource):
+            state = wait.key(resource) if wait.key else None
+
+            if wait.stable_since is not None and state == wait.stable_state:
+                if (expired or self._clock - wait.stable_since
+                        >= wait.stable_for):
+                    wait.future.set_result((True, resource))
+                    return
+
+            elif wait.stable_for <= 0:
+                wait.future.set_result((True, resource))
+                return
+
+            else:
+                wait.stable_since = self._clock
+                wait.stable_state = state
+                wait.next_check = self._clock + wait.stable_for
+
+        else:
+            if wait.stable_since is not None:
+                self._logger.debug(
+                    'The %(kind)s %(id)s left the desired state while '
+                    'waiting for it to settle' %
+                    {'kind': wait.kind, 'id': resource.id})
+                wait.interval = wait.initial_interval
+
+            wait.stable_since = None
+            wait.next_check = self._clock + wait.interval
+            wait.interval = min(wait.interval * 2, wait.max_interval)
+
+        if expired:
+            wait.future.set_result((False, resource))
+
+        elif wait.deadline is not None:
+            wait.next_check = min(wait.next_check, wait.deadline)
+
+
+class ServerIndex(object):
+    """In-memory index of the servers of the OpenStack project
+
+    The index is filled with one full server listing and then kept up to
+    date incrementally: every refresh only asks Nova for the servers
+    changed since the newest change seen so far, which includes the
+    deleted ones.
+    """
+
+    def __init__(self, connection, logger, min_interval=1):
+        self._cc = connection
+        self._logger = logger
+        self._min_interval = min_interval
+        self._lock = threading.Lock()
+        self._names = {}
+        self._changes_since = None
+        self._last_refresh = None
+
+    def refresh(self):
+        """Bring the index up to date unless it has just been refreshed"""
+        with self._lock:
+            now = time.monotonic()
+            if (self._last_refresh is not None
+                    and now - self._last_refresh < self._min_interval):
+                return
+
+            # NOTE: readers use the index without the lock, so changes go
+            # to a copy which then replaces the index
+            started = datetime.datetime.now(
+                datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            if self._changes_since is None:
+                names = {}
+                servers = self._cc.compute.servers(details=True)
+
+            else:
+                names = dict(self._names)
+                servers = self._cc.compute.servers(
+                    details=True, changes_since=self._changes_since)
+
+            changes_since = self._changes_since
+            for server in servers:
+                if server.status == 'DELETED':
+                    names.pop(server.id, None)
+                else:
+                    names[server.id] = server.name
+
+                if server.updated_at and (changes_since is None
+                                          or server.updated_at
+                                          > changes_since):
+                    changes_since = server.updated_at
+
+            self._names = names
+            # NOTE: an empty project has no changes to start from
+            self._changes_since = changes_since or started
+            self._last_refresh = now
+
+    @property
+    def servers(self):
+        """Return the IDs of the known servers"""
+        self.refresh()
+        return list(self._names)
+
+    def resolve(self, identity):
+        """Find server ID by server ID or unique name
+
+        :param identity: server name or ID
+        :returns: server ID or `None` if the server is not in the index
+            or its name is ambiguous
+        """
+        for attempt in range(2):
+            names = self._names
+            if identity in names:
+                return identity
+
+            server_ids = [server_id for server_id, name in names.items()
+                          if name == identity]
+            if len(server_ids) == 1:
+                return server_ids[0]
+
+            if server_ids or attempt:
+                return
+
+            self.refresh()
+
+    def name(self, server_id):
+        """Return the name of a server in the index or `None`"""
+        return self._names.get(server_id)
+
+
+class FlavorCache(object):
+    """Cache of OpenStack flavors by flavor name and ID
+
+    All flavors are fetched with a single listing, which is repeated once
+    the cached flavors get older than `ttl` seconds. Flavors not in the
+    listing (e.g. deleted or inaccessible ones) are fetched one by one.
+    """
+
+    def __init__(self, connection, logger, ttl=600):
+        self._cc = connection
+        self._logger = logger
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._flavors = {}
+        self._expires = None
+
+    def _load(self):
+        flavors = {}
+        for flavor in self._cc.list_flavors():
+            flavors[flavor.id] = flavor
+            flavors[flavor.name] = flavor
+
+        self._logger.debug('Cached %d OpenStack flavors', len(flavors) // 2)
+
+        self._flavors = flavors
+        self._expires = time.monotonic() + self._ttl
+
+    def get(self, name_or_id):
+        """Get flavor by name or ID
+
+        :param name_or_id: flavor name or ID
+        :returns: flavor object or `None` if the flavor does not exist
+        """
+        with self._lock:
+            if self._expires is None or time.monotonic() >= self._expires:
+                self._load()
+
+            try:
+                return self._flavors[name_or_id]
+
+            except KeyError:
+                flavor = self._cc.get_flavor(name_or_id)
+                if flavor is not None:
+                    self._flavors[name_or_id] = flavor
+
+                return flavor
+
+
+class MetadataCache(object):
+    """Write-through cache of OpenStack server metadata
+
+    Server metadata is taken from the server detail payload, which already
+    carries it, and is only fetched separately when the payload does not.
+    A cached copy is kept for as long as the server's `updated_at`
+    timestamp does not move past the one it was cached at. Our own writes
+    are applied to the cached copy.
+
+    Writes are always sent to Nova, as the cached copy may miss changes
+    made by other emulator processes or outside of the emulator.
+    """
+
+    def __init__(self, connection, logger):
+        self._cc = connection
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._metadata = {}
+
+    def _cached(self, instance):
+        # NOTE: must be called with the lock held, returns the cached copy
+        # or the one carried by the server payload, stored as the new copy
+        updated_at = getattr(instance, 'updated_at', None)
+        cached = self._metadata.get(instance.id)
+        if cached is not None:
+            cached_at, metadata = cached
+            if not isinstance(updated_at, str) or (
+                    cached_at is not None and updated_at <= cached_at):
+                return metadata
+
+        metadata = getattr(instance, 'metadata', None)
+        if isinstance(metadata, dict):
+            return self._store(instance, dict(metadata))
+
+    def _store(self, instance, metadata):
+        updated_at = getattr(instance, 'updated_at', None)
+        self._metadata[instance.id] = (
+            updated_at if isinstance(updated_at, str) else None, metadata)
+        return metadata
+
+    def get(self, instance):
+        """Get server metadata
+
+        :param instance: OpenStack server object
+        :returns: metadata as `dict`
+        """
+        with self._lock:
+            metadata = self._cached(instance)
+            if metadata is not None:
+                return dict(metadata)
+
+        metadata = self._cc.compute.get_server_metadata(
+            instance.id).to_dict()
+
+        with self._lock:
+            self._store(instance, metadata)
+
+        return dict(metadata)
+
+    def set(self, instance, **metadata):
+        """Update server metadata
+
+        :param instance: OpenStack server object
+        :param metadata: metadata items to set
+        """
+        self._cc.compute.set_server_metadata(instance.id, **metadata)
+
+        with self._lock:
+            cached = self._cached(instance)
+            if cached is None:
+                # NOTE: the rest of the metadata is unknown, refetch it
+                self._metadata.pop(instance.id, None)
+
+            else:
+                cached.update(metadata)
 
 
 class OpenStackDriver(AbstractSystemsDriver):
@@ -56,6 +524,9 @@ class OpenStackDriver(AbstractSystemsDriver):
     ISO_MAGIC_BYTES = b'CD001'  # ISO 9660 signature
     ISO_MAGIC_OFFSET = 32769  # First 32768 bytes reserved in ISO format
     ISO_EXTENSION = '.iso'
+    # Enough leading bytes of a streamed image to detect its format
+    HEADER_SIZE = ISO_MAGIC_OFFSET + len(ISO_MAGIC_BYTES)
+    STREAM_CHUNK_SIZE = 65536
     QCOW_EXTENSIONS = ('.qcow2', '.qcow')
 
     BOOT_DEVICE_MAP_REV = {v: k for k, v in BOOT_DEVICE_MAP.items()}
@@ -74,14 +545,38 @@ class OpenStackDriver(AbstractSystemsDriver):
 
     PERMANENT_CACHE = {}
 
+    # Queued operations superseded by a later operation of the same group,
+    # as the later one determines the final state of the server anyway
+    COALESCE_GROUPS = {
+        '_insert_image': 'media',
+        '_eject_image': 'media',
+        '_rebuild_with_imported_image': 'rebuild',
+        '_rebuild_with_blank_image': 'rebuild',
+    }
+
     @classmethod
     def initialize(cls, config, logger, os_cloud, *args, **kwargs):
         cls._config = config
         cls._logger = logger
         cls._os_cloud = os_cloud
 
-        cls._cc = openstack.connect(cloud=os_cloud)
-        cls._executor = futures.ThreadPoolExecutor(max_workers=4)
+        cls._cc = osconnection.connect(os_cloud, config, logger)
+        cls._executor = futures.ThreadPoolExecutor(
+            max_workers=config.get('SUSHY_EMULATOR_OS_MAX_WORKERS', 4))
+        cls._max_queued_operations = config.get(
+            'SUSHY_EMULATOR_OS_MAX_QUEUED_OPERATIONS', 4)
+        cls._server_index = ServerIndex(
+            cls._cc, logger,
+            min_interval=config.get(
+                'SUSHY_EMULATOR_OS_SERVER_INDEX_REFRESH', 1))
+        cls._flavor_cache = FlavorCache(
+            cls._cc, logger,
+            ttl=config.get('SUSHY_EMULATOR_OS_FLAVOR_CACHE_TTL', 600))
+        cls._metadata_cache = MetadataCache(cls._cc, logger)
+        cls._waiter = StatusWaiter(
+            cls._cc, logger,
+            interval=config.get('SUSHY_EMULATOR_OS_WAIT_INTERVAL', 1),
+            max_interval=config.get('SUSHY_EMULATOR_OS_WAIT_MAX_INTERVAL', 5))
 
         # Cache rescue PXE boot enabled flag
         cls._rescue_pxe_enabled = config.get(
@@ -108,6 +603,18 @@ class OpenStackDriver(AbstractSystemsDriver):
         if not cls._rescue_vmedia_enabled:
             cls._init_volume_vmedia_persistent_storage(config, logger)
 
+        cls._share_vmedia_images = config.get(
+            'SUSHY_EMULATOR_OS_VMEDIA_SHARE_IMAGES', False)
+        if cls._share_vmedia_images:
+            # Glance images shared by the servers booting the same URL
+            cls._vmedia_image_registry = memoize.PersistentDict()
+            cls._make_persistent_safe(
+                cls._vmedia_image_registry,
+                config.get('SUSHY_EMULATOR_STATE_DIR'),
+                'vmedia_image_registry', logger)
+        else:
+            cls._vmedia_image_registry = {}
+
         return cls
 
     @classmethod
@@ -245,8 +752,12 @@ class OpenStackDriver(AbstractSystemsDriver):
             bios_image_name, uefi_image_name
         )
 
-    @memoize.memoize()
+    @memoize.memoize(max_size=1024, ttl=60, shared=SHARED_RESOURCE)
     def _get_instance(self, identity):
+        server_id = self._server_index.resolve(identity)
+        if server_id is not None and server_id != identity:
+            raise error.AliasAccessError(server_id)
+
         instance = self._cc.get_server(identity)
         if instance:
             if identity != instance.id:
@@ -262,18 +773,19 @@ class OpenStackDriver(AbstractSystemsDriver):
 
         raise error.NotFound(msg)
 
-    @memoize.memoize(permanent_cache=PERMANENT_CACHE)
     def _get_flavor(self, identity):
         instance = self._get_instance(identity)
-        return self._cc.get_flavor(instance.flavor.original_name)
+        return self._flavor_cache.get(instance.flavor.original_name)
 
-    @memoize.memoize(permanent_cache=PERMANENT_CACHE)
+    @memoize.memoize(permanent_cache=PERMANENT_CACHE, max_size=1024,
+                     shared=SHARED_RESOURCE)
     def _get_image_info(self, identity):
         if not identity:
             return
         return self._cc.image.find_image(identity)
 
-    @memoize.memoize(permanent_cache=PERMANENT_CACHE)
+    @memoize.memoize(permanent_cache=PERMANENT_CACHE, max_size=1024,
+                     shared=SHARED_RESOURCE)
     def _get_volume_info(self, identity):
         if not identity:
             return
@@ -289,16 +801,20 @@ class OpenStackDriver(AbstractSystemsDriver):
 
         return image_id
 
-    def _get_server_metadata(self, identity):
-        return self._cc.compute.get_server_metadata(identity).to_dict()
+    def _get_server_metadata(self, instance):
+        return self._metadata_cache.get(instance)
 
-    def _set_server_metadata(self, identity, metadata):
-        self._cc.compute.set_server_metadata(identity, metadata)
+    def _set_server_metadata(self, instance, **metadata):
+        self._metadata_cache.set(instance, **metadata)
 
     @property
     def _futures(self):
         return FUTURES
 
+    @property
+    def _pending(self):
+        return PENDING
+
     @property
     def connection(self):
         """Return openstack connection
@@ -321,7 +837,7 @@ class OpenStackDriver(AbstractSystemsDriver):
 
         :returns: list of UUIDs representing the systems
         """
-        return [server.id for server in self._cc.list_servers(bare=True)]
+        return self._server_index.servers
 
     def uuid(self, identity):
         """Get computer system UUID by name
@@ -330,6 +846,9 @@ class OpenStackDriver(AbstractSystemsDriver):
 
         :returns: computer system UUID
         """
+        if self._server_index.resolve(identity) == identity:
+            return identity
+
         instance = self._get_instance(identity)
         return instance.id
 
@@ -340,6 +859,9 @@ class OpenStackDriver(AbstractSystemsDriver):
 
         :returns: computer system name
         """
+        if self._server_index.resolve(identity) == identity:
+            return self._server_index.name(identity)
+
         instance = self._get_instance(identity)
         return instance.name
 
@@ -379,54 +901,20 @@ class OpenStackDriver(AbstractSystemsDriver):
         :returns: Tuple of (is_ready, instance) where is_ready is True if
                   task_state is None and stable, False if still busy
         """
-        # Fetch fresh state before checking
-        instance.fetch(self._cc.compute)
-
-        waited = 0
-        wait_interval = initial_wait
-        max_interval = 5  # Cap exponential backoff at 5 seconds
-
-        while waited < max_wait:
-            sleep_time = min(wait_interval, max_wait - waited)
-            time.sleep(sleep_time)
-            waited += sleep_time
-
-            # Still busy, fetch new state and apply exponential backoff
-            if instance.task_state is not None:
-                wait_interval = min(wait_interval * 2, max_interval)
-                instance.fetch(self._cc.compute)
-                continue
-
-            # This catches Nova doing rapid state transitions like:
+        is_ready, instance = self._waiter.wait_for_server(
+            instance, lambda server: server.task_state is None,
+            timeout=max_wait, interval=initial_wait,
+            stable_for=stability_wait)
+
+        if is_ready:
+            # Task state stayed None over the stability period, which
+            # catches Nova doing rapid state transitions like:
             # rebuilding -> None -> powering-off -> None
             self._logger.debug(
-                'Instance %(identity)s task_state cleared after '
-                '%(waited)s seconds, verifying stability' %
-                {'identity': instance.id, 'waited': waited})
-
-            # Cap stability wait to not exceed max_wait
-            stability_sleep = min(stability_wait, max_wait - waited)
-            time.sleep(stability_sleep)
-            waited += stability_sleep
-
-            instance.fetch(self._cc.compute)
-
-            # Task state changed again, reset backoff and continue waiting
-            if instance.task_state is not None:
-                self._logger.debug(
-                    'Instance %(identity)s task_state changed to '
-                    '%(task_state)s during stability check, '
-                    'continuing to wait' %
-                    {'identity': instance.id,
-                     'task_state': instance.task_state})
-                wait_interval = initial_wait
-                continue
-
-            # Task state is stable at None, return success
-            return True, instance
+                'Instance %(identity)s task_state cleared and '
+                'stable' % {'identity': instance.id})
 
-        # Task still running after max_wait
-        return False, instance
+        return is_ready, instance
 
     def _wait_for_power_state_stable(self, instance, max_wait=10,
                                      expected_power_state=None):
@@ -446,7 +934,6 @@ class OpenStackDriver(AbstractSystemsDriver):
         :raises: `error.FishyError` if expected_power_state is provided and
             final state doesn't match
         """
-        waited = 0
         check_interval = 2
 
         # First wait for task_state to clear
@@ -458,50 +945,28 @@ class OpenStackDriver(AbstractSystemsDriver):
                 {'identity': instance.id, 'wait': max_wait})
             return instance
 
-        # Then add stability delay to let power_state fully settle
+        # Then let power_state settle: it has to read the same on two
+        # consecutive checks (and match the expected state if given).
         # This prevents race conditions where we report state too early
-        while waited < max_wait:
-            time.sleep(min(check_interval, max_wait - waited))
-            waited += check_interval
+        def power_settled(server):
+            return (expected_power_state is None
+                    or server.power_state == expected_power_state)
 
-            previous_power_state = instance.power_state
-            instance.fetch(self._cc.compute)
+        is_stable, instance = self._waiter.wait_for_server(
+            instance, power_settled, timeout=max_wait,
+            interval=check_interval, stable_for=check_interval,
+            key=lambda server: server.power_state)
 
-            # Power state has stabilized if it hasn't changed
-            if instance.power_state == previous_power_state:
-                # If expected state is specified, only consider stable if it
-                # matches the expected state
-                if expected_power_state is not None:
-                    if instance.power_state == expected_power_state:
-                        self._logger.debug(
-                            'Instance %(identity)s power state stable at '
-                            'expected state %(power_state)s after '
-                            '%(waited)s seconds' %
-                            {'identity': instance.id,
-                             'power_state': instance.power_state,
-                             'waited': waited})
-                        return instance
-                    # Stable but at wrong state - continue waiting
-                    self._logger.debug(
-                        'Instance %(identity)s power state stable at '
-                        '%(power_state)s but expected %(expected)s, '
-                        'continuing to wait' %
-                        {'identity': instance.id,
-                         'power_state': instance.power_state,
-                         'expected': expected_power_state})
-                    continue
-                else:
-                    # No expected state specified, any stable state is OK
-                    self._logger.debug(
-                        'Instance %(identity)s power state stable at '
-                        '%(power_state)s after %(waited)s seconds' %
-                        {'identity': instance.id,
-                         'power_state': instance.power_state,
-                         'waited': waited})
-                    break
+        if is_stable:
+            self._logger.debug(
+                'Instance %(identity)s power state stable at '
+                '%(power_state)s' %
+                {'identity': instance.id,
+                 'power_state': instance.power_state})
+            return instance
 
-        # If we exited the loop and expected_power_state was specified,
-        # verify we reached the expected state
+        # If the power state did not settle and expected_power_state was
+        # specified, verify we reached the expected state
         if expected_power_state is not None:
             instance.fetch(self._cc.compute)
             if instance.power_state != expected_power_state:
@@ -521,7 +986,7 @@ class OpenStackDriver(AbstractSystemsDriver):
                     'status=%(status)s, vm_state=%(vm_state)s, '
                     'task_state=%(task_state)s%(fault)s' %
                     {'identity': instance.id,
-                     'waited': waited,
+                     'waited': max_wait,
                      'expected': expected_power_state,
                      'actual': instance.power_state,
                      'status': instance.status,
@@ -897,7 +1362,7 @@ class OpenStackDriver(AbstractSystemsDriver):
             # Use libvirt:pxe-first metadata (default behavior)
             # NOTE(etingof): the following probably only works with
             # libvirt-backed compute nodes
-            metadata = self._get_server_metadata(instance.id)
+            metadata = self._get_server_metadata(instance)
             if metadata.get('libvirt:pxe-first'):
                 return self.BOOT_DEVICE_MAP_REV['network']
             else:
@@ -931,8 +1396,8 @@ class OpenStackDriver(AbstractSystemsDriver):
             # Use libvirt:pxe-first metadata (default/legacy behavior)
             # NOTE(etingof): the following probably only works with
             # libvirt-backed compute nodes
-            self._cc.compute.set_server_metadata(
-                instance.id,
+            self._set_server_metadata(
+                instance,
                 **{'libvirt:pxe-first': '1'
                    if target == self.BOOT_DEVICE_MAP['Pxe'] else ''}
             )
@@ -1314,6 +1779,25 @@ class OpenStackDriver(AbstractSystemsDriver):
 
         return disk_format
 
+    def _get_disk_format_from_header(self, header):
+        """Detect disk format from the leading bytes of an image.
+
+        :param header: bytes from the start of the image
+        :returns: String disk format ('iso', 'qcow2', or 'raw')
+        """
+        if header.startswith(self.QCOW_MAGIC_BYTES):
+            disk_format = self.DISK_FORMAT_QCOW2
+        elif (header[self.ISO_MAGIC_OFFSET:self.HEADER_SIZE]
+              == self.ISO_MAGIC_BYTES):
+            disk_format = self.DISK_FORMAT_ISO
+        else:
+            disk_format = self.DISK_FORMAT_RAW
+
+        self._logger.debug('Detected %s format from image header',
+                           disk_format)
+
+        return disk_format
+
     def _get_disk_format_from_filename(self, filename):
         """Infer disk format from filename extension.
 
@@ -1335,14 +1819,16 @@ class OpenStackDriver(AbstractSystemsDriver):
 
         return disk_format
 
-    def _get_disk_format(self, filename, local_file_path=None):
+    def _get_disk_format(self, filename, local_file_path=None, header=None):
         """Determine the disk format for an image.
 
-        Uses content inspection when local file is available, otherwise
-        infers from filename extension. Can be overridden by configuration.
+        Uses content inspection when local file or the leading bytes of
+        the image are available, otherwise infers from filename extension.
+        Can be overridden by configuration.
 
         :param filename: The filename of the image
         :param local_file_path: Optional local path to the image file
+        :param header: Optional leading bytes of the image being streamed
         :returns: String disk format ('iso', 'qcow2', or 'raw')
         """
         # Check for configuration override first
@@ -1356,10 +1842,128 @@ class OpenStackDriver(AbstractSystemsDriver):
         if local_file_path:
             # File is local - inspect content for accurate detection
             return self._get_disk_format_from_content(local_file_path)
+        elif header is not None:
+            # Image is streamed - inspect the bytes read ahead
+            return self._get_disk_format_from_header(header)
         else:
             # No local file - use filename extension as hint
             return self._get_disk_format_from_filename(filename)
 
+    def _open_image_stream(self, image_url):
+        """Start downloading an image for a streamed upload
+
+        Reads ahead enough of the image to detect its format.
+
+        :param image_url: URL to download the image from
+        :returns: a tuple of (response, header, data) where `header` are
+            the leading bytes of the image and `data` is an iterator over
+            all of the image content
+        :raises: `error.FishyError` if image download fails
+        """
+        rsp = requests.get(
+            image_url, stream=True,
+            verify=self._config.get('SUSHY_EMULATOR_VMEDIA_VERIFY_SSL',
+                                    False))
+        if rsp.status_code >= 400:
+            rsp.close()
+            target_code = 502 if rsp.status_code >= 500 else 400
+            raise error.FishyError(
+                "Cannot download virtual media: got error %s "
+                "from the server" % rsp.status_code, code=target_code)
+
+        chunks = rsp.iter_content(chunk_size=self.STREAM_CHUNK_SIZE)
+        read_ahead = []
+        header = bytearray()
+        for chunk in chunks:
+            read_ahead.append(chunk)
+            header += chunk
+            if len(header) >= self.HEADER_SIZE:
+                break
+
+        def data():
+            yield from read_ahead
+            yield from chunks
+
+        return rsp, bytes(header), data()
+
+    @staticmethod
+    def _get_shared_image_key(image_url, image_properties, vmedia_type):
+        return json.dumps([image_url, vmedia_type, image_properties],
+                          sort_keys=True)
+
+    def _acquire_shared_image(self, key, instance_id):
+        """Take a reference to a shared vmedia image
+
+        :param key: shared image key
+        :param instance_id: ID of the instance referencing the image
+        :returns: image object or `None` if there is no usable image
+        """
+        # NOTE: the registry is shared by the emulator processes, so are
+        # the locks with SUSHY_EMULATOR_INTERPROCESS_LOCKS set
+        with locks.get(self._config).lock(key):
+            entry = self._vmedia_image_registry.get(key)
+            if entry is None:
+                return
+
+            image = self._cc.image.find_image(entry['image_id'])
+            if (image is None
+                    or image.status not in ('queued', 'importing',
+                                            'active')):
+                self._logger.debug(
+                    'Shared vmedia image %(image)s is gone or broken, '
+                    'forgetting it' % {'image': entry['image_id']})
+                del self._vmedia_image_registry[key]
+                return
+
+            servers = set(entry['servers'])
+            servers.add(instance_id)
+            self._vmedia_image_registry[key] = dict(
+                entry, servers=sorted(servers))
+
+        return image
+
+    def _register_shared_image(self, key, image_id, instance_id):
+        with locks.get(self._config).lock(key):
+            if key in self._vmedia_image_registry:
+                # Lost a race to another server inserting the same image,
+                # ours stays private to this instance
+                return
+
+            self._vmedia_image_registry[key] = {
+                'image_id': image_id, 'servers': [instance_id]}
+
+    def _release_vmedia_image(self, image_id, instance_id):
+        """Drop a reference to a vmedia image
+
+        :param image_id: ID of the image
+        :param instance_id: ID of the instance that used the image
+        :returns: `True` if the image is not used by any other instance
+            and should be deleted, `False` otherwise
+        """
+        keys = [key for key, entry in self._vmedia_image_registry.items()
+                if entry['image_id'] == image_id]
+
+        for key in keys:
+            with locks.get(self._config).lock(key):
+                entry = self._vmedia_image_registry.get(key)
+                if entry is None or entry['image_id'] != image_id:
+                    continue
+
+                servers = [server for server in entry['servers']
+                           if server != instance_id]
+                if servers:
+                    self._vmedia_image_registry[key] = dict(
+                        entry, servers=servers)
+                    self._logger.debug(
+                        'Vmedia image %(image)s still used by %(count)s '
+                        'instance(s), not deleting it' %
+                        {'image': image_id, 'count': len(servers)})
+                    return False
+
+                del self._vmedia_image_registry[key]
+
+        return True
+
     def insert_image(self, identity, image_url, local_file_path=None):
         self._logger.debug(
             'Creating task to insert image for %(identity)s' %
@@ -1371,7 +1975,7 @@ class OpenStackDriver(AbstractSystemsDriver):
         # Common preparation for both approaches
         parsed_url = urlparse.urlparse(image_url)
         filename = os.path.basename(parsed_url.path)
-        disk_format = self._get_disk_format(filename, local_file_path)
+
         unique = base64.urlsafe_b64encode(os.urandom(6)).decode('utf-8')
         boot_mode = self.get_boot_mode(identity)
 
@@ -1400,6 +2004,45 @@ class OpenStackDriver(AbstractSystemsDriver):
             attrs_dict = self._volume_vmedia_attrs
             vmedia_type = 'volume'
 
+        share_key = None
+        if self._share_vmedia_images:
+            share_key = self._get_shared_image_key(
+                image_url, image_properties, vmedia_type)
+            instance = self._get_instance(identity)
+            image = self._acquire_shared_image(share_key, instance.id)
+            if image is not None:
+                self._logger.debug(
+                    'Reusing vmedia image %(image)s of %(url)s for '
+                    '%(identity)s' % {'image': image.id, 'url': image_url,
+                                      'identity': identity})
+                if local_file_path:
+                    self._delete_local_file(local_file_path)
+
+                images_dict[instance.id] = image.id
+                attrs_dict[instance.id] = {'image_url': image_url}
+                return image.id, image.name
+
+        stream = None
+        if (not local_file_path
+                and self._config.get(
+                    'SUSHY_EMULATOR_OS_VMEDIA_IMAGE_FILE_UPLOAD', False)
+                and self._config.get(
+                    'SUSHY_EMULATOR_OS_VMEDIA_IMAGE_STREAM_UPLOAD', False)):
+            try:
+                stream, header, data = self._open_image_stream(image_url)
+
+            except Exception as ex:
+                msg = 'Failed insert image from URL %s: %s' % (image_url, ex)
+                self._logger.exception(msg)
+                if not isinstance(ex, error.FishyError):
+                    ex = error.FishyError(msg)
+                raise ex
+
+            disk_format = self._get_disk_format(filename, header=header)
+
+        else:
+            disk_format = self._get_disk_format(filename, local_file_path)
+
         # Build image attributes
         image_attrs = {
             'name': '%s %s' % (filename, unique),
@@ -1414,12 +2057,20 @@ class OpenStackDriver(AbstractSystemsDriver):
         if local_file_path:
             image_attrs['filename'] = local_file_path
 
+        elif stream is not None:
+            image_attrs['data'] = data
+
         image = None
         try:
             # Create image and begin importing
             image = self._cc.image.create_image(**image_attrs)
 
-            if local_file_path:
+            if stream is not None:
+                self._logger.debug(
+                    'Uploaded image streamed from %(url)s for '
+                    '%(identity)s' % {'identity': identity,
+                                      'url': image_url})
+            elif local_file_path:
                 self._logger.debug(
                     'Uploading image file %(file)s from source %(url)s '
                     'for %(identity)s' % {'identity': identity,
@@ -1442,6 +2093,9 @@ class OpenStackDriver(AbstractSystemsDriver):
                 vmedia_attrs['local_file_path'] = local_file_path
             attrs_dict[instance.id] = vmedia_attrs
 
+            if share_key is not None:
+                self._register_shared_image(share_key, image.id, instance.id)
+
             self._logger.debug(
                 'Vmedia image %(image)s stored for %(identity)s (%(type)s)' %
                 {'image': image.id, 'identity': identity, 'type': vmedia_type})
@@ -1465,6 +2119,10 @@ class OpenStackDriver(AbstractSystemsDriver):
                 ex = error.FishyError(msg)
             raise ex
 
+        finally:
+            if stream is not None:
+                stream.close()
+
         return image.id, image.name
 
     def eject_image(self, identity):
@@ -1509,12 +2167,14 @@ class OpenStackDriver(AbstractSystemsDriver):
             # Delete image from Glance
             image = self._cc.image.find_image(image_id)
             if image:
-                self._logger.debug(
-                    'Deleting %(type)s vmedia image %(image)s for '
-                    '%(identity)s' %
-                    {'type': vmedia_type, 'image': image.id,
-                     'identity': identity})
-                self._cc.delete_image(image.id)
+                if self._release_vmedia_image(image.id, instance.id):
+                    self._logger.debug(
+                        'Deleting %(type)s vmedia image %(image)s for '
+                        '%(identity)s' %
+                        {'type': vmedia_type, 'image': image.id,
+                         'identity': identity})
+                    self._cc.delete_image(image.id)
+                    memoize.invalidate(self._get_image_info, image.id)
             else:
                 raise error.FishyError(
                     'Image not found in image service.')
@@ -1547,24 +2207,112 @@ class OpenStackDriver(AbstractSystemsDriver):
             self._logger.exception(msg)
             raise error.FishyError(msg)
 
-    def _submit_future(self, run_async, fn, identity, *args, **kwargs):
-        future = self._futures.get(identity, None)
-        if future is not None:
-            if future.running():
-                raise error.Conflict(
-                    'An insert or eject operation is already in progress for '
-                    '%(identity)s' % {'identity': identity})
+    def _supersedes(self, fn, queued_fn):
+        group = self.COALESCE_GROUPS.get(fn.__name__)
+        if group is None or group != self.COALESCE_GROUPS.get(
+                queued_fn.__name__):
+            return False
+
+        # An eject still has to remove the current media before a new
+        # one is inserted, and the caller of an insert expects the inserted
+        # image rather than the outcome of an eject
+        return not (group == 'media' and fn.__name__ != queued_fn.__name__)
+
+    def _find_superseded(self, fn, pending):
+        """Find the queued operation a new one makes unnecessary
+
+        :param fn: callable of the new operation
+        :param pending: list of the queued operations
+        :returns: index of the superseded operation or `None`
+        """
+        for index in range(len(pending) - 1, -1, -1):
+            queued_fn = pending[index][0]
+            if self._supersedes(fn, queued_fn):
+                return index
+
+            # An insert followed by an eject is undone anyway, and the
+            # later insert replaces it
+            if not (fn.__name__ == '_insert_image'
+                    and queued_fn.__name__ == '_eject_image'):
+                return
 
+    @staticmethod
+    def _chain_future(source, target):
+        def copy(future):
             ex = future.exception()
-            del self._futures[identity]
             if ex is not None:
-                # A previous operation failed, and the server may be in an
-                # unknown state. Raise the previous error as an error for
-                # this operation.
-                raise ex
+                target.set_exception(ex)
+            else:
+                target.set_result(future.result())
+
+        source.add_done_callback(copy)
+
+    def _submit_future(self, run_async, fn, identity, *args, **kwargs):
+        """Run an operation on a server after the ones already submitted
+
+        Operations on the same server run one at a time, in the order of
+        submission. Queued operations which have not started yet are
+        dropped when a later operation supersedes them, and their callers
+        get the outcome of the later operation.
+
+        :param run_async: return right away instead of waiting for the
+            operation to complete
+        :param fn: callable to run, receives `identity` and the rest of
+            the arguments
+        :param identity: OpenStack instance name or ID
+        :returns: the result of `fn` or `None` if `run_async` is set
+        :raises: `error.Conflict` if too many operations are queued
+        :raises: the exception of a previous operation if it failed,
+            as the server may be in an unknown state
+        """
+        future = futures.Future()
+        start = False
+
+        with PENDING_LOCK:
+            previous = self._futures.get(identity)
+            if previous is not None and previous.done():
+                ex = previous.exception()
+                del self._futures[identity]
+                if ex is not None:
+                    # A previous operation failed, and the server may be in
+                    # an unknown state. Raise the previous error as an error
+                    # for this operation.
+                    raise ex
+
+                previous = None
+
+            pending = self._pending.setdefault(identity, [])
+
+            if previous is None:
+                start = True
+
+            else:
+                index = self._find_superseded(fn, pending)
+                if (index is None
+                        and len(pending) >= self._max_queued_operations):
+                    raise error.Conflict(
+                        'Too many insert or eject operations are queued for '
+                        '%(identity)s' % {'identity': identity})
+
+                if index is not None:
+                    superseded = pending.pop(index)
+                    self._logger.debug(
+                        'Queued %(old)s for %(identity)s superseded by '
+                        '%(new)s' % {'old': superseded[0].__name__,
+                                     'new': fn.__name__,
+                                     'identity': identity})
+                    # The caller of the superseded operation gets the
+                    # outcome of the one that replaced it
+                    self._chain_future(future, superseded[3])
+
+                pending.append((fn, args, kwargs, future))
+
+            self._futures[identity] = future
+
+        if start:
+            self._executor.submit(
+                self._run_operations, identity, fn, args, kwargs, future)
 
-        future = self._executor.submit(fn, identity, *args, **kwargs)
-        self._futures[identity] = future
         if run_async:
             return
         ex = future.exception()
@@ -1572,6 +2320,35 @@ class OpenStackDriver(AbstractSystemsDriver):
             raise ex
         return future.result()
 
+    def _run_operations(self, identity, fn, args, kwargs, future):
+        while True:
+            try:
+                result = fn(identity, *args, **kwargs)
+
+            except Exception as ex:
+                failure = ex
+                future.set_exception(ex)
+
+            else:
+                failure = None
+                future.set_result(result)
+
+            with PENDING_LOCK:
+                pending = self._pending.get(identity)
+                if not pending:
+                    self._pending.pop(identity, None)
+                    return
+
+                if failure is not None:
+                    # The server may be in an unknown state, fail the
+                    # queued operations too
+                    for queued in pending:
+                        queued[3].set_exception(failure)
+                    del self._pending[identity]
+                    return
+
+                fn, args, kwargs, future = pending.pop(0)
+
     def _rebuild_with_imported_image(self, identity, image_id):
         image_url = None
         image = None
@@ -1589,9 +2366,9 @@ class OpenStackDriver(AbstractSystemsDriver):
             image_local_file = vmedia_attrs.get('local_file_path')
 
             # Wait for image to be imported
-            while image.status in ('queued', 'importing'):
-                time.sleep(1)
-                image = self._cc.image.get_image(image)
+            _, image = self._waiter.wait_for_image(
+                image, lambda image: image.status not in ('queued',
+                                                          'importing'))
 
             if image.status != 'active':
                 raise error.FishyError('Image import ended with status %s' %
@@ -1601,9 +2378,9 @@ class OpenStackDriver(AbstractSystemsDriver):
                 'Rebuilding %(identity)s with image %(image)s' %
                 {'identity': identity, 'image': image.id})
             server = self._cc.compute.rebuild_server(identity, image.id)
-            while server.status == 'REBUILD':
-                server = self._cc.compute.get_server(identity)
-                time.sleep(1)
+            memoize.invalidate(self._get_instance, identity)
+            _, server = self._waiter.wait_for_server(
+                server, lambda server: server.status != 'REBUILD')
             if server.status not in ('ACTIVE', 'SHUTOFF'):
                 raise error.FishyError('Server rebuild attempt resulted in '
                                        'status %s' % server.status)
@@ -1614,7 +2391,8 @@ class OpenStackDriver(AbstractSystemsDriver):
             msg = 'Failed insert image from URL %s: %s' % (image_url, ex)
             self._logger.exception(msg)
             # Clean up on failure
-            if image:
+            if image and (instance is None or self._release_vmedia_image(
+                    image.id, instance.id)):
                 try:
                     self._cc.delete_image(image.id)
                 except Exception:
@@ -1661,10 +2439,10 @@ class OpenStackDriver(AbstractSystemsDriver):
                 'Rebuilding %(identity)s with image %(image)s' %
                 {'identity': identity, 'image': image.id})
             server = self._cc.compute.rebuild_server(identity, image.id)
+            memoize.invalidate(self._get_instance, identity)
 
-            while server.status == 'REBUILD':
-                server = self._cc.compute.get_server(identity)
-                time.sleep(1)
+            _, server = self._waiter.wait_for_server(
+                server, lambda server: server.status != 'REBUILD')
             if server.status not in ('ACTIVE', 'SHUTOFF'):
                 raise error.FishyError('Server rebuild attempt resulted in '
                                        'status %s' % server.status)
@@ -0,0 +1,133 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import queue
+import threading
+import weakref
+
+try:
+    from keystoneauth1 import session as ks_session
+    import openstack
+
+except ImportError:
+    ks_session = None
+    openstack = None
+
+
+class _Lease(object):
+    """Marker living as long as a thread holds a pooled connection"""
+
+
+class ConnectionPool(object):
+    """Pool of OpenStack connections sharing one authentication
+
+    Stands in for an `openstack.connection.Connection` object: attribute
+    access is forwarded to a connection checked out by the calling thread.
+    The connection goes back to the pool when the thread ends.
+
+    All pooled connections share the authentication plugin (and therefore
+    the token) of the initial connection, but each has its own HTTP
+    session, so requests made from different threads do not contend for
+    one set of HTTP connections. When all pooled connections are taken,
+    the initial connection is shared by the extra threads.
+    """
+
+    def __init__(self, connection, size, http_pool_maxsize=10, logger=None):
+        self._base = connection
+        self._size = size
+        self._http_pool_maxsize = http_pool_maxsize
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._local = threading.local()
+
+    def _new_connection(self):
+        base_session = self._base.session
+        session = ks_session.Session(
+            auth=base_session.auth, verify=base_session.verify,
+            cert=base_session.cert, timeout=base_session.timeout)
+
+        adapter = ks_session.TCPKeepAliveAdapter(
+            pool_maxsize=self._http_pool_maxsize)
+        session.session.mount('https://', adapter)
+        session.session.mount('http://', adapter)
+
+        return openstack.connection.Connection(
+            session=session, **self._base.config.config)
+
+    def _checkout(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            return connection
+
+        try:
+            connection = self._idle.get_nowait()
+
+        except queue.Empty:
+            with self._lock:
+                if self._created >= self._size:
+                    return self._base
+
+                self._created += 1
+
+            try:
+                connection = self._new_connection()
+
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+            if self._logger:
+                self._logger.debug(
+                    'Opened pooled OpenStack connection %d of %d',
+                    self._created, self._size)
+
+        lease = _Lease()
+        weakref.finalize(lease, self._idle.put, connection)
+
+        self._local.connection = connection
+        self._local.lease = lease
+
+        return connection
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return getattr(self._checkout(), name)
+
+
+def connect(cloud, config, logger):
+    """Connect to an OpenStack cloud
+
+    :param cloud: cloud name in `clouds.yaml`
+    :param config: emulator configuration
+    :param logger: logger object
+    :returns: `openstack.connection.Connection` object or, if connection
+        pooling is configured, a `ConnectionPool` standing in for it
+    """
+    connection = openstack.connect(cloud=cloud)
+
+    size = config.get('SUSHY_EMULATOR_OS_CONNECTION_POOL_SIZE')
+    if not size:
+        return connection
+
+    logger.debug('Using a pool of up to %d connections to cloud %s',
+                 size, cloud)
+
+    return ConnectionPool(
+        connection, size,
+        http_pool_maxsize=config.get(
+            'SUSHY_EMULATOR_OS_HTTP_POOL_MAXSIZE', 10),
+        logger=logger)
@@ -23,7 +23,9 @@ from urllib import parse as urlparse
 
 import requests
 
+from sushy_tools.emulator import locks
 from sushy_tools.emulator import memoize
+from sushy_tools.emulator import profiles
 from sushy_tools.emulator.resources import base
 from sushy_tools import error
 
@@ -113,6 +115,7 @@ class BaseDriver(base.DriverBase):
             }
 
         self._device_types = device_types
+        self._profiles = profiles.load(config)
 
     def _get_device(self, identity, device):
         try:
@@ -188,6 +191,7 @@ class BaseDriver(base.DriverBase):
                           device_info.get('Password', ''),
                           device_info.get('Verify', False))
 
+    @locks.locked
     def update_device_info(self, identity, device, verify=False):
         """Update the virtual media device
 
@@ -200,6 +204,7 @@ class BaseDriver(base.DriverBase):
         device_info['Verify'] = verify
         self._devices[(identity, device)] = device_info
 
+    @locks.locked
     def add_certificate(self, identity, device, cert_string, cert_type):
         device_info = self._get_device(identity, device)
 
@@ -212,6 +217,7 @@ class BaseDriver(base.DriverBase):
 
         return Certificate(_CERT_ID, cert_string, cert_type)
 
+    @locks.locked
     def replace_certificate(self, identity, device, cert_id,
                             cert_string, cert_type):
         device_info = self._get_device(identity, device)
@@ -233,6 +239,7 @@ class BaseDriver(base.DriverBase):
         return [Certificate(_CERT_ID, certificate['String'],
                             certificate['Type'])]
 
+    @locks.locked
     def delete_certificate(self, identity, device, cert_id):
         device_info = self._get_device(identity, device)
         if cert_id != _CERT_ID or "Certificate" not in device_info:
@@ -346,6 +353,36 @@ def _write_from_response(image_url, rsp, tmp_file):
 class StaticDriver(BaseDriver):
     """Redfish virtual media simulator for local image storage."""
 
+    def _use_network_disk(self, image_url, auth, verify_media_cert,
+                          custom_cert):
+        """Check if the image can be attached by URL instead of fetched
+
+        Only plain HTTP(S) images without credentials qualify, and only
+        with the global TLS verification setting since that is all the
+        network disk can be configured with.
+        """
+        if not self._config.get('SUSHY_EMULATOR_VMEDIA_NETWORK_DISK'):
+            return False
+
+        if urlparse.urlparse(image_url).scheme not in ('http', 'https'):
+            return False
+
+        if auth or custom_cert is not None:
+            self._logger.debug(
+                'Image %s requires credentials or a custom TLS '
+                'certificate, falling back to downloading it', image_url)
+            return False
+
+        if bool(verify_media_cert) != bool(self._config.get(
+                'SUSHY_EMULATOR_VMEDIA_VERIFY_SSL', False)):
+            self._logger.debug(
+                'Image %s requires non-default TLS verification, falling '
+                'back to downloading it', image_url)
+            return False
+
+        return True
+
+    @profiles.profiled
     def insert_image(self, identity, device, image_url,
                      inserted=True, write_protected=True,
                      username=None, password=None):
@@ -359,6 +396,9 @@ class StaticDriver(BaseDriver):
         :param write_protected: prevent write access the inserted media
         :raises: `FishyError` if image can't be manipulated
         """
+        # NOTE: the image may take long to download, so only the update of
+        # the device record is done under the lock of the resource
+
         # Validate IP family if configured
         required_ip_family = self._config.get(
             'SUSHY_EMULATOR_VIRTUAL_MEDIA_IP_FAMILY')
@@ -387,25 +427,45 @@ class StaticDriver(BaseDriver):
 
         auth = (username, password) if (username and password) else None
 
-        local_file, local_file_path = self._get_image(
-            image_url, auth, verify_media_cert, custom_cert)
+        if self._use_network_disk(image_url, auth, verify_media_cert,
+                                  custom_cert):
+            local_file = (os.path.basename(urlparse.urlparse(image_url).path)
+                          or 'image.iso')
+            local_file_path = image_url
+            downloaded_file = None
 
-        self._logger.debug(
-            'Fetched image %(url)s for %(identity)s' % {
-                'identity': identity, 'url': image_url})
+            self._logger.debug(
+                'Attaching image %(url)s to %(identity)s as a network '
+                'disk' % {'identity': identity, 'url': image_url})
 
-        device_info['Image'] = image_url
-        device_info['ImageName'] = local_file
-        device_info['Inserted'] = inserted
-        device_info['WriteProtected'] = write_protected
-        device_info['UserName'] = username or ''
-        device_info['Password'] = password or ''
-        device_info['_local_file'] = local_file_path
+        else:
+            local_file, local_file_path = self._get_image(
+                image_url, auth, verify_media_cert, custom_cert)
+            downloaded_file = local_file_path
 
-        self._devices.update({(identity, device): device_info})
+            self._logger.debug(
+                'Fetched image %(url)s for %(identity)s' % {
+                    'identity': identity, 'url': image_url})
+
+        with locks.get(self._config).lock(identity):
+            device_info = self._get_device(identity, device)
+
+            if downloaded_file:
+                device_info['_local_file'] = downloaded_file
+
+            device_info['Image'] = image_url
+            device_info['ImageName'] = local_file
+            device_info['Inserted'] = inserted
+            device_info['WriteProtected'] = write_protected
+            device_info['UserName'] = username or ''
+            device_info['Password'] = password or ''
+
+            self._devices.update({(identity, device): device_info})
 
         return local_file_path
 
+    @profiles.profiled
+    @locks.locked
     def eject_image(self, identity, device):
         """Eject virtual media image
 
@@ -501,7 +561,9 @@ class OpenstackDriver(BaseDriver):
 
         local_file_path = None
         if self._config.get(
-                'SUSHY_EMULATOR_OS_VMEDIA_IMAGE_FILE_UPLOAD', False):
+                'SUSHY_EMULATOR_OS_VMEDIA_IMAGE_FILE_UPLOAD', False
+        ) and not self._config.get(
+                'SUSHY_EMULATOR_OS_VMEDIA_IMAGE_STREAM_UPLOAD', False):
             self._logger.debug('Downloading image for %(identity)s'
                                % {'identity': identity})
             _, local_file_path = self._get_image(
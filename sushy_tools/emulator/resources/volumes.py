@@ -15,6 +15,7 @@
 
 import uuid
 
+from sushy_tools.emulator import locks
 from sushy_tools.emulator import memoize
 from sushy_tools.emulator.resources import base
 
@@ -56,6 +57,7 @@ class StaticDriver(base.DriverBase):
                    'and Storage ID %s' % (uu_identity, storage_id))
             self._logger.debug(msg)
 
+    @locks.locked
     def add_volume(self, uu_identity, storage_id, vol):
         if not self._volumes[(uu_identity, storage_id)]:
             self._volumes[(uu_identity, storage_id)] = []
@@ -64,6 +66,7 @@ class StaticDriver(base.DriverBase):
         vol_col.append(vol)
         self._volumes.update({(uu_identity, storage_id): vol_col})
 
+    @locks.locked
     def delete_volume(self, uu_identity, storage_id, vol):
         try:
             vol_col = self._volumes[(uu_identity, storage_id)]
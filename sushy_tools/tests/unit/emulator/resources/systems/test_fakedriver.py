@@ -14,6 +14,7 @@ import time
 from unittest import mock
 
 from oslotest import base
+import requests
 
 from sushy_tools.emulator.resources.systems import fakedriver
 from sushy_tools import error
@@ -32,6 +33,7 @@ class FakeDriverTestCase(base.BaseTestCase):
         with mock.patch('sushy_tools.emulator.memoize.PersistentDict',
                         return_value=self.cache, autospec=True):
             self.test_driver = test_driver_class()
+        self.addCleanup(self.test_driver._scheduler.stop)
 
     def test_systems(self):
         self.assertEqual([UUID], self.test_driver.systems)
@@ -74,6 +76,58 @@ class FakeDriverTestCase(base.BaseTestCase):
                                return_value=new_time):
             self.assertEqual('On', self.test_driver.get_power_state(UUID))
 
+    @mock.patch('random.randint', autospec=True, return_value=0)
+    def test_power_state_applied(self, mock_rand):
+        self.test_driver.set_power_state(UUID, 'On')
+
+        for _ in range(500):
+            if self.cache[UUID]['power_state'] == 'On':
+                break
+            time.sleep(0.01)
+
+        self.assertEqual('On', self.cache[UUID]['power_state'])
+        self.assertIsNone(self.cache[UUID]['pending_power'])
+        self.assertEqual(2, self.cache[UUID]['generation'])
+
+    @mock.patch('random.randint', autospec=True, return_value=1000)
+    def test_power_state_superseded(self, mock_rand):
+        self.test_driver.set_power_state(UUID, 'On')
+        self.test_driver.set_power_state(UUID, 'ForceOff')
+
+        self.test_driver._apply_pending_power(UUID, 1)
+        self.assertEqual('Off', self.cache[UUID]['pending_power'][
+            'power_state'])
+
+        self.test_driver._apply_pending_power(UUID, 2)
+        self.assertIsNone(self.cache[UUID]['pending_power'])
+        self.assertEqual('Off', self.cache[UUID]['power_state'])
+
+    @mock.patch.object(fakedriver.FakeDriver, '_send_external_notification',
+                       autospec=True)
+    @mock.patch('random.randint', autospec=True, return_value=1000)
+    def test_power_state_notification(self, mock_rand, mock_notify):
+        self.cache[UUID]['external_notifier'] = True
+        self.test_driver.set_power_state(UUID, 'On')
+        mock_notify.reset_mock()
+
+        self.test_driver._apply_pending_power(UUID, 1)
+
+        mock_notify.assert_called_once_with(
+            self.test_driver, self.cache[UUID])
+        self.assertEqual('On', self.cache[UUID]['power_state'])
+
+    @mock.patch.object(fakedriver.PowerScheduler, 'schedule', autospec=True)
+    def test_pending_power_scheduled(self, mock_schedule):
+        self.cache[UUID]['pending_power'] = {
+            'power_state': 'On', 'apply_time': 42, 'generation': 3}
+
+        with mock.patch('sushy_tools.emulator.memoize.PersistentDict',
+                        return_value=self.cache, autospec=True):
+            test_driver = fakedriver.FakeDriver()
+
+        mock_schedule.assert_called_once_with(
+            test_driver._scheduler, 42, UUID, 3)
+
     def test_boot_mode(self):
         self.assertEqual('UEFI', self.test_driver.get_boot_mode(UUID))
         self.test_driver.set_boot_mode(UUID, 'legacy')
@@ -102,3 +156,306 @@ class FakeDriverTestCase(base.BaseTestCase):
         self.assertEqual([{'id': '00:5c:52:31:3a:9c',
                            'mac': '00:5c:52:31:3a:9c'}],
                          self.test_driver.get_nics(UUID))
+
+    def test_existing_systems(self):
+        self.cache[UUID]['power_state'] = 'On'
+
+        with mock.patch('sushy_tools.emulator.memoize.PersistentDict',
+                        return_value=self.cache, autospec=True):
+            test_driver = fakedriver.FakeDriver()
+        self.addCleanup(test_driver._scheduler.stop)
+
+        self.assertEqual('On', test_driver.get_power_state(UUID))
+
+
+class FakeDriverWriteBackTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        test_driver_class = fakedriver.FakeDriver.initialize(
+            {'SUSHY_EMULATOR_FAKE_WRITE_BACK_INTERVAL': 3600},
+            mock.MagicMock())
+        self.cache = {}
+        with mock.patch('sushy_tools.emulator.memoize.PersistentDict',
+                        return_value=self.cache, autospec=True):
+            self.test_driver = test_driver_class()
+        self.addCleanup(self.test_driver._systems.close)
+        self.addCleanup(self.test_driver._scheduler.stop)
+
+    def test_systems(self):
+        self.assertEqual([UUID], self.test_driver.systems)
+        self.assertEqual(UUID, self.test_driver.uuid('fake'))
+        self.assertEqual('fake', self.cache[UUID]['name'])
+
+    def test_write_back(self):
+        self.test_driver.set_boot_device(UUID, 'Cd')
+        self.assertEqual('Cd', self.test_driver.get_boot_device(UUID))
+        self.assertNotIn('boot_device', self.cache[UUID])
+
+        self.test_driver._systems.flush()
+
+        self.assertEqual('Cd', self.cache[UUID]['boot_device'])
+
+
+class PowerSchedulerTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.callback = mock.Mock()
+        self.scheduler = fakedriver.PowerScheduler(
+            self.callback, mock.Mock())
+        self.addCleanup(self.scheduler.stop)
+
+    def _wait_for_calls(self, count):
+        for _ in range(500):
+            if self.callback.call_count >= count:
+                break
+            time.sleep(0.01)
+
+    def test_schedule(self):
+        now = time.time()
+        self.scheduler.schedule(now + 3600, 'uuid0', 1)
+        self.scheduler.schedule(now - 1, 'uuid1', 2)
+        self.scheduler.schedule(now - 2, 'uuid2', 3)
+
+        self._wait_for_calls(2)
+
+        self.assertEqual([mock.call('uuid2', 3), mock.call('uuid1', 2)],
+                         self.callback.call_args_list)
+
+    def test_callback_fails(self):
+        self.callback.side_effect = [RuntimeError, None]
+        now = time.time()
+        self.scheduler.schedule(now - 2, 'uuid0', 1)
+        self.scheduler.schedule(now - 1, 'uuid1', 2)
+
+        self._wait_for_calls(2)
+
+        self.assertEqual(2, self.callback.call_count)
+
+    def test_stop(self):
+        self.scheduler.schedule(time.time() + 3600, 'uuid0', 1)
+
+        self.scheduler.stop()
+
+        self.assertFalse(self.scheduler._thread.is_alive())
+        self.callback.assert_not_called()
+
+
+@mock.patch('time.sleep', autospec=True)
+class ExternalNotifierTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        session_patcher = mock.patch('requests.Session', autospec=True)
+        self.session = session_patcher.start().return_value
+        self.addCleanup(session_patcher.stop)
+        self.session.put.return_value.status_code = 204
+        self.logger = mock.Mock()
+
+    def _notifier(self, **kwargs):
+        notifier = fakedriver.ExternalNotifier(
+            'http://localhost:9999', self.logger, **kwargs)
+        self.addCleanup(notifier.close)
+        return notifier
+
+    def test_notify(self, mock_sleep):
+        notifier = self._notifier()
+        system = {'name': 'fake', 'power_state': 'On'}
+
+        notifier.notify(system)
+        system['power_state'] = 'Off'
+        notifier.close()
+
+        self.session.put.assert_called_once_with(
+            'http://localhost:9999',
+            json={'name': 'fake', 'power_state': 'On'},
+            headers={'Content-type': 'application/json'})
+        self.assertEqual(1, notifier.stats['sent'])
+
+    def test_notify_batch(self, mock_sleep):
+        notifier = self._notifier(batch_size=10)
+        notifier._thread = mock.Mock()
+
+        notifier.notify({'name': 'fake0'})
+        notifier.notify({'name': 'fake1'})
+        notifier._queue.put(None)
+        notifier._run()
+
+        self.session.put.assert_called_once_with(
+            'http://localhost:9999', json=[{'name': 'fake0'},
+                                           {'name': 'fake1'}],
+            headers={'Content-type': 'application/json'})
+        self.assertEqual(2, notifier.stats['sent'])
+
+    def test_notify_retry(self, mock_sleep):
+        notifier = self._notifier(retries=2)
+        self.session.put.side_effect = [
+            mock.Mock(status_code=503), requests.ConnectionError,
+            mock.Mock(status_code=204)]
+
+        notifier.notify({'name': 'fake'})
+        notifier.close()
+
+        self.assertEqual(3, self.session.put.call_count)
+        self.assertEqual(1, notifier.stats['sent'])
+
+    def test_notify_fails(self, mock_sleep):
+        notifier = self._notifier(retries=2)
+        self.session.put.return_value.status_code = 404
+
+        notifier.notify({'name': 'fake'})
+        notifier.close()
+
+        self.session.put.assert_called_once()
+        self.assertEqual(1, notifier.stats['failed'])
+        self.assertTrue(self.logger.error.called)
+
+    def test_notify_overflow(self, mock_sleep):
+        notifier = self._notifier(queue_size=2)
+        notifier._thread = mock.Mock()
+
+        for index in range(3):
+            notifier.notify({'name': 'fake%d' % index})
+
+        self.assertEqual(1, notifier.stats['dropped'])
+        self.assertEqual(3, notifier.stats['queued'])
+        self.assertEqual([{'name': 'fake1'}, {'name': 'fake2'}],
+                         [notifier._queue.get_nowait() for _ in range(2)])
+
+
+class SystemGeneratorTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.generator = fakedriver.SystemGenerator({
+            'count': 1000,
+            'name_pattern': 'node-{index:04d}',
+            'seed': 'fleet',
+            'nics': 2,
+            'power_states': {'On': 1, 'Off': 3},
+            'boot_modes': {'UEFI': 1, 'Legacy': 1},
+        })
+
+    def test_generate(self):
+        system = self.generator.generate(42)
+
+        self.assertEqual(self.generator.uuid(42), system['uuid'])
+        self.assertEqual('node-0042', system['name'])
+        self.assertIn(system['power_state'], ('On', 'Off'))
+        self.assertIn(system['boot_mode'], ('UEFI', 'Legacy'))
+        self.assertEqual(2, len(system['nics']))
+        self.assertNotEqual(system['nics'][0]['mac'],
+                            system['nics'][1]['mac'])
+        self.assertEqual(system, self.generator.generate(42))
+
+    def test_generate_distribution(self):
+        power_states = [self.generator.generate(index)['power_state']
+                        for index in range(1000)]
+
+        self.assertLess(100, power_states.count('On'))
+        self.assertLess(power_states.count('On'), 400)
+
+    def test_uuids(self):
+        uuids = list(self.generator.uuids())
+
+        self.assertEqual(1000, len(set(uuids)))
+        self.assertEqual(list(range(1000)),
+                         [self.generator.index(uuid) for uuid in uuids])
+
+    def test_uuids_seed(self):
+        generator = fakedriver.SystemGenerator({'count': 1, 'seed': 'other'})
+
+        self.assertNotEqual(self.generator.uuid(0), generator.uuid(0))
+        self.assertIsNone(self.generator.index(generator.uuid(0)))
+
+    def test_index(self):
+        self.assertIsNone(self.generator.index(UUID))
+        self.assertIsNone(self.generator.index('node-0001'))
+        self.assertIsNone(self.generator.index(
+            self.generator.uuid(1).upper()))
+        self.assertIsNone(self.generator.index(
+            self.generator.uuid(0)[:-8] + '%08x' % 1000))
+
+    def test_index_by_name(self):
+        self.assertEqual(7, self.generator.index_by_name('node-0007'))
+        self.assertIsNone(self.generator.index_by_name('node-7'))
+        self.assertIsNone(self.generator.index_by_name('node-1000'))
+        self.assertIsNone(self.generator.index_by_name('fake'))
+
+    def test_invalid_name_pattern(self):
+        self.assertRaises(error.FishyError, fakedriver.SystemGenerator,
+                          {'count': 1, 'name_pattern': 'node'})
+        self.assertRaises(error.FishyError, fakedriver.SystemGenerator,
+                          {'count': 1, 'name_pattern': 'node-{id}'})
+
+
+class FakeDriverGeneratorTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        test_driver_class = fakedriver.FakeDriver.initialize(
+            {'SUSHY_EMULATOR_FAKE_SYSTEMS_GENERATOR': {
+                'count': 3, 'seed': 'fleet'}},
+            mock.MagicMock())
+        self.cache = {}
+        with mock.patch('sushy_tools.emulator.memoize.PersistentDict',
+                        return_value=self.cache, autospec=True):
+            self.test_driver = test_driver_class()
+        self.addCleanup(self.test_driver._scheduler.stop)
+        self.generator = self.test_driver._generator
+
+    def test_systems(self):
+        self.assertEqual([self.generator.uuid(index) for index in range(3)],
+                         self.test_driver.systems)
+        self.assertEqual({}, self.cache)
+
+    def test_get(self):
+        uuid = self.generator.uuid(1)
+
+        self.assertEqual('Off', self.test_driver.get_power_state(uuid))
+
+        self.assertEqual([uuid], list(self.cache))
+        self.assertEqual([self.generator.uuid(index) for index in range(3)],
+                         self.test_driver.systems)
+
+    def test_name(self):
+        uuid = self.generator.uuid(2)
+
+        self.assertEqual(uuid, self.test_driver.uuid('fake-2'))
+        self.assertEqual('fake-2', self.test_driver.name(uuid))
+        self.assertEqual('fake-2', self.test_driver.name('fake-2'))
+
+    def test_not_found(self):
+        self.assertRaises(error.NotFound, self.test_driver.get_power_state,
+                          'fake-3')
+        self.assertRaises(error.NotFound, self.test_driver.get_power_state,
+                          UUID)
+
+    def test_update(self):
+        uuid = self.generator.uuid(0)
+
+        self.test_driver.set_boot_device(uuid, 'Cd')
+
+        self.assertEqual('Cd', self.test_driver.get_boot_device(uuid))
+        self.assertEqual('Cd', self.cache[uuid]['boot_device'])
+
+
+class FakeDriverProfilesTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        test_driver_class = fakedriver.FakeDriver.initialize(
+            {'SUSHY_EMULATOR_FAKE_PROFILES': [
+                {'systems': [UUID],
+                 'methods': {'set_boot_device': {'error_rate': 1}}}]},
+            mock.MagicMock())
+        with mock.patch('sushy_tools.emulator.memoize.PersistentDict',
+                        return_value={}, autospec=True):
+            self.test_driver = test_driver_class()
+        self.addCleanup(self.test_driver._scheduler.stop)
+
+    def test_error(self):
+        self.assertRaises(error.FishyError, self.test_driver.set_boot_device,
+                          UUID, 'Cd')
+        self.assertEqual('Hdd', self.test_driver.get_boot_device(UUID))
@@ -14,13 +14,14 @@
 #    under the License.
 from unittest import mock
 
+import openstack
 from oslotest import base
 
+from sushy_tools.emulator.resources.systems import ironicdriver
 from sushy_tools.emulator.resources.systems.ironicdriver import IronicDriver
 from sushy_tools import error
 
 
-@mock.patch.dict(IronicDriver.PERMANENT_CACHE)
 class IronicDriverTestCase(base.BaseTestCase):
     uuid = 'c7a5fdbd-cdaf-9455-926a-d65c16db1809'
 
@@ -59,6 +60,19 @@ class IronicDriverTestCase(base.BaseTestCase):
         systems = self.test_driver.systems
 
         self.assertEqual(['host0', 'host1'], systems)
+        self.ironic_mock.return_value.baremetal.nodes.assert_called_once_with(
+            fields=ironicdriver.NodeCache.FIELDS, details=False)
+
+    def test_systems_cached(self):
+        node0 = mock.Mock(id='host0')
+        node0.name = 'node0'
+        self.ironic_mock.return_value.baremetal.nodes.return_value = [node0]
+        self.test_driver.systems
+
+        self.assertEqual('host0', self.test_driver.uuid('node0'))
+        self.assertEqual('node0', self.test_driver.name('host0'))
+
+        self.ironic_mock.return_value.baremetal.get_node.assert_not_called()
 
     def test_get_power_state_on(self):
         self.node_mock.power_state = 'power on'
@@ -110,18 +124,36 @@ class IronicDriverTestCase(base.BaseTestCase):
         snps = self.ironic_mock.return_value.baremetal.set_node_power_state
         snps.assert_called_once_with(self.uuid, 'rebooting')
 
+    def test_set_power_state_write_through(self):
+        self.node_mock.power_state = 'power on'
+
+        self.test_driver.set_power_state(self.uuid, 'GracefulShutdown')
+
+        self.assertEqual('Off', self.test_driver.get_power_state(self.uuid))
+        self.ironic_mock.return_value.baremetal.get_node.\
+            assert_called_once_with(
+                self.uuid, fields=ironicdriver.NodeCache.FIELDS)
+
     def test_get_boot_device(self):
         self.node_mock.get_boot_device.return_value.get.return_value = "pxe"
 
         boot_device = self.test_driver.get_boot_device(self.uuid)
+        self.assertEqual('Pxe', boot_device)
 
+        boot_device = self.test_driver.get_boot_device(self.uuid)
         self.assertEqual('Pxe', boot_device)
 
+        self.node_mock.get_boot_device.assert_called_once_with(
+            self.ironic_mock.return_value.baremetal)
+
     def test_set_boot_device(self):
         self.test_driver.set_boot_device(self.uuid, 'Pxe')
         self.ironic_mock.return_value.baremetal.set_node_boot_device.\
             assert_called_once_with(self.uuid, "pxe")
 
+        self.assertEqual('Pxe', self.test_driver.get_boot_device(self.uuid))
+        self.node_mock.get_boot_device.assert_not_called()
+
     def test_get_boot_mode(self):
         self.node_mock.boot_mode = 'bios'
 
@@ -173,6 +205,8 @@ class IronicDriverTestCase(base.BaseTestCase):
         self.assertEqual([{'id': 'fa:16:3e:22:18:31',
                            'mac': 'fa:16:3e:22:18:31'}],
                          sorted(nics, key=lambda k: k['id']))
+        self.ironic_mock.return_value.baremetal.ports.assert_called_once_with(
+            fields=["address", "node_uuid"])
 
     def test_get_nics_empty(self):
         self.node_mock.addresses = None
@@ -180,6 +214,20 @@ class IronicDriverTestCase(base.BaseTestCase):
         nics = self.test_driver.get_nics(self.uuid)
         self.assertEqual([], nics)
 
+    def test_get_nics_node_scoped(self):
+        test_driver = IronicDriver.initialize(
+            {'SUSHY_EMULATOR_IRONIC_PORT_INDEX_TTL': 0},
+            mock.MagicMock(), 'fake-cloud')()
+        ports_mock = self.ironic_mock.return_value.baremetal.ports
+        ports_mock.return_value = [{"address": "fa:16:3e:22:18:31"}]
+
+        nics = test_driver.get_nics(self.uuid)
+
+        self.assertEqual([{'id': 'fa:16:3e:22:18:31',
+                          'mac': 'fa:16:3e:22:18:31'}], nics)
+        ports_mock.assert_called_once_with(
+            node_id=self.uuid, fields=["address"])
+
     def test_get_simple_storage_collection(self):
         self.assertRaises(
             error.FishyError,
@@ -197,3 +245,113 @@ class IronicDriverTestCase(base.BaseTestCase):
         self.assertRaises(
             error.NotSupportedError, self.test_driver.set_secure_boot,
             self.uuid, True)
+
+
+class NodeCacheTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.connection = mock.Mock()
+        self.node = mock.Mock(id='uuid0', power_state='power off')
+        self.node.name = 'node0'
+        self.connection.baremetal.get_node.return_value = self.node
+        self.cache = ironicdriver.NodeCache(
+            self.connection, mock.Mock(), ttl=5)
+
+    @mock.patch('time.monotonic', autospec=True)
+    def test_get(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+
+        self.assertIs(self.node, self.cache.get('uuid0'))
+        self.assertIs(self.node, self.cache.get('uuid0'))
+        self.assertIs(self.node, self.cache.get('node0'))
+
+        self.connection.baremetal.get_node.assert_called_once_with(
+            'uuid0', fields=ironicdriver.NodeCache.FIELDS)
+
+    @mock.patch('time.monotonic', autospec=True)
+    def test_get_expired(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        self.cache.get('uuid0')
+
+        mock_monotonic.return_value = 105
+        self.cache.get('uuid0')
+
+        self.assertEqual(2, self.connection.baremetal.get_node.call_count)
+
+    def test_get_not_found(self):
+        self.connection.baremetal.get_node.side_effect = (
+            openstack.exceptions.ResourceNotFound)
+
+        self.assertRaises(openstack.exceptions.ResourceNotFound,
+                          self.cache.get, 'uuid0')
+
+    @mock.patch('time.monotonic', autospec=True)
+    def test_refresh(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        self.connection.baremetal.nodes.return_value = [self.node]
+
+        self.assertEqual([self.node], self.cache.refresh())
+        self.assertIs(self.node, self.cache.get('node0'))
+
+        self.connection.baremetal.get_node.assert_not_called()
+
+    def test_set_power_state(self):
+        self.cache.get('uuid0')
+
+        self.cache.set_power_state('uuid0', 'power on')
+
+        self.assertEqual('power on', self.cache.get('uuid0').power_state)
+
+    def test_set_power_state_not_cached(self):
+        self.cache.set_power_state('uuid0', 'power on')
+
+        self.assertEqual('power off', self.node.power_state)
+
+
+class PortIndexTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.connection = mock.Mock()
+        self.ports_mock = self.connection.baremetal.ports
+        self.ports_mock.return_value = [
+            {"node_uuid": "node0", "address": "mac0"},
+            {"node_uuid": "node0", "address": "mac1"},
+            {"node_uuid": "node1", "address": "mac2"}]
+        self.index = ironicdriver.PortIndex(
+            self.connection, mock.Mock(), ttl=60)
+
+    @mock.patch('time.monotonic', autospec=True)
+    def test_get(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+
+        self.assertEqual({"mac0", "mac1"}, self.index.get("node0"))
+        self.assertEqual({"mac2"}, self.index.get("node1"))
+
+        self.ports_mock.assert_called_once_with(
+            fields=["address", "node_uuid"])
+
+    @mock.patch('time.monotonic', autospec=True)
+    def test_get_expired(self, mock_monotonic):
+        mock_monotonic.side_effect = [100, 159, 160, 160]
+
+        self.index.get("node0")
+        self.index.get("node0")
+        self.assertEqual(1, self.ports_mock.call_count)
+
+        self.index.get("node0")
+        self.assertEqual(2, self.ports_mock.call_count)
+
+    @mock.patch('time.monotonic', autospec=True)
+    def test_get_missing(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        self.index.get("node0")
+        self.ports_mock.return_value = [{"address": "mac3"}]
+
+        self.assertEqual({"mac3"}, self.index.get("node2"))
+        self.assertEqual({"mac3"}, self.index.get("node2"))
+
+        self.ports_mock.assert_called_with(
+            node_id="node2", fields=["address"])
+        self.assertEqual(2, self.ports_mock.call_count)
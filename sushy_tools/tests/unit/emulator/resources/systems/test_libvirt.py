@@ -10,6 +10,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import threading
+import time
 from unittest import mock
 import uuid
 import xml.etree.ElementTree as ET
@@ -17,6 +19,8 @@ import xml.etree.ElementTree as ET
 import libvirt
 from oslotest import base
 
+from sushy_tools.emulator.resources.systems.libvirtdriver import (
+    DomainStatsCollector)
 from sushy_tools.emulator.resources.systems.libvirtdriver import LibvirtDriver
 from sushy_tools import error
 
@@ -605,6 +609,55 @@ class LibvirtDriverTestCase(base.BaseTestCase):
 
         self.assertEqual(expected, image_info)
 
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_get_boot_image_network(self, libvirt_mock):
+        with open('sushy_tools/tests/unit/emulator/domain.xml', 'r') as f:
+            data = f.read()
+
+        data = data.replace(
+            "<disk type='file' device='cdrom'>\n"
+            "      <source file='/home/user/boot.iso'/>",
+            "<disk type='network' device='cdrom'>\n"
+            "      <source protocol='https' name='/red.iso?fish=1'>"
+            "<host name='fish.it' port='443'/><ssl verify='no'/></source>")
+
+        conn_mock = libvirt_mock.return_value
+        domain_mock = conn_mock.lookupByUUID.return_value
+        domain_mock.XMLDesc.return_value = data
+
+        image_info = self.test_driver.get_boot_image(self.uuid, 'Cd')
+
+        expected = 'https://fish.it/red.iso?fish=1', False, False
+
+        self.assertEqual(expected, image_info)
+
+    @mock.patch('libvirt.open', autospec=True)
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_set_boot_image_network(self, libvirt_mock, libvirt_rw_mock):
+        with open('sushy_tools/tests/unit/emulator/domain.xml', 'r') as f:
+            data = f.read()
+
+        conn_mock = libvirt_rw_mock.return_value
+        domain_mock = conn_mock.lookupByUUID.return_value
+        domain_mock.XMLDesc.return_value = data
+
+        with mock.patch.object(
+                self.test_driver, 'get_boot_device', return_value=None):
+            self.test_driver.set_boot_image(
+                self.uuid, 'Cd', 'https://fish.it:8443/red.iso')
+
+        self.assertFalse(conn_mock.storagePoolLookupByName.called)
+
+        domain_tree = ET.fromstring(conn_mock.defineXML.call_args[0][0])
+        disk_element = domain_tree.find('devices/disk[@device="cdrom"]')
+        self.assertEqual('network', disk_element.get('type'))
+        source_element = disk_element.find('source')
+        self.assertEqual('https', source_element.get('protocol'))
+        self.assertEqual('/red.iso', source_element.get('name'))
+        self.assertEqual({'name': 'fish.it', 'port': '8443'},
+                         source_element.find('host').attrib)
+        self.assertEqual('no', source_element.find('ssl').get('verify'))
+
     @mock.patch('sushy_tools.emulator.resources.systems.libvirtdriver'
                 '.os.stat', autospec=True)
     @mock.patch('sushy_tools.emulator.resources.systems.libvirtdriver'
@@ -861,6 +914,155 @@ class LibvirtDriverTestCase(base.BaseTestCase):
         conn_mock.defineXML.assert_called_once()
         set_boot_device_mock.assert_called_once_with(self.uuid, 'Hdd')
 
+    @mock.patch(
+        'sushy_tools.emulator.resources.systems.libvirtdriver.LibvirtDriver'
+        '._upload_image', autospec=True, return_value='/var/lib/image.img')
+    @mock.patch(
+        'sushy_tools.emulator.resources.systems.libvirtdriver.LibvirtDriver'
+        '.set_boot_device', autospec=True)
+    @mock.patch('libvirt.open', autospec=True)
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_set_boot_image_live(self, libvirt_mock, libvirt_rw_mock,
+                                 set_boot_device_mock, upload_mock):
+        self.test_driver.LIVE_MEDIA_CHANGE = True
+
+        with open('sushy_tools/tests/unit/emulator/domain.xml', 'r') as f:
+            data = f.read()
+
+        conn_mock = libvirt_rw_mock.return_value
+        domain_mock = conn_mock.lookupByUUID.return_value
+        domain_mock.XMLDesc.return_value = data
+        domain_mock.isActive.return_value = True
+
+        with mock.patch.object(
+                self.test_driver, 'get_boot_device', return_value='Cd'):
+            self.test_driver.set_boot_image(
+                self.uuid, 'Cd', '/tmp/image.iso')
+
+        domain_mock.updateDeviceFlags.assert_called_once_with(
+            mock.ANY, libvirt.VIR_DOMAIN_AFFECT_LIVE
+            | libvirt.VIR_DOMAIN_AFFECT_CONFIG)
+        disk_element = ET.fromstring(
+            domain_mock.updateDeviceFlags.call_args[0][0])
+        self.assertEqual('cdrom', disk_element.get('device'))
+        self.assertEqual('hdc', disk_element.find('target').get('dev'))
+        self.assertEqual('/var/lib/image.img',
+                         disk_element.find('source').get('file'))
+        self.assertIsNotNone(disk_element.find('readonly'))
+        self.assertFalse(conn_mock.defineXML.called)
+        set_boot_device_mock.assert_called_once_with(
+            self.test_driver, self.uuid, 'Cd')
+
+    @mock.patch(
+        'sushy_tools.emulator.resources.systems.libvirtdriver.LibvirtDriver'
+        '.set_boot_device', autospec=True)
+    @mock.patch('libvirt.open', autospec=True)
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_set_boot_image_live_eject(self, libvirt_mock, libvirt_rw_mock,
+                                       set_boot_device_mock):
+        self.test_driver.LIVE_MEDIA_CHANGE = True
+
+        with open('sushy_tools/tests/unit/emulator/domain.xml', 'r') as f:
+            data = f.read()
+
+        conn_mock = libvirt_rw_mock.return_value
+        domain_mock = conn_mock.lookupByUUID.return_value
+        domain_mock.XMLDesc.return_value = data
+        domain_mock.isActive.return_value = True
+
+        self.test_driver.set_boot_image(self.uuid, 'Cd', boot_image=None)
+
+        disk_element = ET.fromstring(
+            domain_mock.updateDeviceFlags.call_args[0][0])
+        self.assertEqual('cdrom', disk_element.get('device'))
+        self.assertIsNone(disk_element.find('source'))
+        self.assertFalse(conn_mock.defineXML.called)
+        set_boot_device_mock.assert_called_once_with(
+            self.test_driver, self.uuid, 'Hdd')
+
+    @mock.patch(
+        'sushy_tools.emulator.resources.systems.libvirtdriver.LibvirtDriver'
+        '.set_boot_device', autospec=True)
+    @mock.patch('libvirt.open', autospec=True)
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_set_boot_image_live_inactive(self, libvirt_mock, libvirt_rw_mock,
+                                          set_boot_device_mock):
+        self.test_driver.LIVE_MEDIA_CHANGE = True
+
+        with open('sushy_tools/tests/unit/emulator/domain.xml', 'r') as f:
+            data = f.read()
+
+        conn_mock = libvirt_rw_mock.return_value
+        domain_mock = conn_mock.lookupByUUID.return_value
+        domain_mock.XMLDesc.return_value = data
+        domain_mock.isActive.return_value = False
+
+        self.test_driver.set_boot_image(self.uuid, 'Cd', boot_image=None)
+
+        self.assertFalse(domain_mock.updateDeviceFlags.called)
+        conn_mock.defineXML.assert_called_once_with(mock.ANY)
+
+    @mock.patch(
+        'sushy_tools.emulator.resources.systems.libvirtdriver.LibvirtDriver'
+        '.set_boot_device', autospec=True)
+    @mock.patch('libvirt.open', autospec=True)
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_set_boot_image_live_fallback(self, libvirt_mock, libvirt_rw_mock,
+                                          set_boot_device_mock):
+        self.test_driver.LIVE_MEDIA_CHANGE = True
+
+        with open('sushy_tools/tests/unit/emulator/domain.xml', 'r') as f:
+            data = f.read()
+
+        conn_mock = libvirt_rw_mock.return_value
+        domain_mock = conn_mock.lookupByUUID.return_value
+        domain_mock.XMLDesc.return_value = data
+        domain_mock.isActive.return_value = True
+        domain_mock.updateDeviceFlags.side_effect = libvirt.libvirtError(
+            'boom')
+
+        self.test_driver.set_boot_image(self.uuid, 'Cd', boot_image=None)
+
+        domain_mock.updateDeviceFlags.assert_called_once_with(
+            mock.ANY, mock.ANY)
+        conn_mock.defineXML.assert_called_once_with(mock.ANY)
+        self.assertNotIn('device="cdrom"',
+                         conn_mock.defineXML.call_args[0][0])
+
+    @mock.patch(
+        'sushy_tools.emulator.resources.systems.libvirtdriver.LibvirtDriver'
+        '._upload_image', autospec=True, return_value='/var/lib/image.img')
+    @mock.patch(
+        'sushy_tools.emulator.resources.systems.libvirtdriver.LibvirtDriver'
+        '.set_boot_device', autospec=True)
+    @mock.patch('libvirt.open', autospec=True)
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_set_boot_image_live_fallback_uploaded(
+            self, libvirt_mock, libvirt_rw_mock, set_boot_device_mock,
+            upload_mock):
+        self.test_driver.LIVE_MEDIA_CHANGE = True
+
+        with open('sushy_tools/tests/unit/emulator/domain.xml', 'r') as f:
+            data = f.read()
+
+        conn_mock = libvirt_rw_mock.return_value
+        domain_mock = conn_mock.lookupByUUID.return_value
+        domain_mock.XMLDesc.return_value = data
+        domain_mock.isActive.return_value = True
+        domain_mock.updateDeviceFlags.side_effect = libvirt.libvirtError(
+            'boom')
+
+        with mock.patch.object(
+                self.test_driver, 'get_boot_device', return_value='Cd'):
+            self.test_driver.set_boot_image(
+                self.uuid, 'Cd', '/tmp/image.iso')
+
+        upload_mock.assert_called_once_with(
+            self.test_driver, domain_mock, mock.ANY, '/tmp/image.iso')
+        conn_mock.defineXML.assert_called_once_with(mock.ANY)
+        self.assertIn('/var/lib/image.img',
+                      conn_mock.defineXML.call_args[0][0])
+
     @mock.patch('libvirt.openReadOnly', autospec=True)
     def test_get_total_memory(self, libvirt_mock):
         conn_mock = libvirt_mock.return_value
@@ -1315,6 +1517,106 @@ class LibvirtDriverTestCase(base.BaseTestCase):
 
         self.assertEqual(simple_storage_response, simple_storage_expected)
 
+    def _make_volume(self, name, path, capacity):
+        vol_mock = mock.MagicMock()
+        vol_mock.name.return_value = name
+        vol_mock.path.return_value = path
+        vol_mock.info.return_value = ['volType', capacity]
+        return vol_mock
+
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_get_simple_storage_collection_volume_index(self, libvirt_mock):
+        with open('sushy_tools/tests/unit/emulator/'
+                  'domain_simple_storage.xml', 'r') as f:
+            data = f.read()
+
+        conn_mock = libvirt_mock.return_value
+        dom_mock = conn_mock.lookupByUUID.return_value
+        dom_mock.XMLDesc.return_value = data
+
+        default_pool = mock.MagicMock()
+        default_pool.name.return_value = 'default'
+        default_pool.listAllVolumes.return_value = [
+            self._make_volume('testVM1.img',
+                              '/var/lib/libvirt/images/testVM1.img', 100000),
+            self._make_volume('testVol1.img',
+                              '/home/varsha/Documents/testPool/testVol1.img',
+                              200000),
+        ]
+        blk_pool = mock.MagicMock()
+        blk_pool.name.return_value = 'blk-pool0'
+        blk_pool.listAllVolumes.return_value = [
+            self._make_volume('blk-pool0-vol0', '/dev/blk-pool0-vol0',
+                              300000),
+        ]
+        conn_mock.listAllStoragePools.return_value = [default_pool, blk_pool]
+        conn_mock.storageVolLookupByPath.side_effect = libvirt.libvirtError(
+            'not found')
+
+        for _ in range(2):
+            simple_storage_response = (
+                self.test_driver.get_simple_storage_collection(self.uuid))
+
+        simple_storage_expected = {
+            'virtio': {
+                'Id': 'virtio',
+                'Name': 'virtio',
+                'DeviceList': [
+                    {
+                        'Name': 'testVM1.img',
+                        'CapacityBytes': 100000
+                    }
+                ]
+            },
+            'ide': {
+                'Id': 'ide',
+                'Name': 'ide',
+                'DeviceList': [
+                    {
+                        'Name': 'testVol1.img',
+                        'CapacityBytes': 200000
+                    },
+                    {
+                        'Name': 'blk-pool0-vol0',
+                        'CapacityBytes': 300000
+                    }
+                ]
+            }
+        }
+
+        self.assertEqual(simple_storage_expected, simple_storage_response)
+        conn_mock.listAllStoragePools.assert_called_once_with()
+        # only the block device missing from the index is looked up, once
+        conn_mock.storageVolLookupByPath.assert_called_once_with('/dev/sdb1')
+        conn_mock.storagePoolLookupByName.assert_not_called()
+
+    @mock.patch('time.monotonic', autospec=True)
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_get_simple_storage_collection_volume_index_expired(
+            self, libvirt_mock, time_mock):
+        with open('sushy_tools/tests/unit/emulator/'
+                  'domain_simple_storage.xml', 'r') as f:
+            data = f.read()
+
+        conn_mock = libvirt_mock.return_value
+        dom_mock = conn_mock.lookupByUUID.return_value
+        dom_mock.XMLDesc.return_value = data
+        conn_mock.listAllStoragePools.return_value = []
+
+        time_mock.return_value = 1000
+        self.test_driver.get_simple_storage_collection(self.uuid)
+        time_mock.return_value = 1000 + self.test_driver.VOLUME_INDEX_TTL - 1
+        self.test_driver.get_simple_storage_collection(self.uuid)
+        self.assertEqual(1, conn_mock.listAllStoragePools.call_count)
+
+        time_mock.return_value = 1000 + self.test_driver.VOLUME_INDEX_TTL
+        self.test_driver.get_simple_storage_collection(self.uuid)
+        self.assertEqual(2, conn_mock.listAllStoragePools.call_count)
+
+        self.test_driver._invalidate_volume_index()
+        self.test_driver.get_simple_storage_collection(self.uuid)
+        self.assertEqual(3, conn_mock.listAllStoragePools.call_count)
+
     @mock.patch('libvirt.openReadOnly', autospec=True)
     def test_get_simple_storage_collection_empty(self, libvirt_mock):
         with open('sushy_tools/tests/unit/emulator/domain.xml') as f:
@@ -1547,3 +1849,282 @@ class LibvirtDriverTestCase(base.BaseTestCase):
         self.assertEqual('secure-boot', secure_boot[0].get('name'))
         self.assertEqual('no', secure_boot[0].get('enabled'))
         conn_mock.defineXML.assert_called_once_with(mock.ANY)
+
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_get_metrics_not_enabled(self, libvirt_mock):
+        self.assertRaises(error.NotSupportedError,
+                          self.test_driver.get_metrics, self.uuid)
+        self.assertFalse(libvirt_mock.called)
+
+    @mock.patch.object(DomainStatsCollector, 'start', autospec=True)
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_get_metrics(self, libvirt_mock, start_mock):
+        test_driver = LibvirtDriver.initialize(
+            {'SUSHY_EMULATOR_LIBVIRT_STATS_INTERVAL': 10}, mock.MagicMock())()
+        domain_mock = libvirt_mock.return_value.lookupByUUID.return_value
+        domain_mock.UUIDString.return_value = self.uuid
+
+        self.assertEqual({}, test_driver.get_metrics(self.uuid))
+        self.assertEqual({}, test_driver.get_metrics(self.uuid))
+
+        start_mock.assert_called_once_with(
+            test_driver._stats_collectors[test_driver._uri])
+
+    @mock.patch('sushy_tools.emulator.resources.systems.libvirtdriver.'
+                'DomainStatsCollector', autospec=True)
+    def test_get_stats_collector_concurrent(self, collector_mock):
+        test_driver = LibvirtDriver.initialize(
+            {'SUSHY_EMULATOR_LIBVIRT_STATS_INTERVAL': 10}, mock.MagicMock())()
+
+        def create(*args, **kwargs):
+            # NOTE: let the other threads race for the same URI
+            time.sleep(0.05)
+            return mock.Mock()
+
+        collector_mock.side_effect = create
+
+        collectors = []
+        threads = [threading.Thread(target=lambda: collectors.append(
+            test_driver._get_stats_collector(test_driver._uri)))
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, collector_mock.call_count)
+        self.assertEqual(1, len(set(map(id, collectors))))
+
+
+class DomainStatsCollectorTestCase(base.BaseTestCase):
+
+    uuid = 'c7a5fdbd-cdaf-9455-926a-d65c16db1809'
+
+    def setUp(self):
+        super().setUp()
+        self.collector = DomainStatsCollector(
+            'qemu:///system', mock.MagicMock(), interval=10, history=3)
+
+    @staticmethod
+    def _make_record(cpu_time, vcpu_times, unused, block_bytes, net_bytes):
+        record = {
+            'state.state': 1,
+            'cpu.time': cpu_time,
+            'vcpu.current': len(vcpu_times),
+            'balloon.maximum': 2097152,
+            'balloon.available': 2000000,
+            'balloon.unused': unused,
+            'block.count': 1,
+            'block.0.rd.bytes': block_bytes,
+            'block.0.wr.bytes': block_bytes,
+            'net.count': 1,
+            'net.0.rx.bytes': net_bytes,
+            'net.0.tx.bytes': net_bytes,
+        }
+        for index, vcpu_time in enumerate(vcpu_times):
+            record['vcpu.%d.time' % index] = vcpu_time
+        return record
+
+    def _collect(self, libvirt_mock, *records):
+        domains = []
+        for uuid_, record in records:
+            domain_mock = mock.Mock()
+            domain_mock.UUIDString.return_value = uuid_
+            domains.append((domain_mock, record))
+
+        conn_mock = libvirt_mock.return_value
+        conn_mock.getAllDomainStats.return_value = domains
+        self.collector.collect()
+
+    @mock.patch('time.monotonic', autospec=True)
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_get_metrics(self, libvirt_mock, time_mock):
+        time_mock.return_value = 100
+        self._collect(libvirt_mock, (self.uuid, self._make_record(
+            0, (0, 0), 1000000, 0, 0)))
+
+        self.assertEqual({}, self.collector.get_metrics(self.uuid))
+
+        time_mock.return_value = 110
+        self._collect(libvirt_mock, (self.uuid, self._make_record(
+            10 * 10 ** 9, (2 * 10 ** 9, 8 * 10 ** 9), 976000, 1000, 500)))
+
+        conn_mock = libvirt_mock.return_value
+        self.assertEqual(2, conn_mock.getAllDomainStats.call_count)
+
+        expected = {
+            'active': True,
+            'cpu_utilization': 50.0,
+            'vcpu_utilization': [20.0, 80.0],
+            'cpu_temperature_celsius': 38.0,
+            'memory_used_mib': 1000,
+            'memory_total_mib': 2048,
+            'memory_utilization': 48.8,
+            'block_bytes_per_second': 200,
+            'network_bytes_per_second': 100,
+            'power_watts': 75,
+            'power_watts_min': 75,
+            'power_watts_max': 75,
+            'power_watts_average': 75,
+            'interval_minutes': 1,
+        }
+        self.assertEqual(expected, self.collector.get_metrics(self.uuid))
+
+    @mock.patch('time.monotonic', autospec=True)
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_get_metrics_same_timestamp(self, libvirt_mock, time_mock):
+        time_mock.return_value = 100
+        self._collect(libvirt_mock, (self.uuid, self._make_record(
+            0, (0, 0), 1000000, 0, 0)))
+        self._collect(libvirt_mock, (self.uuid, self._make_record(
+            10 * 10 ** 9, (2 * 10 ** 9, 8 * 10 ** 9), 976000, 1000, 500)))
+
+        metrics = self.collector.get_metrics(self.uuid)
+
+        self.assertEqual(0, metrics['cpu_utilization'])
+        self.assertEqual([0, 0], metrics['vcpu_utilization'])
+        self.assertEqual(0, metrics['block_bytes_per_second'])
+        self.assertEqual(0, metrics['network_bytes_per_second'])
+
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_collect_history(self, libvirt_mock):
+        other = str(uuid.uuid4())
+        record = self._make_record(0, (0,), 0, 0, 0)
+
+        for _ in range(5):
+            self._collect(libvirt_mock, (self.uuid, record), (other, record))
+
+        self.assertEqual(3, len(self.collector._series[self.uuid]))
+
+        self._collect(libvirt_mock, (self.uuid, record))
+
+        self.assertNotIn(other, self.collector._series)
+        self.assertEqual({}, self.collector.get_metrics(other))
+
+
+class LibvirtMultiHostTestCase(base.BaseTestCase):
+
+    uris = ['qemu+ssh://host1/system', 'qemu+ssh://host2/system',
+            'qemu+ssh://host3/system']
+
+    def setUp(self):
+        super().setUp()
+        self.test_driver = LibvirtDriver.initialize(
+            {'SUSHY_EMULATOR_LIBVIRT_HOST_TIMEOUT': 1}, mock.MagicMock(),
+            self.uris)()
+        self.addCleanup(self.test_driver._executor.shutdown)
+
+        self.conns = {}
+        for index, uri in enumerate(self.uris):
+            domain_mock = mock.Mock()
+            domain_mock.UUIDString.return_value = str(
+                uuid.UUID(int=index + 1))
+            domain_mock.name.return_value = 'node-%d' % index
+            domain_mock.isActive.return_value = bool(index)
+
+            conn_mock = mock.Mock()
+            conn_mock.listAllDomains.return_value = [domain_mock]
+            conn_mock.lookupByUUID.return_value = domain_mock
+            self.conns[uri] = conn_mock
+
+    def _open(self, uri):
+        conn_mock = self.conns[uri]
+        if isinstance(conn_mock, Exception):
+            raise conn_mock
+        return conn_mock
+
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_systems(self, libvirt_mock):
+        libvirt_mock.side_effect = self._open
+
+        self.assertEqual([str(uuid.UUID(int=1)), str(uuid.UUID(int=2)),
+                          str(uuid.UUID(int=3))],
+                         self.test_driver.systems)
+        self.assertEqual(self.uris[1],
+                         self.test_driver._uri_for(str(uuid.UUID(int=2))))
+        self.assertEqual(self.uris[2],
+                         self.test_driver._uri_for('node-2'))
+
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_systems_host_failure(self, libvirt_mock):
+        libvirt_mock.side_effect = self._open
+        self.conns[self.uris[1]] = libvirt.libvirtError('host down')
+
+        self.assertEqual([str(uuid.UUID(int=1)), str(uuid.UUID(int=3))],
+                         self.test_driver.systems)
+
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_systems_host_listing_failure(self, libvirt_mock):
+        libvirt_mock.side_effect = self._open
+        self.conns[self.uris[0]].listAllDomains.side_effect = (
+            libvirt.libvirtError('connection reset'))
+
+        self.assertEqual([str(uuid.UUID(int=2)), str(uuid.UUID(int=3))],
+                         self.test_driver.systems)
+        self.test_driver._logger.warning.assert_called_once_with(
+            'Failed listing domains at libvirt URI "%s": %s', self.uris[0],
+            mock.ANY)
+
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_systems_host_timeout(self, libvirt_mock):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def open_(uri):
+            if uri == self.uris[0]:
+                release.wait()
+            return self._open(uri)
+
+        libvirt_mock.side_effect = open_
+        self.test_driver.HOST_TIMEOUT = 0.1
+
+        self.assertEqual([str(uuid.UUID(int=2)), str(uuid.UUID(int=3))],
+                         self.test_driver.systems)
+
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_systems_host_hung(self, libvirt_mock):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def open_(uri):
+            if uri == self.uris[0]:
+                release.wait()
+            return self._open(uri)
+
+        libvirt_mock.side_effect = open_
+        self.test_driver.HOST_TIMEOUT = 0.1
+
+        for _ in range(3):
+            self.assertEqual(
+                [str(uuid.UUID(int=2)), str(uuid.UUID(int=3))],
+                self.test_driver._route_domains())
+
+        # the hung host is not queried again until it responds
+        self.assertEqual(
+            1, [call[0][0] for call in libvirt_mock.call_args_list].count(
+                self.uris[0]))
+
+        release.set()
+        self.test_driver.HOST_TIMEOUT = 1
+
+        self.assertEqual(3, len(self.test_driver._route_domains()))
+
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_get_power_state_routed(self, libvirt_mock):
+        libvirt_mock.side_effect = self._open
+
+        self.assertEqual(
+            'Off', self.test_driver.get_power_state(str(uuid.UUID(int=1))))
+        self.assertEqual(
+            'On', self.test_driver.get_power_state(str(uuid.UUID(int=3))))
+
+        self.conns[self.uris[2]].lookupByUUID.assert_called_once_with(
+            uuid.UUID(int=3).bytes)
+        self.assertFalse(self.conns[self.uris[1]].lookupByUUID.called)
+
+    @mock.patch('libvirt.openReadOnly', autospec=True)
+    def test_get_power_state_unknown(self, libvirt_mock):
+        libvirt_mock.side_effect = self._open
+
+        self.assertRaises(error.NotFound, self.test_driver.get_power_state,
+                          str(uuid.UUID(int=4)))
@@ -13,12 +13,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 import base64
+from concurrent import futures
+import pickle
+import threading
 import time
 from unittest import mock
 
 from munch import Munch
+from openstack.compute.v2 import server as os_server
 from oslotest import base
 
+from sushy_tools.emulator.resources.systems import novadriver
 from sushy_tools.emulator.resources.systems.novadriver import OpenStackDriver
 from sushy_tools import error
 
@@ -66,14 +71,90 @@ class NovaDriverTestCase(base.BaseTestCase):
         uuid = self.test_driver.uuid(self.uuid)
         self.assertEqual(self.uuid, uuid)
 
+    def _server(self, server_id, name, status='ACTIVE',
+                updated_at='2024-01-01T00:00:00Z'):
+        server = mock.Mock(id=server_id, status=status,
+                           updated_at=updated_at)
+        server.name = name
+        return server
+
     def test_systems(self):
-        server0 = mock.Mock(id='host0')
-        server1 = mock.Mock(id='host1')
-        self.nova_mock.return_value.list_servers.return_value = [
-            server0, server1]
+        self._cc.compute.servers.return_value = [
+            self._server('host0', 'node0'), self._server('host1', 'node1')]
         systems = self.test_driver.systems
 
         self.assertEqual(['host0', 'host1'], systems)
+        self._cc.compute.servers.assert_called_once_with(details=True)
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    def test_systems_incremental(self, mock_monotonic):
+        mock_monotonic.side_effect = [100, 100.5, 102]
+        self._cc.compute.servers.side_effect = [
+            [self._server('host0', 'node0'),
+             self._server('host1', 'node1',
+                          updated_at='2024-01-02T00:00:00Z')],
+            [self._server('host1', 'node1', status='DELETED',
+                          updated_at='2024-01-03T00:00:00Z'),
+             self._server('host2', 'node2',
+                          updated_at='2024-01-03T00:00:00Z')],
+        ]
+
+        self.assertEqual(['host0', 'host1'], self.test_driver.systems)
+        # Refreshed less than a second ago
+        self.assertEqual(['host0', 'host1'], self.test_driver.systems)
+        self.assertEqual(['host0', 'host2'], self.test_driver.systems)
+
+        self._cc.compute.servers.assert_has_calls([
+            mock.call(details=True),
+            mock.call(details=True, changes_since='2024-01-02T00:00:00Z')])
+        self.assertEqual('2024-01-03T00:00:00Z',
+                         self.test_driver._server_index._changes_since)
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    def test_systems_incremental_copy(self, mock_monotonic):
+        mock_monotonic.side_effect = [100, 102]
+        self._cc.compute.servers.side_effect = [
+            [self._server('host0', 'node0')],
+            [self._server('host0', 'node0', status='DELETED',
+                          updated_at='2024-01-03T00:00:00Z')],
+        ]
+
+        self.assertEqual(['host0'], self.test_driver.systems)
+        names = self.test_driver._server_index._names
+        self.assertEqual([], self.test_driver.systems)
+
+        # readers holding the previous index are not affected
+        self.assertEqual({'host0': 'node0'}, names)
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    def test_systems_incremental_empty(self, mock_monotonic):
+        mock_monotonic.side_effect = [100, 102]
+        self._cc.compute.servers.side_effect = [[], []]
+
+        self.assertEqual([], self.test_driver.systems)
+        self.assertEqual([], self.test_driver.systems)
+
+        changes_since = self._cc.compute.servers.call_args[1][
+            'changes_since']
+        self.assertRegex(changes_since,
+                         r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ$')
+
+    def test_uuid_from_index(self):
+        self._cc.compute.servers.return_value = [
+            self._server(self.uuid, self.name)]
+
+        self.assertEqual(self.uuid, self.test_driver.uuid(self.uuid))
+        self.assertEqual(self.name, self.test_driver.name(self.uuid))
+        self._cc.get_server.assert_not_called()
+
+    def test_get_instance_alias_from_index(self):
+        self._cc.compute.servers.return_value = [
+            self._server(self.uuid, self.name)]
+
+        e = self.assertRaises(error.AliasAccessError,
+                              self.test_driver.uuid, self.name)
+        self.assertEqual(self.uuid, str(e))
+        self._cc.get_server.assert_not_called()
 
     def test_get_power_state_on(self,):
         server = mock.Mock(id=self.uuid,
@@ -220,12 +301,14 @@ class NovaDriverTestCase(base.BaseTestCase):
     def test_get_boot_device(self):
         server = mock.Mock(id=self.uuid)
         self.nova_mock.return_value.get_server.return_value = server
+        get_server_metadata = (
+            self.nova_mock.return_value.compute.get_server_metadata)
+        get_server_metadata.return_value.to_dict.return_value = {
+            'libvirt:pxe-first': '1'}
 
         boot_device = self.test_driver.get_boot_device(self.uuid)
 
         self.assertEqual('Pxe', boot_device)
-        get_server_metadata = (
-            self.nova_mock.return_value.compute.get_server_metadata)
         get_server_metadata.assert_called_once_with(server.id)
 
     def test_set_boot_device(self):
@@ -241,6 +324,61 @@ class NovaDriverTestCase(base.BaseTestCase):
             self.uuid, **{'libvirt:pxe-first': '1'}
         )
 
+    def test_get_boot_device_cached_metadata(self):
+        server = mock.Mock(id=self.uuid, updated_at='2024-01-01T00:00:00Z',
+                           metadata={'libvirt:pxe-first': '1'})
+        self._cc.get_server.return_value = server
+
+        self.assertEqual('Pxe', self.test_driver.get_boot_device(self.uuid))
+
+        self.test_driver.set_boot_device(self.uuid, 'Hdd')
+        self.assertEqual('Hdd', self.test_driver.get_boot_device(self.uuid))
+
+        # Server updated elsewhere, the payload metadata takes over
+        server.updated_at = '2024-01-02T00:00:00Z'
+        server.metadata = {'libvirt:pxe-first': '1'}
+        self.assertEqual('Pxe', self.test_driver.get_boot_device(self.uuid))
+
+        self._cc.compute.get_server_metadata.assert_not_called()
+        self._cc.compute.set_server_metadata.assert_called_once_with(
+            self.uuid, **{'libvirt:pxe-first': ''})
+
+    def test_set_boot_device_before_get(self):
+        server = mock.Mock(id=self.uuid, updated_at='2024-01-01T00:00:00Z',
+                           metadata={'libvirt:pxe-first': '1'})
+        self._cc.get_server.return_value = server
+
+        self.test_driver.set_boot_device(self.uuid, 'Hdd')
+
+        # the server payload is stale until it is looked up again
+        self.assertEqual('Hdd', self.test_driver.get_boot_device(self.uuid))
+        self._cc.compute.get_server_metadata.assert_not_called()
+
+    def test_set_boot_device_before_get_no_metadata(self):
+        server = mock.Mock(id=self.uuid, updated_at='2024-01-01T00:00:00Z',
+                           metadata=None)
+        self._cc.get_server.return_value = server
+        get_server_metadata = self._cc.compute.get_server_metadata
+        get_server_metadata.return_value.to_dict.return_value = {
+            'libvirt:pxe-first': ''}
+
+        self.test_driver.set_boot_device(self.uuid, 'Hdd')
+
+        self.assertEqual('Hdd', self.test_driver.get_boot_device(self.uuid))
+        get_server_metadata.assert_called_once_with(self.uuid)
+
+    def test_set_boot_device_unchanged(self):
+        server = mock.Mock(id=self.uuid, updated_at='2024-01-01T00:00:00Z',
+                           metadata={'libvirt:pxe-first': '1'})
+        self._cc.get_server.return_value = server
+
+        self.test_driver.get_boot_device(self.uuid)
+        self.test_driver.set_boot_device(self.uuid, 'Pxe')
+
+        # the cached copy may be stale, so the write still happens
+        self._cc.compute.set_server_metadata.assert_called_once_with(
+            self.uuid, **{'libvirt:pxe-first': '1'})
+
     def test_get_boot_mode(self):
         server = mock.Mock(id=self.uuid, image=dict(id=self.uuid))
         self.nova_mock.return_value.get_server.return_value = server
@@ -304,6 +442,34 @@ class NovaDriverTestCase(base.BaseTestCase):
 
         self.assertEqual(2, cpus)
 
+    def test_get_flavor_cached(self):
+        flavor = mock.Mock(id='f-1', ram=2048, vcpus=4)
+        flavor.name = 'm1.small'
+        self._cc.list_flavors.return_value = [flavor]
+        self._cc.get_server.side_effect = lambda identity: mock.Mock(
+            id=identity, flavor=Munch(original_name='m1.small'))
+
+        for identity in ('host0', 'host1'):
+            self.assertEqual(2, self.test_driver.get_total_memory(identity))
+            self.assertEqual(4, self.test_driver.get_total_cpus(identity))
+
+        self._cc.list_flavors.assert_called_once_with()
+        self._cc.get_flavor.assert_not_called()
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    def test_get_flavor_cache_expired(self, mock_monotonic):
+        mock_monotonic.side_effect = [0, 599, 600, 600]
+        self._cc.list_flavors.return_value = []
+        self._cc.get_flavor.return_value = mock.Mock(id='f-2', vcpus=1)
+
+        flavor_cache = self.test_driver._flavor_cache
+        self.assertEqual(1, flavor_cache.get('m1.gone').vcpus)
+        self.assertEqual(1, flavor_cache.get('m1.gone').vcpus)
+        self.assertEqual(1, flavor_cache.get('m1.gone').vcpus)
+
+        self.assertEqual(2, self._cc.list_flavors.call_count)
+        self.assertEqual(2, self._cc.get_flavor.call_count)
+
     def test_get_bios(self):
         self.assertRaises(
             error.FishyError, self.test_driver.get_bios, self.uuid)
@@ -526,6 +692,69 @@ class NovaDriverTestCase(base.BaseTestCase):
 
         self.assertEqual('aaa-bbb', image_id)
 
+    @mock.patch.object(novadriver.requests, 'get', autospec=True)
+    @mock.patch.object(OpenStackDriver, 'get_boot_mode', autospec=True)
+    @mock.patch.object(base64, 'urlsafe_b64encode', autospec=True)
+    def test_insert_image_stream_upload(self, mock_b64e, mock_get_boot_mode,
+                                        mock_get):
+        self.test_driver._config.update({
+            'SUSHY_EMULATOR_OS_VMEDIA_IMAGE_FILE_UPLOAD': True,
+            'SUSHY_EMULATOR_OS_VMEDIA_IMAGE_STREAM_UPLOAD': True})
+        mock_get_boot_mode.return_value = None
+        mock_b64e.return_value = b'0hIwh_vN'
+        self._cc.get_server.return_value = mock.Mock(id=self.uuid)
+        chunks = [b'\x00' * 32768, b'\x00CD001', b'\x00' * 16]
+        rsp = mock_get.return_value
+        rsp.status_code = 200
+        rsp.iter_content.return_value = iter(chunks)
+        uploaded = []
+
+        def create_image(**attrs):
+            uploaded.extend(attrs.pop('data'))
+            return mock.Mock(id='aaa-bbb')
+
+        self._cc.image.create_image.side_effect = create_image
+
+        image_id, _ = self.test_driver.insert_image(
+            self.uuid, 'http://fish.it/red')
+
+        self.assertEqual('aaa-bbb', image_id)
+        mock_get.assert_called_once_with(
+            'http://fish.it/red', stream=True, verify=False)
+        self._cc.image.create_image.assert_called_once_with(
+            name='red 0hIwh_vN', disk_format='iso',
+            container_format='bare', visibility='private', data=mock.ANY)
+        self.assertEqual(chunks, uploaded)
+        self._cc.image.import_image.assert_not_called()
+        rsp.close.assert_called_once_with()
+        self.assertEqual({'image_url': 'http://fish.it/red'},
+                         self.test_driver._volume_vmedia_attrs[self.uuid])
+
+    @mock.patch.object(novadriver.requests, 'get', autospec=True)
+    @mock.patch.object(OpenStackDriver, 'get_boot_mode', autospec=True)
+    def test_insert_image_stream_upload_http_error(self, mock_get_boot_mode,
+                                                   mock_get):
+        self.test_driver._config.update({
+            'SUSHY_EMULATOR_OS_VMEDIA_IMAGE_FILE_UPLOAD': True,
+            'SUSHY_EMULATOR_OS_VMEDIA_IMAGE_STREAM_UPLOAD': True})
+        mock_get_boot_mode.return_value = None
+        mock_get.return_value.status_code = 503
+
+        e = self.assertRaises(
+            error.FishyError, self.test_driver.insert_image,
+            self.uuid, 'http://fish.it/red.iso')
+
+        self.assertEqual(502, e.code)
+        self._cc.image.create_image.assert_not_called()
+
+    def test_get_disk_format_from_header(self):
+        self.assertEqual('qcow2', self.test_driver._get_disk_format(
+            'image.iso', header=b'QFI\xfb\x00\x00\x00\x03'))
+        self.assertEqual('iso', self.test_driver._get_disk_format(
+            'image.img', header=b'\x00' * 32769 + b'CD001'))
+        self.assertEqual('raw', self.test_driver._get_disk_format(
+            'image.iso', header=b'\x00' * 512))
+
     @mock.patch('builtins.open', autospec=True)
     def test_get_disk_format_from_content(self, mock_open):
         """Test disk format detection from file content"""
@@ -660,19 +889,139 @@ class NovaDriverTestCase(base.BaseTestCase):
             'Failed insert image from URL http://fish.it/red.iso: ouch',
             str(e))
 
-    @mock.patch.object(OpenStackDriver, 'get_boot_mode', autospec=True)
-    def test_insert_image_future_running(self, mock_get_boot_mode):
-        mock_get_boot_mode.return_value = None
-        mock_future = mock.Mock()
-        mock_future.running.return_value = True
-        self.test_driver._futures[self.uuid] = mock_future
+    def _operation(self, name, calls, release=None):
+        def operation(identity, *args):
+            calls.append((name, identity) + args)
+            if release is not None:
+                release.wait(10)
+            return name
+
+        operation.__name__ = name
+        return operation
+
+    @mock.patch.dict(novadriver.PENDING)
+    def test_submit_future_queued(self):
+        calls = []
+        release = threading.Event()
+        self.test_driver._submit_future(
+            True, self._operation('_block', calls, release), self.uuid)
+
+        self.test_driver._submit_future(
+            True, self._operation('_insert_image', calls), self.uuid, 'a')
+        self.test_driver._submit_future(
+            True, self._operation('_rebuild_with_imported_image', calls),
+            self.uuid, 'img')
+        self.assertEqual(2, len(self.test_driver._pending[self.uuid]))
+
+        release.set()
+        self.assertEqual(
+            '_rebuild_with_imported_image',
+            self.test_driver._futures[self.uuid].result(10))
+        self.assertEqual(
+            [('_block', self.uuid), ('_insert_image', self.uuid, 'a'),
+             ('_rebuild_with_imported_image', self.uuid, 'img')], calls)
+        self.assertNotIn(self.uuid, self.test_driver._pending)
+
+    @mock.patch.dict(novadriver.PENDING)
+    def test_submit_future_coalesced(self):
+        calls = []
+        release = threading.Event()
+        self.test_driver._submit_future(
+            True, self._operation('_block', calls, release), self.uuid)
+
+        # insert -> eject -> insert collapses to eject -> insert
+        self.test_driver._submit_future(
+            True, self._operation('_insert_image', calls), self.uuid, 'a')
+        superseded = self.test_driver._futures[self.uuid]
+        self.test_driver._submit_future(
+            True, self._operation('_eject_image', calls), self.uuid)
+        self.test_driver._submit_future(
+            True, self._operation('_insert_image', calls), self.uuid, 'b')
+
+        release.set()
+        self.test_driver._futures[self.uuid].result(10)
+        self.assertEqual(
+            [('_block', self.uuid), ('_eject_image', self.uuid),
+             ('_insert_image', self.uuid, 'b')], calls)
+        # the caller of the dropped insert gets the outcome of the later one
+        self.assertEqual('_insert_image', superseded.result(10))
+
+    @mock.patch.dict(novadriver.PENDING)
+    def test_submit_future_superseded_failure(self):
+        calls = []
+        release = threading.Event()
+        self.test_driver._submit_future(
+            True, self._operation('_block', calls, release), self.uuid)
+
+        self.test_driver._submit_future(
+            True, self._operation('_insert_image', calls), self.uuid, 'a')
+        superseded = self.test_driver._futures[self.uuid]
+
+        def fail(identity, *args):
+            raise error.FishyError('boom')
+
+        fail.__name__ = '_insert_image'
+        self.test_driver._submit_future(True, fail, self.uuid, 'b')
+
+        release.set()
+        self.assertRaises(error.FishyError, superseded.result, 10)
+        self.assertEqual([('_block', self.uuid)], calls)
+
+    @mock.patch.dict(novadriver.PENDING)
+    def test_submit_future_eject_after_insert(self):
+        calls = []
+        release = threading.Event()
+        self.test_driver._submit_future(
+            True, self._operation('_block', calls, release), self.uuid)
+
+        self.test_driver._submit_future(
+            True, self._operation('_insert_image', calls), self.uuid, 'a')
+        inserted = self.test_driver._futures[self.uuid]
+        self.test_driver._submit_future(
+            True, self._operation('_eject_image', calls), self.uuid)
+
+        release.set()
+        self.test_driver._futures[self.uuid].result(10)
+        self.assertEqual('_insert_image', inserted.result(10))
+        self.assertEqual(
+            [('_block', self.uuid), ('_insert_image', self.uuid, 'a'),
+             ('_eject_image', self.uuid)], calls)
+
+    @mock.patch.dict(novadriver.PENDING)
+    def test_submit_future_queue_full(self):
+        self.test_driver._futures[self.uuid] = futures.Future()
+        self.test_driver._pending[self.uuid] = [
+            (self._operation('_eject_image', []), (), {}, futures.Future())
+        ] * 4
+
         e = self.assertRaises(
-            error.FishyError, self.test_driver.insert_image,
-            self.uuid, 'http://fish.it/red.iso')
+            error.Conflict, self.test_driver._submit_future, True,
+            self._operation('_rebuild_with_blank_image', []), self.uuid)
         self.assertEqual(
-            'An insert or eject operation is already in progress for '
+            'Too many insert or eject operations are queued for '
             'c7a5fdbd-cdaf-9455-926a-d65c16db1809', str(e))
 
+    @mock.patch.dict(novadriver.PENDING)
+    def test_submit_future_failure_fails_queued(self):
+        release = threading.Event()
+
+        def failing(identity):
+            release.wait(10)
+            raise error.FishyError('ouch')
+
+        self.test_driver._submit_future(True, failing, self.uuid)
+        self.test_driver._submit_future(
+            True, self._operation('_eject_image', []), self.uuid)
+        queued = self.test_driver._futures[self.uuid]
+
+        release.set()
+        self.assertRaises(error.FishyError, queued.result, 10)
+        # The failure is reported to the next submission too
+        e = self.assertRaises(
+            error.FishyError, self.test_driver._submit_future, False,
+            self._operation('_eject_image', []), self.uuid)
+        self.assertEqual('ouch', str(e))
+
     @mock.patch.object(OpenStackDriver, 'get_boot_mode', autospec=True)
     def test_insert_image_future_exception(self, mock_get_boot_mode):
         mock_get_boot_mode.return_value = None
@@ -709,6 +1058,82 @@ class NovaDriverTestCase(base.BaseTestCase):
         self._cc.image.find_image.assert_called_once_with('ccc-ddd')
         self._cc.delete_image.assert_called_once_with('ccc-ddd')
 
+    @mock.patch.object(OpenStackDriver, 'get_boot_mode', autospec=True)
+    def test_insert_eject_shared_image(self, mock_get_boot_mode):
+        mock_get_boot_mode.return_value = None
+        self.test_driver._share_vmedia_images = True
+        self.test_driver._vmedia_image_registry = {}
+        self._cc.get_server.side_effect = lambda identity: mock.Mock(
+            id=identity)
+        image = mock.Mock(id='aaa-bbb', status='active')
+        image.name = 'red.iso 0hIwh_vN'
+        self._cc.image.create_image.return_value = image
+        self._cc.image.find_image.return_value = image
+
+        for identity in ('host0', 'host1'):
+            self.assertEqual(
+                ('aaa-bbb', 'red.iso 0hIwh_vN'),
+                self.test_driver.insert_image(identity,
+                                              'http://fish.it/red.iso'))
+            self.assertEqual(
+                'aaa-bbb', self.test_driver._volume_vmedia_images[identity])
+
+        self._cc.image.create_image.assert_called_once_with(
+            name=mock.ANY, disk_format='iso', container_format='bare',
+            visibility='private')
+        self._cc.image.import_image.assert_called_once_with(
+            image, method='web-download', uri='http://fish.it/red.iso')
+        registry = self.test_driver._vmedia_image_registry
+        self.assertEqual([{'image_id': 'aaa-bbb',
+                           'servers': ['host0', 'host1']}],
+                         list(registry.values()))
+
+        self.test_driver.eject_image('host0')
+        self._cc.delete_image.assert_not_called()
+
+        self.test_driver.eject_image('host1')
+        self._cc.delete_image.assert_called_once_with('aaa-bbb')
+        self.assertEqual({}, registry)
+
+    @mock.patch.object(novadriver, 'locks', autospec=True)
+    def test_shared_image_registry_locked(self, mock_locks):
+        mock_lock = mock_locks.get.return_value.lock
+        self.test_driver._vmedia_image_registry = {
+            'key': {'image_id': 'aaa-bbb', 'servers': ['host0', 'host1']}}
+        self._cc.image.find_image.return_value = mock.Mock(status='active')
+
+        self.test_driver._acquire_shared_image('key', 'host2')
+        self.assertFalse(
+            self.test_driver._release_vmedia_image('aaa-bbb', 'host0'))
+
+        mock_locks.get.assert_called_with(self.test_driver._config)
+        self.assertEqual([mock.call('key')] * 2, mock_lock.call_args_list)
+        self.assertEqual(2, mock_lock.return_value.__enter__.call_count)
+        self.assertEqual(['host1', 'host2'],
+                         self.test_driver._vmedia_image_registry[
+                             'key']['servers'])
+
+    @mock.patch.object(OpenStackDriver, 'get_boot_mode', autospec=True)
+    def test_insert_shared_image_gone(self, mock_get_boot_mode):
+        mock_get_boot_mode.return_value = None
+        self.test_driver._share_vmedia_images = True
+        self.test_driver._vmedia_image_registry = {}
+        self._cc.get_server.return_value = mock.Mock(id=self.uuid)
+        self._cc.image.find_image.return_value = None
+        self._cc.image.create_image.return_value = mock.Mock(id='ccc-ddd')
+        key = self.test_driver._get_shared_image_key(
+            'http://fish.it/red.iso', {}, 'volume')
+        self.test_driver._vmedia_image_registry[key] = {
+            'image_id': 'aaa-bbb', 'servers': ['host0']}
+
+        image_id, _ = self.test_driver.insert_image(
+            self.uuid, 'http://fish.it/red.iso')
+
+        self.assertEqual('ccc-ddd', image_id)
+        self.assertEqual({key: {'image_id': 'ccc-ddd',
+                                'servers': [self.uuid]}},
+                         self.test_driver._vmedia_image_registry)
+
     def test_eject_image_error_detach(self):
         mock_server = mock.Mock(id=self.uuid)
         mock_server.name = 'node01'
@@ -756,12 +1181,14 @@ class NovaDriverTestCase(base.BaseTestCase):
             mock.Mock(id='aaa-bbb', status='importing'),
             mock.Mock(id='aaa-bbb', status='active'),
         ]
-        self._cc.compute.rebuild_server.return_value = mock.Mock(
-            status='REBUILD')
-        self._cc.compute.get_server.side_effect = [
-            mock.Mock(status='REBUILD'),
-            mock.Mock(status='ACTIVE'),
-        ]
+        rebuilt_server = mock.Mock(id=self.uuid, status='REBUILD')
+        statuses = iter(['REBUILD', 'ACTIVE'])
+
+        def fetch(compute):
+            rebuilt_server.status = next(statuses)
+
+        rebuilt_server.fetch.side_effect = fetch
+        self._cc.compute.rebuild_server.return_value = rebuilt_server
 
         self.test_driver._rebuild_with_imported_image(
             self.uuid, 'aaa-bbb')
@@ -814,12 +1241,14 @@ class NovaDriverTestCase(base.BaseTestCase):
             mock.Mock(id='aaa-bbb', status='importing'),
             mock.Mock(id='aaa-bbb', status='active'),
         ]
-        self._cc.compute.rebuild_server.return_value = mock.Mock(
-            status='REBUILD')
-        self._cc.compute.get_server.side_effect = [
-            mock.Mock(status='REBUILD'),
-            mock.Mock(status='ERROR'),
-        ]
+        rebuilt_server = mock.Mock(id=self.uuid, status='REBUILD')
+        statuses = iter(['REBUILD', 'ERROR'])
+
+        def fetch(compute):
+            rebuilt_server.status = next(statuses)
+
+        rebuilt_server.fetch.side_effect = fetch
+        self._cc.compute.rebuild_server.return_value = rebuilt_server
         e = self.assertRaises(
             error.FishyError, self.test_driver._rebuild_with_imported_image,
             self.uuid, 'aaa-bbb')
@@ -838,10 +1267,8 @@ class NovaDriverTestCase(base.BaseTestCase):
 
         self.assertTrue(is_ready)
         self.assertEqual(server, result_instance)
-        # Should sleep for initial_wait (2s) + stability_wait (4s)
-        self.assertEqual(2, mock_sleep.call_count)
-        mock_sleep.assert_any_call(2)  # initial_wait
-        mock_sleep.assert_any_call(4)  # stability_wait
+        # Ready on the first check, so only sleep for stability_wait (4s)
+        mock_sleep.assert_called_once_with(4)
         # fetch() called twice: initial check + stability check
         self.assertEqual(2, server.fetch.call_count)
 
@@ -865,8 +1292,9 @@ class NovaDriverTestCase(base.BaseTestCase):
 
         self.assertTrue(is_ready)
         self.assertEqual(server, result_instance)
-        # Sleeps: 2s (initial check->busy), 4s (backoff->ready), 4s (stability)
-        self.assertEqual(3, mock_sleep.call_count)
+        # Sleeps: 2s (initial check->busy, then ready), 4s (stability)
+        self.assertEqual(2, mock_sleep.call_count)
+        self.assertEqual(3, server.fetch.call_count)
 
     @mock.patch('time.sleep')
     def test_check_and_wait_task_state_timeout(self, mock_sleep):
@@ -913,8 +1341,8 @@ class NovaDriverTestCase(base.BaseTestCase):
         """Test exponential backoff behavior"""
         server = mock.Mock(id=self.uuid, task_state='rebuilding')
 
-        # fetch() updates: initial->busy, busy->ready, ready (stability)
-        fetch_states = ['rebuilding', None, None]
+        # fetch() updates: initial->busy, busy->busy, busy->ready, ready
+        fetch_states = ['rebuilding', 'rebuilding', None, None]
         fetch_call_count = [0]
 
         def update_task_state(compute):
@@ -2553,16 +2981,18 @@ class NovaDriverRescueVMediaTestCase(base.BaseTestCase):
         # Should NOT call stop_server since unrescue not ready
         compute.stop_server.assert_not_called()
 
+    @mock.patch.dict(novadriver.PENDING)
     @mock.patch('base64.urlsafe_b64encode')
     def test_insert_image_future_already_running(self, mock_b64e):
-        """Test insert_image when a future is already running raises error"""
+        """Test insert_image when too many operations are queued"""
         test_driver = self._create_driver()
         mock_b64e.return_value = b'unique'
 
-        # Set up a running future
-        mock_future = mock.Mock()
-        mock_future.running.return_value = True
-        test_driver._futures[self.uuid] = mock_future
+        # Set up a running operation with a full queue
+        test_driver._futures[self.uuid] = futures.Future()
+        test_driver._pending[self.uuid] = [
+            (test_driver._rebuild_with_blank_image, (), {},
+             futures.Future())] * 4
 
         # Insert image should raise error
         e = self.assertRaises(
@@ -2570,7 +3000,7 @@ class NovaDriverRescueVMediaTestCase(base.BaseTestCase):
             test_driver.insert_image,
             self.uuid, 'http://example.com/test.iso')
 
-        self.assertIn('already in progress', str(e))
+        self.assertIn('Too many insert or eject operations', str(e))
 
     @mock.patch('base64.urlsafe_b64encode')
     def test_insert_image_previous_future_failed(self, mock_b64e):
@@ -2593,14 +3023,16 @@ class NovaDriverRescueVMediaTestCase(base.BaseTestCase):
 
         self.assertEqual('Previous operation failed', str(e))
 
+    @mock.patch.dict(novadriver.PENDING)
     def test_eject_image_future_already_running(self):
-        """Test eject_image when a future is already running raises error"""
+        """Test eject_image when too many operations are queued"""
         test_driver = self._create_driver()
 
-        # Set up a running future
-        mock_future = mock.Mock()
-        mock_future.running.return_value = True
-        test_driver._futures[self.uuid] = mock_future
+        # Set up a running operation with a full queue
+        test_driver._futures[self.uuid] = futures.Future()
+        test_driver._pending[self.uuid] = [
+            (test_driver._rebuild_with_blank_image, (), {},
+             futures.Future())] * 4
 
         # Eject image should raise error
         e = self.assertRaises(
@@ -2608,7 +3040,7 @@ class NovaDriverRescueVMediaTestCase(base.BaseTestCase):
             test_driver.eject_image,
             self.uuid)
 
-        self.assertIn('already in progress', str(e))
+        self.assertIn('Too many insert or eject operations', str(e))
 
     @mock.patch.object(OpenStackDriver, '_check_and_wait_for_task_state')
     @mock.patch('time.sleep')
@@ -2868,3 +3300,175 @@ class NovaDriverRescueVMediaTestCase(base.BaseTestCase):
         # PersistentDict should be cleared
         self.assertIsNone(test_driver._rescue_vmedia_images.get(self.uuid))
         self.assertIsNone(test_driver._rescue_vmedia_attrs.get(self.uuid))
+
+
+class SharedResourceTestCase(base.BaseTestCase):
+
+    def test_round_trip(self):
+        dump, load = novadriver.SHARED_RESOURCE
+        instance = os_server.Server.existing(
+            id='aaa', name='fake', flavor={'original_name': 'm1.small'},
+            image={'id': 'bbb'}, power_state=1)
+
+        data = pickle.loads(pickle.dumps(dump(None, instance)))
+        instance = load(None, data)
+
+        self.assertIsInstance(instance, os_server.Server)
+        self.assertEqual('aaa', instance.id)
+        self.assertEqual('m1.small', instance.flavor.original_name)
+        self.assertEqual('bbb', instance.image['id'])
+        self.assertIsNone(load(None, dump(None, None)))
+
+
+class StatusWaiterTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._cc = mock.MagicMock()
+        self.waiter = novadriver.StatusWaiter(self._cc, mock.MagicMock())
+
+    def _add_wait(self, kind, resource, ready):
+        wait = novadriver._PendingWait(
+            kind, resource, ready, None, 0, 1, 5, self.waiter._clock, None)
+        self.waiter._waits.append(wait)
+        return wait
+
+    def test_check_servers_batched(self):
+        waits = [self._add_wait('server', mock.Mock(id=server_id),
+                                lambda server: server.status == 'ACTIVE')
+                 for server_id in ('aaa', 'bbb')]
+        self._cc.compute.servers.return_value = [
+            mock.Mock(id='aaa', status='ACTIVE'),
+            mock.Mock(id='bbb', status='REBUILD'),
+            mock.Mock(id='ccc', status='ACTIVE'),
+        ]
+
+        self.waiter._check(waits)
+
+        self._cc.compute.servers.assert_called_once_with(details=True)
+        is_ready, server = waits[0].future.result()
+        self.assertTrue(is_ready)
+        self.assertEqual('aaa', server.id)
+        self.assertFalse(waits[1].future.done())
+        self.assertEqual(1, waits[1].next_check)
+        self.assertEqual(2, waits[1].interval)
+        for wait in waits:
+            self.assertFalse(wait.resource.fetch.called)
+
+    def test_check_servers_changed_since(self):
+        waits = [self._add_wait('server',
+                                mock.Mock(id=server_id, status='REBUILD',
+                                          updated_at=updated_at),
+                                lambda server: server.status == 'ACTIVE')
+                 for server_id, updated_at in (
+                     ('aaa', '2024-01-01T00:00:05Z'),
+                     ('bbb', '2024-01-01T00:00:01Z'),
+                     ('ccc', '2024-01-01T00:00:03Z'))]
+        self._cc.compute.servers.return_value = [
+            mock.Mock(id='aaa', status='ACTIVE'),
+            mock.Mock(id='ccc', status='DELETED'),
+        ]
+        unchanged = waits[1].resource
+
+        self.waiter._check(waits)
+
+        self._cc.compute.servers.assert_called_once_with(
+            details=True, changes_since='2024-01-01T00:00:01Z')
+        self.assertEqual('ACTIVE', waits[0].future.result()[1].status)
+        # unchanged since it was last seen
+        self.assertFalse(waits[1].future.done())
+        self.assertIs(unchanged, waits[1].resource)
+        self.assertRaises(error.NotFound, waits[2].future.result)
+
+    def test_check_images_batched(self):
+        waits = [self._add_wait('image', mock.Mock(id=image_id),
+                                lambda image: image.status == 'active')
+                 for image_id in ('bbb', 'aaa')]
+        self._cc.image.images.return_value = [
+            mock.Mock(id='aaa', status='active'),
+            mock.Mock(id='bbb', status='active'),
+        ]
+
+        self.waiter._check(waits)
+
+        self._cc.image.images.assert_called_once_with(id='in:aaa,bbb')
+        for wait in waits:
+            self.assertEqual((True, wait.resource), wait.future.result())
+
+    def test_check_server_gone(self):
+        waits = [self._add_wait('server', mock.Mock(id=server_id),
+                                lambda server: True)
+                 for server_id in ('aaa', 'bbb')]
+        self._cc.compute.servers.return_value = [mock.Mock(id='aaa')]
+
+        self.waiter._check(waits)
+
+        self.assertTrue(waits[0].future.result()[0])
+        self.assertRaises(error.NotFound, waits[1].future.result)
+
+    def test_check_fetch_fails(self):
+        wait = self._add_wait('image', mock.Mock(id='aaa'),
+                              lambda image: True)
+        self._cc.image.get_image.side_effect = error.FishyError('boom')
+
+        self.waiter._check([wait])
+
+        self.assertRaises(error.FishyError, wait.future.result)
+
+    @mock.patch.object(time, 'sleep', autospec=True)
+    def test_wait_for_server_timeout(self, mock_sleep):
+        server = mock.Mock(id='aaa', status='REBUILD')
+
+        is_ready, result = self.waiter.wait_for_server(
+            server, lambda server: server.status == 'ACTIVE', timeout=10)
+
+        self.assertFalse(is_ready)
+        self.assertIs(server, result)
+        # Exponential backoff capped at 5 seconds, then up to the deadline
+        self.assertEqual([1, 2, 4, 3],
+                         [call[0][0] for call in mock_sleep.call_args_list])
+        self.assertEqual(5, server.fetch.call_count)
+
+    @mock.patch.object(time, 'sleep', autospec=True)
+    def test_wait_for_server_stability_reset(self, mock_sleep):
+        server = mock.Mock(id='aaa')
+        states = iter([('ACTIVE', 1), ('ACTIVE', 4), ('ACTIVE', 4)])
+
+        def fetch(compute):
+            server.status, server.power_state = next(states)
+
+        server.fetch.side_effect = fetch
+
+        is_ready, result = self.waiter.wait_for_server(
+            server, lambda server: server.status == 'ACTIVE',
+            stable_for=2, key=lambda server: server.power_state)
+
+        self.assertTrue(is_ready)
+        self.assertEqual(4, result.power_state)
+        self.assertEqual(3, server.fetch.call_count)
+
+    def test_wait_concurrently(self):
+        self.waiter = novadriver.StatusWaiter(
+            self._cc, mock.MagicMock(), interval=0.01, max_interval=0.01)
+        servers = [mock.Mock(id=server_id, status='REBUILD')
+                   for server_id in ('aaa', 'bbb')]
+        self._cc.compute.servers.return_value = [
+            mock.Mock(id='aaa', status='ACTIVE'),
+            mock.Mock(id='bbb', status='ACTIVE'),
+        ]
+        results = {}
+
+        def wait(server):
+            results[server.id] = self.waiter.wait_for_server(
+                server, lambda server: server.status == 'ACTIVE')
+
+        threads = [threading.Thread(target=wait, args=(server,))
+                   for server in servers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual({'aaa', 'bbb'}, set(results))
+        self.assertTrue(all(is_ready for is_ready, _ in results.values()))
+        self.assertEqual([], self.waiter._waits)
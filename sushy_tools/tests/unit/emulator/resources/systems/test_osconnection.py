@@ -0,0 +1,119 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+from unittest import mock
+
+import openstack
+from oslotest import base
+
+from sushy_tools.emulator.resources.systems import osconnection
+
+
+class ConnectTestCase(base.BaseTestCase):
+
+    @mock.patch('openstack.connect', autospec=True)
+    def test_connect(self, mock_connect):
+        connection = osconnection.connect('fake-cloud', {}, mock.Mock())
+
+        self.assertIs(mock_connect.return_value, connection)
+        mock_connect.assert_called_once_with(cloud='fake-cloud')
+
+    @mock.patch('openstack.connect', autospec=True)
+    def test_connect_pool(self, mock_connect):
+        connection = osconnection.connect(
+            'fake-cloud', {'SUSHY_EMULATOR_OS_CONNECTION_POOL_SIZE': 2},
+            mock.Mock())
+
+        self.assertIsInstance(connection, osconnection.ConnectionPool)
+        self.assertIs(mock_connect.return_value, connection._base)
+        self.assertEqual(2, connection._size)
+
+
+class ConnectionPoolTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.base_connection = mock.Mock()
+        self.pool = osconnection.ConnectionPool(self.base_connection, 2)
+        self.connections = [mock.Mock(), mock.Mock()]
+        patcher = mock.patch.object(
+            osconnection.ConnectionPool, '_new_connection', autospec=True,
+            side_effect=self.connections)
+        self.new_connection = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _in_thread(self, fn):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(fn()))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_per_thread(self):
+        self.assertIs(self.connections[0].compute, self.pool.compute)
+        self.assertIs(self.connections[0].compute, self.pool.compute)
+        self.assertIs(self.connections[1].compute,
+                      self._in_thread(lambda: self.pool.compute))
+
+        self.assertEqual(2, self.new_connection.call_count)
+
+    def test_returned_when_thread_ends(self):
+        self._in_thread(lambda: self.pool.compute)
+        self._in_thread(lambda: self.pool.compute)
+
+        self.new_connection.assert_called_once_with(self.pool)
+        self.assertEqual(1, self.pool._idle.qsize())
+
+    def test_exhausted(self):
+        self.pool.compute
+        hold = threading.Event()
+        release = threading.Event()
+
+        def hold_connection():
+            self.pool.compute
+            hold.set()
+            release.wait(10)
+
+        thread = threading.Thread(target=hold_connection)
+        thread.start()
+        hold.wait(10)
+        try:
+            self.assertIs(self.base_connection.compute,
+                          self._in_thread(lambda: self.pool.compute))
+        finally:
+            release.set()
+            thread.join()
+
+    def test_private_attributes(self):
+        self.assertRaises(AttributeError, getattr, self.pool, '_foo')
+
+
+class NewConnectionTestCase(base.BaseTestCase):
+
+    def test_new_connection(self):
+        base_connection = openstack.connect(
+            auth_type='none', endpoint='http://127.0.0.1:6385',
+            compute_endpoint_override='http://127.0.0.1:8774/v2.1',
+            region_name='RegionOne')
+        pool = osconnection.ConnectionPool(
+            base_connection, 1, http_pool_maxsize=4)
+
+        connection = pool._new_connection()
+
+        self.assertIsNot(base_connection.session, connection.session)
+        self.assertIs(base_connection.session.auth, connection.session.auth)
+        self.assertEqual('RegionOne', connection.config.get_region_name())
+        self.assertEqual('http://127.0.0.1:8774/v2.1',
+                         connection.config.get_endpoint('compute'))
+        adapter = connection.session.session.get_adapter('https://cloud')
+        self.assertEqual(4, adapter._pool_maxsize)
@@ -14,10 +14,12 @@
 #    under the License.
 
 import builtins
+import threading
 from unittest import mock
 
 from oslotest import base
 
+from sushy_tools.emulator import locks
 from sushy_tools.emulator.resources import vmedia
 from sushy_tools import error
 
@@ -120,6 +122,37 @@ class StaticDriverTestCase(base.BaseTestCase):
         self.assertEqual('', device_info['Password'])
         self.assertEqual(local_file, device_info['_local_file'])
 
+    @mock.patch.object(vmedia.StaticDriver, '_get_device', autospec=True)
+    @mock.patch.object(vmedia.StaticDriver, '_get_image', autospec=True)
+    def test_insert_image_download_unlocked(self, mock_get_image,
+                                            mock_get_device):
+        device_info = {}
+        mock_get_device.return_value = device_info
+        acquired = []
+
+        def get_image(*args, **kwargs):
+            # NOTE: the stripe lock is reentrant, so probe it from a thread
+            def probe():
+                striped = locks.get(self.test_driver._config)
+                lock = striped._locks[striped._stripe(self.UUID)]
+                acquired.append(lock.acquire(blocking=False))
+                if acquired[-1]:
+                    lock.release()
+
+            thread = threading.Thread(target=probe)
+            thread.start()
+            thread.join()
+            return 'red.iso', '/alphabet/soup/red.iso'
+
+        mock_get_image.side_effect = get_image
+
+        local_file = self.test_driver.insert_image(
+            self.UUID, 'Cd', 'http://fish.it/red.iso')
+
+        self.assertEqual([True], acquired)
+        self.assertEqual('/alphabet/soup/red.iso', local_file)
+        self.assertEqual(local_file, device_info['_local_file'])
+
     @mock.patch.object(vmedia.StaticDriver, '_get_device', autospec=True)
     @mock.patch.object(builtins, 'open', autospec=True)
     @mock.patch.object(vmedia.os, 'rename', autospec=True)
@@ -392,6 +425,49 @@ class StaticDriverTestCase(base.BaseTestCase):
         mock_open.assert_not_called()
         self.assertEqual({}, device_info)
 
+    @mock.patch.object(vmedia.StaticDriver, '_get_device', autospec=True)
+    @mock.patch.object(vmedia, 'requests', autospec=True)
+    def test_insert_image_network_disk(self, mock_requests, mock_get_device):
+        device_info = {}
+        mock_get_device.return_value = device_info
+        self.test_driver._config = dict(
+            self.CONFIG, SUSHY_EMULATOR_VMEDIA_NETWORK_DISK=True)
+
+        image_url = self.test_driver.insert_image(
+            self.UUID, 'Cd', 'https://fish.it/red.iso', inserted=True,
+            write_protected=True)
+
+        self.assertEqual('https://fish.it/red.iso', image_url)
+        mock_requests.get.assert_not_called()
+        self.assertEqual('https://fish.it/red.iso', device_info['Image'])
+        self.assertEqual('red.iso', device_info['ImageName'])
+        self.assertTrue(device_info['Inserted'])
+        self.assertNotIn('_local_file', device_info)
+
+    @mock.patch.object(vmedia.StaticDriver, '_get_device', autospec=True)
+    @mock.patch.object(vmedia.StaticDriver, '_get_image', autospec=True,
+                       return_value=('red.iso', '/alphabet/soup/red.iso'))
+    def test_insert_image_network_disk_fallback(self, mock_get_image,
+                                                mock_get_device):
+        self.test_driver._config = dict(
+            self.CONFIG, SUSHY_EMULATOR_VMEDIA_NETWORK_DISK=True)
+
+        for device_info, username, password in [
+                ({}, 'Admin', 'Secret'),
+                ({'Verify': True}, None, None),
+                ({'Verify': True, 'Certificate': {'String': 'abcd'}},
+                 None, None)]:
+            mock_get_device.return_value = device_info
+
+            local_file = self.test_driver.insert_image(
+                self.UUID, 'Cd', 'https://fish.it/red.iso',
+                username=username, password=password)
+
+            self.assertEqual('/alphabet/soup/red.iso', local_file)
+            self.assertEqual(local_file, device_info['_local_file'])
+
+        self.assertEqual(3, mock_get_image.call_count)
+
     @mock.patch.object(vmedia.StaticDriver, '_get_device', autospec=True)
     @mock.patch.object(vmedia.os, 'unlink', autospec=True)
     def test_eject_image(self, mock_unlink, mock_get_device):
@@ -517,6 +593,20 @@ class StaticDriverTestCase(base.BaseTestCase):
             self.test_driver._get_image(
                 'http://fish.it/fish.iso', None, False, None))
 
+    @mock.patch('time.sleep', autospec=True)
+    def test_insert_image_profile(self, mock_sleep):
+        config = dict(self.CONFIG, SUSHY_EMULATOR_FAKE_PROFILES=[
+            {'methods': {'insert_image': {
+                'latency': {'distribution': 'fixed', 'value': 3},
+                'error_rate': 1}}}])
+        with mock.patch('sushy_tools.emulator.memoize.PersistentDict',
+                        return_value={}, autospec=True):
+            test_driver = vmedia.StaticDriver(config, mock.MagicMock())
+
+        self.assertRaises(error.FishyError, test_driver.insert_image,
+                          self.UUID, 'Cd', 'http://fish.it/red.iso')
+        mock_sleep.assert_called_once_with(3.0)
+
 
 class OpenstackDriverTestCase(base.BaseTestCase):
 
@@ -574,6 +664,24 @@ class OpenstackDriverTestCase(base.BaseTestCase):
         self.assertTrue(device_info['Inserted'])
         self.assertFalse(device_info['WriteProtected'])
 
+    @mock.patch.object(vmedia.OpenstackDriver, '_get_image', autospec=True)
+    @mock.patch.object(vmedia.OpenstackDriver, '_get_device', autospec=True)
+    def test_insert_image_stream_upload(self, mock_get_device,
+                                        mock_get_image):
+        mock_get_device.return_value = {}
+        self.test_driver._config.update({
+            'SUSHY_EMULATOR_OS_VMEDIA_IMAGE_FILE_UPLOAD': True,
+            'SUSHY_EMULATOR_OS_VMEDIA_IMAGE_STREAM_UPLOAD': True})
+        self.novadriver.insert_image.return_value = ('aaa-bbb', 'red.iso')
+
+        image_id = self.test_driver.insert_image(
+            self.UUID, 'Cd', 'http://fish.it/red.iso')
+
+        self.assertEqual('aaa-bbb', image_id)
+        mock_get_image.assert_not_called()
+        self.novadriver.insert_image.assert_called_once_with(
+            self.UUID, 'http://fish.it/red.iso', None)
+
     @mock.patch.object(vmedia.OpenstackDriver, '_get_device', autospec=True)
     def test_insert_image_auth(self, mock_get_device):
         device_info = {}
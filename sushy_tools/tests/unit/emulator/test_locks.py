@@ -0,0 +1,157 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import tempfile
+import threading
+from unittest import mock
+
+from oslotest import base
+
+from sushy_tools.emulator import locks
+
+
+class StripedLockTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.locks = locks.StripedLock(stripes=4)
+
+    def _identities(self):
+        # two identities in one stripe and one in another
+        by_stripe = {}
+        for index in range(100):
+            by_stripe.setdefault(
+                self.locks._stripe('id%d' % index), []).append('id%d' % index)
+
+        same, other = [ids for ids in by_stripe.values() if len(ids) > 1][:2]
+        return same[0], same[1], other[0]
+
+    def _hold(self, identity):
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with self.locks.lock(identity):
+                held.set()
+                release.wait(10)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait(10)
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        return release
+
+    def test_serialized(self):
+        first, second, other = self._identities()
+        release = self._hold(first)
+        acquired = threading.Event()
+
+        def lock():
+            with self.locks.lock(second):
+                acquired.set()
+
+        thread = threading.Thread(target=lock)
+        thread.start()
+
+        self.assertFalse(acquired.wait(0.1))
+        release.set()
+        self.assertTrue(acquired.wait(10))
+        thread.join()
+
+    def test_parallel(self):
+        first, second, other = self._identities()
+        self._hold(first)
+
+        with self.locks.lock(other):
+            pass
+
+        self.assertEqual(0, self.locks.stats['contended'])
+
+    def test_contended(self):
+        first, second, other = self._identities()
+        release = self._hold(first)
+        threading.Timer(0.05, release.set).start()
+
+        with self.locks.lock(first):
+            pass
+
+        self.assertEqual(2, self.locks.stats['acquired'])
+        self.assertEqual(1, self.locks.stats['contended'])
+        self.assertLess(0, self.locks.stats['max_wait_time'])
+
+    def test_reentrant(self):
+        with self.locks.lock('id'):
+            with self.locks.lock('id'):
+                pass
+
+        self.assertEqual(2, self.locks.stats['acquired'])
+
+
+@mock.patch.object(locks, 'fcntl', autospec=True)
+class InterProcessStripedLockTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(tempfile.mkdtemp(), 'locks')
+
+    def test_lock(self, mock_fcntl):
+        striped_lock = locks.StripedLock(stripes=4, path=self.path)
+        stripe = striped_lock._stripe('id')
+
+        with striped_lock.lock('id'):
+            with striped_lock.lock('id'):
+                pass
+
+        self.assertEqual(
+            [mock.call(striped_lock._fd,
+                       mock_fcntl.LOCK_EX | mock_fcntl.LOCK_NB, 1, stripe),
+             mock.call(striped_lock._fd, mock_fcntl.LOCK_UN, 1, stripe)],
+            mock_fcntl.lockf.call_args_list)
+
+    def test_lock_contended(self, mock_fcntl):
+        striped_lock = locks.StripedLock(stripes=4, path=self.path)
+        mock_fcntl.lockf.side_effect = [BlockingIOError, None, None]
+
+        with striped_lock.lock('id'):
+            pass
+
+        self.assertEqual(1, striped_lock.stats['contended'])
+        self.assertEqual(3, mock_fcntl.lockf.call_count)
+
+
+class GetTestCase(base.BaseTestCase):
+
+    @mock.patch.dict(locks._LOCKS, clear=True)
+    def test_get(self):
+        striped_lock = locks.get({'SUSHY_EMULATOR_LOCK_STRIPES': 8})
+
+        self.assertIs(striped_lock,
+                      locks.get({'SUSHY_EMULATOR_LOCK_STRIPES': 8}))
+        self.assertIsNot(striped_lock, locks.get({}))
+        self.assertEqual(8, len(striped_lock._locks))
+
+    @mock.patch.dict(locks._LOCKS, clear=True)
+    def test_locked(self):
+        striped_lock = locks.get({})
+
+        class Driver(object):
+            _config = {}
+
+            @locks.locked
+            def set_power_state(self, identity, state):
+                return identity, state
+
+        self.assertEqual(('id', 'On'),
+                         Driver().set_power_state('id', 'On'))
+        self.assertEqual(1, striped_lock.stats['acquired'])
@@ -158,6 +158,8 @@ class ChassisTestCase(EmulatorTestCase):
         chassis_mock.chassis = [self.uuid]
         chassis_mock.uuid.return_value = self.uuid
         systems_mock.return_value.systems = ['sys1']
+        systems_mock.return_value.get_metrics.side_effect = (
+            error.NotSupportedError)
 
         response = self.app.get('/redfish/v1/Chassis/xxxx-yyyy-zzzz/Thermal')
 
@@ -176,6 +178,92 @@ class ChassisTestCase(EmulatorTestCase):
             {'@odata.id': '/redfish/v1/Chassis/xxxx-yyyy-zzzz'},
             response.json['Fans'][0]['RelatedItem'][0])
 
+        self.assertEqual(41,
+                         response.json['Temperatures'][0]['ReadingCelsius'])
+
+    @patch_resource('systems')
+    @patch_resource('chassis')
+    def test_chassis_thermal_metrics(self, chassis_mock, systems_mock):
+        chassis_mock = chassis_mock.return_value
+        chassis_mock.chassis = [self.uuid]
+        chassis_mock.uuid.return_value = self.uuid
+        systems_mock.return_value.systems = ['sys1']
+        systems_mock.return_value.get_metrics.return_value = {
+            'cpu_temperature_celsius': 38.5}
+
+        response = self.app.get('/redfish/v1/Chassis/xxxx-yyyy-zzzz/Thermal')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(38.5,
+                         response.json['Temperatures'][0]['ReadingCelsius'])
+        systems_mock.return_value.get_metrics.assert_called_once_with('sys1')
+
+    @patch_resource('systems')
+    @patch_resource('chassis')
+    def test_chassis_power(self, chassis_mock, systems_mock):
+        chassis_mock = chassis_mock.return_value
+        chassis_mock.chassis = [self.uuid]
+        chassis_mock.uuid.return_value = self.uuid
+        systems_mock.return_value.systems = ['sys1']
+        systems_mock.return_value.get_metrics.return_value = {
+            'power_watts': 75, 'power_watts_min': 60,
+            'power_watts_max': 90, 'power_watts_average': 72,
+            'interval_minutes': 1}
+
+        response = self.app.get('/redfish/v1/Chassis/xxxx-yyyy-zzzz/Power')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('Power', response.json['Id'])
+        control = response.json['PowerControl'][0]
+        self.assertEqual(
+            '/redfish/v1/Chassis/xxxx-yyyy-zzzz/Power#/PowerControl/0',
+            control['@odata.id'])
+        self.assertEqual(75, control['PowerConsumedWatts'])
+        self.assertEqual({'IntervalInMin': 1, 'MinConsumedWatts': 60,
+                          'MaxConsumedWatts': 90,
+                          'AverageConsumedWatts': 72},
+                         control['PowerMetrics'])
+        self.assertEqual([{'@odata.id': '/redfish/v1/Systems/sys1'}],
+                         control['RelatedItem'])
+
+    @patch_resource('systems')
+    @patch_resource('chassis')
+    def test_chassis_power_not_supported(self, chassis_mock, systems_mock):
+        chassis_mock = chassis_mock.return_value
+        chassis_mock.chassis = [self.uuid]
+        chassis_mock.uuid.return_value = self.uuid
+        systems_mock.return_value.systems = ['sys1']
+        systems_mock.return_value.get_metrics.side_effect = (
+            error.NotSupportedError)
+
+        response = self.app.get('/redfish/v1/Chassis/xxxx-yyyy-zzzz/Power')
+
+        self.assertEqual(200, response.status_code)
+        control = response.json['PowerControl'][0]
+        self.assertEqual(60, control['PowerConsumedWatts'])
+        self.assertNotIn('PowerMetrics', control)
+
+    @patch_resource('systems')
+    @patch_resource('chassis')
+    def test_chassis_power_metrics_failure(self, chassis_mock, systems_mock):
+        chassis_mock = chassis_mock.return_value
+        chassis_mock.chassis = [self.uuid]
+        chassis_mock.uuid.return_value = self.uuid
+        systems_mock.return_value.systems = ['sys1', 'sys2']
+        systems_mock.return_value.get_metrics.side_effect = [
+            error.NotFound('gone'),
+            {'power_watts': 80, 'power_watts_min': 60,
+             'power_watts_max': 90, 'power_watts_average': 72,
+             'interval_minutes': 1}]
+
+        response = self.app.get('/redfish/v1/Chassis/xxxx-yyyy-zzzz/Power')
+
+        self.assertEqual(200, response.status_code)
+        controls = response.json['PowerControl']
+        self.assertEqual(60, controls[0]['PowerConsumedWatts'])
+        self.assertNotIn('PowerMetrics', controls[0])
+        self.assertEqual(80, controls[1]['PowerConsumedWatts'])
+
     @patch_resource('indicators')
     @patch_resource('chassis')
     def test_chassis_indicator_set_ok(self, chassis_mock, indicators_mock):
@@ -348,6 +436,10 @@ class SystemsTestCase(EmulatorTestCase):
         self.assertEqual(
             {'@odata.id': '/redfish/v1/Systems/xxxx-yyyy-zzzz/VirtualMedia'},
             response.json['VirtualMedia'])
+        self.assertEqual(
+            {'@odata.id': '/redfish/v1/Systems/xxxx-yyyy-zzzz/MemorySummary/'
+                          'MemoryMetrics'},
+            response.json['MemorySummary']['Metrics'])
 
     @patch_resource('indicators')
     @patch_resource('chassis')
@@ -583,6 +675,70 @@ class SystemsTestCase(EmulatorTestCase):
                                   json=data)
         self.assertEqual(400, response.status_code)
 
+    @patch_resource('systems')
+    def test_processor_metrics(self, systems_mock):
+        systems_mock = systems_mock.return_value
+        systems_mock.get_processors.return_value = [
+            {'id': 'CPU0'}, {'id': 'CPU1'}]
+        systems_mock.get_metrics.return_value = {
+            'cpu_utilization': 30.0, 'vcpu_utilization': [20.0, 40.0],
+            'cpu_temperature_celsius': 36.8, 'power_watts': 69}
+
+        response = self.app.get(
+            '/redfish/v1/Systems/xxxx-yyyy-zzzz/Processors/CPU1/'
+            'ProcessorMetrics')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(40.0, response.json['BandwidthPercent'])
+        self.assertEqual(36.8, response.json['TemperatureCelsius'])
+        self.assertEqual(69, response.json['ConsumedPowerWatt'])
+
+    @patch_resource('systems')
+    def test_processor_metrics_not_supported(self, systems_mock):
+        systems_mock = systems_mock.return_value
+        systems_mock.get_processors.return_value = [{'id': 'CPU0'}]
+        systems_mock.get_metrics.side_effect = error.NotSupportedError
+
+        response = self.app.get(
+            '/redfish/v1/Systems/xxxx-yyyy-zzzz/Processors/CPU0/'
+            'ProcessorMetrics')
+
+        self.assertEqual(501, response.status_code)
+
+    @patch_resource('systems')
+    def test_processor_advertises_metrics(self, systems_mock):
+        systems_mock = systems_mock.return_value
+        systems_mock.get_processors.return_value = [
+            {'id': 'CPU0', 'socket': 'CPU 0', 'vendor': 'Intel',
+             'model': 'Model', 'cores': '1', 'threads': '1'}]
+        systems_mock.get_metrics.return_value = {}
+
+        response = self.app.get(
+            '/redfish/v1/Systems/xxxx-yyyy-zzzz/Processors/CPU0')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            {'@odata.id': '/redfish/v1/Systems/xxxx-yyyy-zzzz/Processors/'
+                          'CPU0/ProcessorMetrics'},
+            response.json['Metrics'])
+        self.assertEqual(
+            '/redfish/v1/Systems/xxxx-yyyy-zzzz/Processors/CPU0',
+            response.json['@odata.id'])
+
+    @patch_resource('systems')
+    def test_memory_metrics(self, systems_mock):
+        systems_mock.return_value.get_metrics.return_value = {
+            'memory_used_mib': 512, 'memory_total_mib': 1024,
+            'memory_utilization': 50.0}
+
+        response = self.app.get(
+            '/redfish/v1/Systems/xxxx-yyyy-zzzz/MemorySummary/MemoryMetrics')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'UtilizationPercent': 50.0, 'UsedMiB': 512,
+                          'CapacityMiB': 1024},
+                         response.json['Oem']['Sushy'])
+
 
 @patch_resource('systems')
 class BiosTestCase(EmulatorTestCase):
@@ -13,8 +13,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
 import pickle
 import sqlite3
+import tempfile
+import time
 from unittest import mock
 
 from oslotest import base
@@ -84,43 +87,150 @@ class MemoizeTestCase(base.BaseTestCase):
         # Due to permanent cache, expect no more calls
         self.assertEqual(0, driver.call_count)
 
+    def test_argument_order(self):
+
+        class Driver(object):
+
+            @memoize.memoize()
+            def fun(self, *args, **kwargs):
+                return args, kwargs
+
+        driver = Driver()
+
+        self.assertEqual(((1, 2), {}), driver.fun(1, 2))
+        self.assertEqual(((2, 1), {}), driver.fun(2, 1))
+        self.assertEqual(((), {'x': 1}), driver.fun(x=1))
+        self.assertEqual(((), {'x': 2}), driver.fun(x=2))
+        self.assertEqual(
+            {'hits': 0, 'misses': 4, 'evictions': 0, 'size': 4},
+            memoize.cache_info(driver.fun))
+
+    def test_max_size(self):
+
+        class Driver(object):
+            call_count = 0
+
+            @memoize.memoize(max_size=2)
+            def fun(self, arg):
+                self.call_count += 1
+                return arg
+
+        driver = Driver()
+
+        driver.fun(1)
+        driver.fun(2)
+        driver.fun(1)
+        driver.fun(3)
+
+        # 2 is the least recently used one
+        driver.fun(1)
+        self.assertEqual(3, driver.call_count)
+        driver.fun(2)
+        self.assertEqual(4, driver.call_count)
+
+        self.assertEqual(
+            {'hits': 2, 'misses': 4, 'evictions': 2, 'size': 2},
+            memoize.cache_info(driver.fun))
+
+    @mock.patch('time.monotonic', autospec=True)
+    def test_ttl(self, mock_monotonic):
+
+        class Driver(object):
+            call_count = 0
+
+            @memoize.memoize(ttl=10)
+            def fun(self, arg):
+                self.call_count += 1
+                return arg
+
+        driver = Driver()
+
+        mock_monotonic.return_value = 100
+        driver.fun(1)
+        mock_monotonic.return_value = 109
+        driver.fun(1)
+        self.assertEqual(1, driver.call_count)
+
+        mock_monotonic.return_value = 110
+        driver.fun(1)
+        self.assertEqual(2, driver.call_count)
+
+        self.assertEqual(
+            {'hits': 1, 'misses': 2, 'evictions': 1, 'size': 1},
+            memoize.cache_info(driver.fun))
+
+    def test_invalidate(self):
+
+        class Driver(object):
+            call_count = 0
+
+            @memoize.memoize()
+            def fun(self, arg, readonly=False):
+                self.call_count += 1
+                return arg
+
+        driver = Driver()
+
+        driver.fun(1)
+        driver.fun(2, readonly=True)
+
+        memoize.invalidate(driver.fun, 2, readonly=True)
+        driver.fun(1)
+        driver.fun(2, readonly=True)
+        self.assertEqual(3, driver.call_count)
+
+        memoize.invalidate(driver.fun)
+        driver.fun(1)
+        self.assertEqual(4, driver.call_count)
+
 
 @mock.patch.object(sqlite3, 'connect', autospec=True)
 class PersistentDictTestCase(base.BaseTestCase):
 
+    def _make_permanent(self, pd, mock_sqlite3):
+        mock_conn = mock_sqlite3.return_value.__enter__.return_value
+        mock_conn.cursor.return_value.fetchone.return_value = ('json',)
+        pd.make_permanent('/', 'file')
+
     def test_make_permanent(self, mock_sqlite3):
         pd = memoize.PersistentDict()
-        pd.make_permanent('/', 'file')
+        self._make_permanent(pd, mock_sqlite3)
         mock_sqlite3.assert_called_once_with('/file.sqlite')
 
     def test_encode(self, mock_sqlite3):
         pd = memoize.PersistentDict()
         value = pd.encode({1: '2'})
-        self.assertEqual(pickle.dumps({1: '2'}), value)
+        self.assertEqual('{"!d":[[1,"2"]]}', value)
 
     def test_decode(self, mock_sqlite3):
         pd = memoize.PersistentDict()
-        value = pd.decode(pickle.dumps({1: '2'}))
+        value = pd.decode('{"!d":[[1,"2"]]}')
         self.assertEqual({1: '2'}, value)
 
+    def test_pickle_codec(self, mock_sqlite3):
+        pd = memoize.PersistentDict(codec='pickle')
+        value = pd.encode({1: '2'})
+        self.assertEqual(pickle.dumps({1: '2'}), value)
+        self.assertEqual({1: '2'}, pd.decode(value))
+
     def test___getitem__(self, mock_sqlite3):
         pd = memoize.PersistentDict()
-        pd.make_permanent('/', 'file')
+        self._make_permanent(pd, mock_sqlite3)
 
         mock_conn = mock_sqlite3.return_value.__enter__.return_value
         mock_cursor = mock_conn.cursor.return_value
         mock_cursor.execute.reset_mock()
-        mock_cursor.fetchone.return_value = [pickle.dumps('pickled-value')]
+        mock_cursor.fetchone.return_value = [pd.encode('pickled-value')]
 
         result = pd[1]
         self.assertEqual('pickled-value', result)
 
         mock_cursor.execute.assert_called_with(
-            'select value from cache where key=?', (pickle.dumps(1),))
+            'select value from cache where key=?', (pd.encode(1),))
 
     def test___getitem__retries(self, mock_sqlite3):
         pd = memoize.PersistentDict()
-        pd.make_permanent('/', 'file')
+        self._make_permanent(pd, mock_sqlite3)
 
         mock_conn = mock_sqlite3.return_value.__enter__.return_value
         mock_cursor = mock_conn.cursor.return_value
@@ -129,18 +239,18 @@ class PersistentDictTestCase(base.BaseTestCase):
             sqlite3.OperationalError,
             None
         ]
-        mock_cursor.fetchone.return_value = [pickle.dumps('pickled-value')]
+        mock_cursor.fetchone.return_value = [pd.encode('pickled-value')]
 
         result = pd[1]
         self.assertEqual('pickled-value', result)
 
         mock_cursor.execute.assert_called_with(
-            'select value from cache where key=?', (pickle.dumps(1),))
+            'select value from cache where key=?', (pd.encode(1),))
         self.assertEqual(2, mock_cursor.execute.call_count)
 
     def test___setitem__(self, mock_sqlite3):
         pd = memoize.PersistentDict()
-        pd.make_permanent('/', 'file')
+        self._make_permanent(pd, mock_sqlite3)
 
         mock_conn = mock_sqlite3.return_value.__enter__.return_value
         mock_cursor = mock_conn.cursor.return_value
@@ -150,11 +260,11 @@ class PersistentDictTestCase(base.BaseTestCase):
 
         mock_cursor.execute.assert_called_once_with(
             'insert or replace into cache values (?, ?)',
-            (pickle.dumps(1), pickle.dumps(2)))
+            (pd.encode(1), pd.encode(2)))
 
     def test___setitem__retries(self, mock_sqlite3):
         pd = memoize.PersistentDict()
-        pd.make_permanent('/', 'file')
+        self._make_permanent(pd, mock_sqlite3)
 
         mock_conn = mock_sqlite3.return_value.__enter__.return_value
         mock_cursor = mock_conn.cursor.return_value
@@ -168,12 +278,12 @@ class PersistentDictTestCase(base.BaseTestCase):
 
         mock_cursor.execute.assert_called_with(
             'insert or replace into cache values (?, ?)',
-            (pickle.dumps(1), pickle.dumps(2)))
+            (pd.encode(1), pd.encode(2)))
         self.assertEqual(2, mock_cursor.execute.call_count)
 
     def test___delitem__(self, mock_sqlite3):
         pd = memoize.PersistentDict()
-        pd.make_permanent('/', 'file')
+        self._make_permanent(pd, mock_sqlite3)
 
         mock_conn = mock_sqlite3.return_value.__enter__.return_value
         mock_cursor = mock_conn.cursor.return_value
@@ -182,11 +292,11 @@ class PersistentDictTestCase(base.BaseTestCase):
         del pd[1]
 
         mock_cursor.execute.assert_called_once_with(
-            'delete from cache where key=?', (pickle.dumps(1),))
+            'delete from cache where key=?', (pd.encode(1),))
 
     def test___delitem__fails(self, mock_sqlite3):
         pd = memoize.PersistentDict()
-        pd.make_permanent('/', 'file')
+        self._make_permanent(pd, mock_sqlite3)
 
         mock_conn = mock_sqlite3.return_value.__enter__.return_value
         mock_cursor = mock_conn.cursor.return_value
@@ -199,16 +309,16 @@ class PersistentDictTestCase(base.BaseTestCase):
         self.assertRaises(KeyError, _del)
 
         mock_cursor.execute.assert_called_once_with(
-            'delete from cache where key=?', (pickle.dumps(1),))
+            'delete from cache where key=?', (pd.encode(1),))
 
     def test___iter__(self, mock_sqlite3):
         pd = memoize.PersistentDict()
-        pd.make_permanent('/', 'file')
+        self._make_permanent(pd, mock_sqlite3)
 
         mock_conn = mock_sqlite3.return_value.__enter__.return_value
         mock_cursor = mock_conn.cursor.return_value
         mock_cursor.execute.reset_mock()
-        mock_cursor.fetchall.return_value = [[pickle.dumps('pickled-key')]]
+        mock_cursor.fetchall.return_value = [[pd.encode('pickled-key')]]
 
         self.assertEqual(['pickled-key'], list(iter(pd)))
 
@@ -216,7 +326,7 @@ class PersistentDictTestCase(base.BaseTestCase):
 
     def test___len__(self, mock_sqlite3):
         pd = memoize.PersistentDict()
-        pd.make_permanent('/', 'file')
+        self._make_permanent(pd, mock_sqlite3)
 
         mock_conn = mock_sqlite3.return_value.__enter__.return_value
         mock_cursor = mock_conn.cursor.return_value
@@ -227,3 +337,389 @@ class PersistentDictTestCase(base.BaseTestCase):
 
         mock_cursor.execute.assert_called_once_with(
             'select count(*) from cache')
+
+    def test_items(self, mock_sqlite3):
+        pd = memoize.PersistentDict()
+        self._make_permanent(pd, mock_sqlite3)
+
+        mock_conn = mock_sqlite3.return_value.__enter__.return_value
+        mock_cursor = mock_conn.cursor.return_value
+        mock_cursor.execute.reset_mock()
+        mock_cursor.fetchall.return_value = [
+            [pd.encode('key'), pd.encode('value')]]
+
+        self.assertEqual([('key', 'value')], pd.items())
+
+        mock_cursor.execute.assert_called_once_with(
+            'select key, value from cache')
+
+    def test_update(self, mock_sqlite3):
+        pd = memoize.PersistentDict()
+        self._make_permanent(pd, mock_sqlite3)
+
+        mock_conn = mock_sqlite3.return_value.__enter__.return_value
+        mock_cursor = mock_conn.cursor.return_value
+
+        pd.update({1: 2}, k=3)
+
+        mock_cursor.executemany.assert_called_once_with(
+            'insert or replace into cache values (?, ?)',
+            [(pd.encode(1), pd.encode(2)),
+             (pd.encode('k'), pd.encode(3))])
+
+
+class PersistentDictReadCacheTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        dbpath = tempfile.mkdtemp()
+        self.pd = memoize.PersistentDict()
+        self.pd.make_permanent(dbpath, 'file')
+        # as if in another process
+        self.other_pd = memoize.PersistentDict()
+        self.other_pd.make_permanent(dbpath, 'file')
+
+    def test_read_cache(self):
+        self.pd['a'] = {'x': 1}
+        self.assertEqual({'x': 1}, self.pd['a'])
+
+        with mock.patch.object(self.pd, 'connection',
+                               autospec=True) as mock_connection:
+            value = self.pd['a']
+
+        self.assertEqual({'x': 1}, value)
+        mock_connection.assert_not_called()
+
+        # a private copy
+        value['x'] = 2
+        self.assertEqual({'x': 1}, self.pd['a'])
+
+    def test_read_cache_invalidated(self):
+        self.pd['a'] = 1
+        self.pd['b'] = 2
+        self.assertEqual(1, self.pd['a'])
+        self.assertEqual(2, self.pd['b'])
+
+        self.other_pd['a'] = 3
+        del self.other_pd['b']
+
+        self.assertEqual(3, self.pd['a'])
+        self.assertRaises(KeyError, lambda: self.pd['b'])
+
+        self.pd['a'] = 4
+
+        self.assertEqual(4, self.pd['a'])
+        self.assertEqual(4, self.other_pd['a'])
+
+    def test_write(self):
+        self.pd['a'] = 1
+        self.pd['b'] = 2
+
+        self.pd.write({'a': 3, 'c': 4}, ['b', 'd'])
+
+        self.assertEqual({'a': 3, 'c': 4}, dict(self.other_pd.items()))
+
+
+class PersistentDictMigrationTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dbpath = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.dbpath, 'file.sqlite')
+
+    def _records(self):
+        with sqlite3.connect(self.dbfile) as connection:
+            return sorted(connection.execute('select key, value from cache'))
+
+    def test_migrate_legacy(self):
+        with sqlite3.connect(self.dbfile) as connection:
+            connection.execute(
+                'create table cache '
+                '(key blob primary key not null, value blob not null)')
+            connection.execute(
+                'insert into cache values (?, ?)',
+                (pickle.dumps(('id', 'Cd')), pickle.dumps({'Inserted': True})))
+
+        pd = memoize.PersistentDict()
+        pd.make_permanent(self.dbpath, 'file')
+
+        self.assertEqual({'Inserted': True}, pd[('id', 'Cd')])
+        self.assertEqual([('{"!t":["id","Cd"]}', '{"Inserted":true}')],
+                         self._records())
+
+        # converted once
+        pd = memoize.PersistentDict()
+        pd.make_permanent(self.dbpath, 'file')
+
+        self.assertEqual({'Inserted': True}, pd[('id', 'Cd')])
+
+    def test_migrate_codec(self):
+        pd = memoize.PersistentDict()
+        pd.make_permanent(self.dbpath, 'file')
+        pd['a'] = {1, 2}
+
+        pd = memoize.PersistentDict(codec='pickle')
+        pd.make_permanent(self.dbpath, 'file')
+
+        self.assertEqual({1, 2}, pd['a'])
+        self.assertEqual([(pickle.dumps('a'), pickle.dumps({1, 2}))],
+                         self._records())
+
+    def test_current_codec_not_locked(self):
+        pd = memoize.PersistentDict()
+        pd.make_permanent(self.dbpath, 'file')
+        pd['a'] = 1
+
+        # another process holds the write lock
+        connection = sqlite3.connect(self.dbfile, isolation_level=None)
+        self.addCleanup(connection.close)
+        connection.execute('begin immediate')
+
+        pd = memoize.PersistentDict()
+        pd.make_permanent(self.dbpath, 'file')
+
+        self.assertEqual(1, pd['a'])
+
+    def test_unknown_codec(self):
+        pd = memoize.PersistentDict()
+        pd.make_permanent(self.dbpath, 'file')
+
+        with sqlite3.connect(self.dbfile) as connection:
+            connection.execute("update meta set value='xml'")
+
+        self.assertRaises(TypeError, pd.make_permanent, self.dbpath, 'file')
+
+
+class WriteBackDictTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = {'a': {'x': 1}}
+        self.wbd = memoize.WriteBackDict(self.store, 3600)
+        self.addCleanup(self.wbd.close)
+
+    def test_get(self):
+        self.assertEqual({'x': 1}, self.wbd['a'])
+        self.assertEqual(['a'], list(self.wbd))
+        self.assertEqual(1, len(self.wbd))
+
+    def test_get_copy(self):
+        self.wbd['a']['x'] = 2
+
+        self.assertEqual({'x': 1}, self.wbd['a'])
+
+    def test_initial_data(self):
+        wbd = memoize.WriteBackDict(self.store, 3600, data={'b': 2})
+        self.addCleanup(wbd.close)
+
+        self.assertEqual({'b': 2}, dict(wbd))
+
+    def test_flush(self):
+        self.wbd['a'] = {'x': 2}
+        self.wbd['b'] = {'y': 1}
+        self.assertEqual({'a': {'x': 1}}, self.store)
+
+        self.wbd.flush()
+
+        self.assertEqual({'a': {'x': 2}, 'b': {'y': 1}}, self.store)
+
+    def test_flush_deleted(self):
+        del self.wbd['a']
+        self.assertIn('a', self.store)
+
+        self.wbd.flush()
+
+        self.assertEqual({}, self.store)
+
+    def test_flush_batched(self):
+        store = mock.MagicMock(spec=memoize.PersistentDict)
+        store.items.return_value = [('a', 1), ('b', 2)]
+        wbd = memoize.WriteBackDict(store, 3600)
+        self.addCleanup(wbd.close)
+        wbd['a'] = 3
+        del wbd['b']
+
+        wbd.flush()
+
+        store.write.assert_called_once_with({'a': 3}, {'b'})
+        store.update.assert_not_called()
+        store.pop.assert_not_called()
+
+    def test_flush_fails(self):
+        store = mock.MagicMock(spec=dict)
+        store.items.return_value = []
+        store.update.side_effect = [sqlite3.OperationalError, None]
+        wbd = memoize.WriteBackDict(store, 3600)
+        self.addCleanup(wbd.close)
+        wbd['a'] = 1
+
+        self.assertRaises(sqlite3.OperationalError, wbd.flush)
+        wbd.flush()
+
+        store.update.assert_called_with({'a': 1})
+
+    def test_close(self):
+        self.wbd['a'] = {'x': 2}
+
+        self.wbd.close()
+
+        self.assertEqual({'a': {'x': 2}}, self.store)
+        self.assertFalse(self.wbd._thread.is_alive())
+
+    def test_interval(self):
+        wbd = memoize.WriteBackDict(self.store, 0.01)
+        self.addCleanup(wbd.close)
+        wbd['b'] = 1
+
+        for _ in range(500):
+            if 'b' in self.store:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(1, self.store['b'])
+
+
+class SharedCacheTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.config = {'SUSHY_EMULATOR_SHARED_CACHE': True,
+                       'SUSHY_EMULATOR_STATE_DIR': tempfile.mkdtemp()}
+        patcher = mock.patch.dict(memoize._SHARED, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.shared_cache = memoize.get_shared(self.config)
+
+    def test_get_shared(self):
+        self.assertIs(self.shared_cache, memoize.get_shared(self.config))
+        self.assertIsNone(memoize.get_shared({}))
+
+    def test_put_get(self):
+        self.shared_cache.put('scope', ('a',), {'x': 1}, 0)
+
+        self.assertEqual({'x': 1}, self.shared_cache.get('scope', ('a',)))
+        self.assertRaises(KeyError, self.shared_cache.get, 'scope', ('b',))
+        self.assertRaises(KeyError, self.shared_cache.get, 'other', ('a',))
+
+    @mock.patch('time.time', autospec=True)
+    def test_ttl(self, mock_time):
+        mock_time.return_value = 100
+        self.shared_cache.put('scope', ('a',), 1, 0, ttl=10)
+
+        mock_time.return_value = 109
+        self.assertEqual(1, self.shared_cache.get('scope', ('a',)))
+        mock_time.return_value = 110
+        self.assertRaises(KeyError, self.shared_cache.get, 'scope', ('a',))
+
+    def test_invalidate(self):
+        self.shared_cache.put('scope', ('a',), 1, 0)
+        self.shared_cache.put('scope', ('b',), 2, 0)
+
+        self.shared_cache.invalidate('scope', ('a',))
+
+        self.assertEqual(1, self.shared_cache.generation('scope'))
+        self.assertRaises(KeyError, self.shared_cache.get, 'scope', ('a',))
+        # looked up before invalidation
+        self.assertRaises(KeyError, self.shared_cache.get, 'scope', ('b',))
+        self.shared_cache.put('scope', ('b',), 3, 1)
+        self.assertEqual(3, self.shared_cache.get('scope', ('b',)))
+
+        self.shared_cache.invalidate('scope')
+
+        self.assertEqual(2, self.shared_cache.generation('scope'))
+        self.assertRaises(KeyError, self.shared_cache.get, 'scope', ('b',))
+
+    def test_generation_cached(self):
+        self.assertEqual(0, self.shared_cache.generation('scope'))
+
+        with mock.patch.object(self.shared_cache, 'connection',
+                               autospec=True) as mock_connection:
+            self.assertEqual(0, self.shared_cache.generation('scope'))
+
+        mock_connection.assert_not_called()
+
+        # invalidated by another process
+        memoize.SharedCache(self.shared_cache._path).invalidate('scope')
+
+        self.assertEqual(1, self.shared_cache.generation('scope'))
+
+    def _count(self, scope):
+        with self.shared_cache.connection() as cursor:
+            cursor.execute(
+                'select count(*) from entries where scope=?', (scope,))
+            return cursor.fetchone()[0]
+
+    @mock.patch('time.time', autospec=True)
+    def test_put_purges(self, mock_time):
+        mock_time.return_value = 100
+        self.shared_cache.put('scope', ('a',), 1, 0, ttl=10)
+        self.shared_cache.put('scope', ('b',), 2, 0)
+        self.shared_cache.put('other', ('a',), 3, 0, ttl=10)
+
+        mock_time.return_value = 110
+        self.shared_cache.put('scope', ('c',), 4, 0)
+
+        self.assertEqual(2, self.shared_cache.get('scope', ('b',)))
+        self.assertEqual(2, self._count('scope'))
+        self.assertEqual(1, self._count('other'))
+
+        self.shared_cache.invalidate('scope', ('c',))
+        self.shared_cache.put('scope', ('d',), 5, 1)
+
+        self.assertEqual(5, self.shared_cache.get('scope', ('d',)))
+        self.assertEqual(1, self._count('scope'))
+
+    def test_put_max_size(self):
+        self.shared_cache.put('scope', ('a',), 1, 0, max_size=2)
+        self.shared_cache.put('scope', ('b',), 2, 0, max_size=2)
+        self.shared_cache.put('scope', ('a',), 3, 0, max_size=2)
+        self.shared_cache.put('scope', ('c',), 4, 0, max_size=2)
+
+        self.assertEqual(2, self._count('scope'))
+        self.assertRaises(KeyError, self.shared_cache.get, 'scope', ('b',))
+        self.assertEqual(3, self.shared_cache.get('scope', ('a',)))
+        self.assertEqual(4, self.shared_cache.get('scope', ('c',)))
+
+    def test_memoize(self):
+        config = self.config
+
+        class Driver(object):
+            _config = config
+            call_count = 0
+
+            @memoize.memoize(shared=True)
+            def fun(self, arg):
+                self.call_count += 1
+                return [arg]
+
+        # drivers of two processes
+        driver, other_driver = Driver(), Driver()
+
+        self.assertEqual([1], driver.fun(1))
+        self.assertEqual([1], other_driver.fun(1))
+        self.assertEqual(1, driver.call_count)
+        self.assertEqual(0, other_driver.call_count)
+
+        memoize.invalidate(driver.fun, 1)
+
+        self.assertEqual([1], other_driver.fun(1))
+        self.assertEqual(1, other_driver.call_count)
+        self.assertEqual([1], driver.fun(1))
+        self.assertEqual(1, driver.call_count)
+
+    def test_memoize_codec(self):
+        config = self.config
+
+        class Driver(object):
+            _config = config
+
+            @memoize.memoize(shared=(lambda driver, value: value[0],
+                                     lambda driver, data: [data]))
+            def fun(self, arg):
+                return [arg]
+
+        Driver().fun(1)
+
+        self.assertEqual(
+            1, self.shared_cache.get(Driver.fun.scope, ((1,), ())))
+        self.assertEqual([1], Driver().fun(1))
@@ -0,0 +1,131 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+from unittest import mock
+
+from oslotest import base
+
+from sushy_tools.emulator import profiles
+from sushy_tools import error
+
+
+class LatencyTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rng = random.Random(42)
+
+    def _samples(self, spec, count=1000):
+        latency = profiles.Latency(spec, self.rng)
+        return [latency.sample() for _ in range(count)]
+
+    def test_fixed(self):
+        self.assertEqual([0.5] * 10,
+                         self._samples({'distribution': 'fixed',
+                                        'value': 0.5}, 10))
+
+    def test_uniform(self):
+        samples = self._samples(
+            {'distribution': 'uniform', 'min': 0.1, 'max': 0.2})
+
+        self.assertTrue(all(0.1 <= sample <= 0.2 for sample in samples))
+
+    def test_lognormal(self):
+        samples = sorted(self._samples(
+            {'distribution': 'lognormal', 'median': 0.5, 'sigma': 0.5}))
+
+        self.assertAlmostEqual(0.5, samples[len(samples) // 2], delta=0.05)
+
+    def test_histogram(self):
+        samples = self._samples(
+            {'distribution': 'histogram',
+             'buckets': [[0.1, 0], [0.2, 9], [1.0, 1]]})
+
+        self.assertTrue(all(0.1 <= sample <= 1.0 for sample in samples))
+        self.assertLess(800, len([sample for sample in samples
+                                  if sample <= 0.2]))
+
+    def test_unknown(self):
+        self.assertRaises(error.FishyError, profiles.Latency,
+                          {'distribution': 'gamma'})
+
+    def test_invalid(self):
+        self.assertRaises(error.FishyError, profiles.Latency,
+                          {'distribution': 'uniform', 'min': 0.1})
+        self.assertRaises(error.FishyError, profiles.Latency,
+                          {'distribution': 'histogram', 'buckets': []})
+
+
+@mock.patch('time.sleep', autospec=True)
+class ProfilesTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rng = mock.Mock(spec=random.Random)
+        self.rng.random.return_value = 0.5
+        self.profiles = profiles.Profiles([
+            {
+                'systems': ['slow-*'],
+                'methods': {
+                    'set_power_state': {
+                        'latency': {'distribution': 'fixed', 'value': 2},
+                        'error_rate': 0.6,
+                        'error_code': 503,
+                    },
+                },
+            },
+            {
+                'methods': {
+                    '*': {'latency': {'distribution': 'fixed', 'value': 1}},
+                },
+            },
+        ], self.rng)
+
+    def test_apply(self, mock_sleep):
+        exc = self.assertRaises(error.FishyError, self.profiles.apply,
+                                'set_power_state', 'slow-1')
+
+        self.assertEqual(503, exc.code)
+        mock_sleep.assert_called_once_with(2.0)
+
+    def test_apply_no_error(self, mock_sleep):
+        self.rng.random.return_value = 0.7
+
+        self.profiles.apply('set_power_state', 'slow-1')
+
+        mock_sleep.assert_called_once_with(2.0)
+
+    def test_apply_fallback(self, mock_sleep):
+        self.profiles.apply('get_power_state', 'slow-1')
+        self.profiles.apply('set_power_state', 'fast-1')
+
+        self.assertEqual([mock.call(1.0)] * 2, mock_sleep.call_args_list)
+
+    def test_load(self, mock_sleep):
+        self.assertIsNone(profiles.load({}))
+        self.assertIsInstance(
+            profiles.load({'SUSHY_EMULATOR_FAKE_PROFILES': [{}]}),
+            profiles.Profiles)
+
+    def test_profiled(self, mock_sleep):
+
+        class Driver(object):
+            _profiles = self.profiles
+
+            @profiles.profiled
+            def set_power_state(self, identity, state):
+                return identity, state
+
+        self.assertEqual(('fast-1', 'On'),
+                         Driver().set_power_state('fast-1', 'On'))
+        mock_sleep.assert_called_once_with(1.0)
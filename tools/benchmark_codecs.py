@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compare the PersistentDict codecs
+
+Encodes and decodes virtual media and fake driver records with every codec
+in `memoize.CODECS`, and stores them in an sqlite database to measure its
+size on disk.
+
+Usage: python tools/benchmark_codecs.py [--records N]
+"""
+
+import argparse
+import os
+import tempfile
+import timeit
+
+from sushy_tools.emulator import memoize
+from sushy_tools.emulator.resources.systems import fakedriver
+
+
+def vmedia_records(count):
+    generator = fakedriver.SystemGenerator({'count': count})
+    for index in range(count):
+        yield (generator.uuid(index), 'Cd'), {
+            'Name': 'Virtual CD',
+            'MediaTypes': ['CD', 'DVD'],
+            'Image': 'http://images.example.com/boot-%d.iso' % index,
+            'ImageName': 'boot-%d.iso' % index,
+            'Inserted': True,
+            'WriteProtected': True,
+            'Verify': False,
+        }
+
+
+def fake_records(count):
+    generator = fakedriver.SystemGenerator({'count': count, 'nics': 2})
+    for index in range(count):
+        system = generator.generate(index)
+        system['generation'] = 3
+        system['pending_power'] = {'power_state': 'On', 'apply_time': 1.5,
+                                   'generation': 3}
+        yield system['uuid'], system
+
+
+def benchmark(codec, records, dbpath):
+    encoded = [(codec.encode(key), codec.encode(value))
+               for key, value in records]
+
+    encode_time = timeit.timeit(
+        lambda: [(codec.encode(key), codec.encode(value))
+                 for key, value in records], number=1)
+    decode_time = timeit.timeit(
+        lambda: [(codec.decode(key), codec.decode(value))
+                 for key, value in encoded], number=1)
+
+    store = memoize.PersistentDict(codec=codec.name)
+    store.make_permanent(dbpath, codec.name)
+    store.update(records)
+
+    # NOTE: move the records from the write-ahead log to the database file
+    with store.connection() as cursor:
+        cursor.execute('pragma wal_checkpoint(truncate)')
+
+    return {
+        'encode': len(records) / encode_time,
+        'decode': len(records) / decode_time,
+        'record': sum(len(key) + len(value)
+                      for key, value in encoded) / len(records),
+        'file': os.path.getsize(os.path.join(dbpath, codec.name + '.sqlite')),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--records', type=int, default=10000,
+                        help='number of records of each kind')
+    args = parser.parse_args()
+
+    print('%-8s %-7s %12s %12s %10s %12s' % (
+        'records', 'codec', 'encode/s', 'decode/s', 'bytes/rec', 'file'))
+
+    for kind, records in (('vmedia', vmedia_records),
+                          ('fake', fake_records)):
+        records = list(records(args.records))
+
+        for name, codec in sorted(memoize.CODECS.items()):
+            with tempfile.TemporaryDirectory() as dbpath:
+                result = benchmark(codec, records, dbpath)
+
+            print('%-8s %-7s %12.0f %12.0f %10.1f %12d' % (
+                kind, name, result['encode'], result['decode'],
+                result['record'], result['file']))
+
+
+if __name__ == '__main__':
+    main()